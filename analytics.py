@@ -0,0 +1,94 @@
+"""Код для расчета статистики без pandas.
+
+Итоги считаются в SQL, записи приходят из БД уже отсортированными,
+точки графиков читаются из курсора сразу в массивы NumPy.
+"""
+
+import io
+import os
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from db_functions import connections
+from exporter import parse_dates, write_sheet
+from metrics import timer
+
+# Больше точек на графике не рисуется (см. downsample)
+GRAPH_MAX_POINTS = int(os.getenv('GRAPH_MAX_POINTS', 60))
+
+Query = Callable[..., Tuple[str, tuple]]
+
+# Точка графика: дата записи и сумма
+POINT = np.dtype([('date', 'datetime64[s]'), ('amount', 'float64')])
+# Колонки и их ширина в таблицах статистики
+TABLE_HEADER = ['Дата', 'Сумма', 'Описание', 'Категория']
+TABLE_WIDTHS = [18, 12, 40, 15]
+INCOMES_HEADER = ['Дата', 'Сумма', 'Описание']
+INCOMES_WIDTHS = [18, 12, 40]
+
+
+def read_rows(query: Query, *args) -> List[tuple]:
+    """Строки параметризованного запроса query(*args)."""
+    sql, params = query(*args)
+    with timer('query', query.__name__):
+        return connections.reader().execute(sql, params).fetchall()
+
+
+def read_total(query: Query, *args) -> float:
+    """Итог запроса query(*args), считающего сумму в SQL."""
+    sql, params = query(*args)
+    with timer('query', query.__name__):
+        return connections.reader().execute(sql, params).fetchone()[0]
+
+
+def read_points(query: Query, *args) -> np.ndarray:
+    """Точки графика из запроса query(*args), возвращающего дату и сумму.
+
+    Строки не собираются в список: массив заполняется прямо из курсора.
+    """
+    sql, params = query(*args)
+    with timer('query', query.__name__):
+        return np.fromiter(connections.reader().execute(sql, params),
+                           dtype=POINT)
+
+
+def to_points(rows: Sequence[tuple]) -> np.ndarray:
+    """Точки графика из строк, начинающихся с даты и суммы."""
+    return np.fromiter(((row[0], row[1]) for row in rows), dtype=POINT,
+                       count=len(rows))
+
+
+def downsample(points: np.ndarray,
+               limit: int = GRAPH_MAX_POINTS) -> np.ndarray:
+    """Прореживание точек графика до limit алгоритмом LTTB.
+
+    Первая и последняя точки сохраняются, остальные делятся на limit - 2
+    групп, и из каждой берется точка, образующая наибольший треугольник
+    с уже выбранной точкой и средним следующей группы. Так сохраняются
+    пики и форма графика, а не только средние значения.
+    """
+    size = len(points)
+    if limit < 3 or size <= limit:
+        return points
+    x = points['date'].astype('int64').astype('float64')
+    y = points['amount']
+    edges = np.append(np.linspace(1, size - 1, limit - 1).astype(int), size)
+    selected = [0]
+    for start, end, next_end in zip(edges, edges[1:], edges[2:]):
+        previous = selected[-1]
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        selected.append(start + int(areas.argmax()))
+    selected.append(size - 1)
+    return points[selected]
+
+
+def to_xlsx(header: Sequence[str], rows: List[tuple],
+            widths: Sequence[int] = ()) -> bytes:
+    """Таблица XLSX в памяти; первая колонка строк - дата из БД."""
+    buffer = io.BytesIO()
+    write_sheet(buffer, header, [parse_dates(rows)], widths)
+    return buffer.getvalue()
@@ -0,0 +1,101 @@
+"""Код для приёма обновлений асинхронным ботом."""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from telebot import TeleBot, types
+from telebot.async_telebot import AsyncTeleBot
+
+from runtime import HANDLER_WORKERS, MAX_PENDING_UPDATES, get_chat_id
+from storage import AsyncStorage, storage
+
+# Больше обновлений за один getUpdates Telegram не отдает
+MAX_UPDATES_LIMIT = 100
+
+
+class AsyncRuntime(AsyncTeleBot):
+    """Асинхронный приём обновлений с пулом потоков для обработчиков.
+
+    Обновления получаются асинхронным ботом, а обработчики синхронного
+    бота выполняются в пуле асинхронного хранилища AsyncStorage, где у
+    каждого потока свое соединение для чтения: работа с БД и
+    построение графиков не блокируют цикл событий. Обновления одного
+    чата обрабатываются строго по очереди, разные чаты - параллельно.
+
+    Место для обновлений занимается до запроса getUpdates, и запрос
+    просит не больше обновлений, чем есть места: при заполненной
+    очереди бот перестает забирать обновления у Telegram.
+    """
+
+    def __init__(self, bot: TeleBot, workers: int = HANDLER_WORKERS,
+                 max_pending: int = MAX_PENDING_UPDATES) -> None:
+        super().__init__(token=bot.token)
+        self.sync_bot = bot
+        self.storage = AsyncStorage(storage, workers)
+        self.pending = asyncio.Semaphore(max_pending)
+        self.chat_tasks: Dict[int, asyncio.Task] = {}
+
+    async def get_updates(self, *args, **kwargs) -> List[types.Update]:
+        """Получение обновлений, когда для них есть место в очереди."""
+        reserved = await self.reserve(kwargs.get('limit')
+                                      or MAX_UPDATES_LIMIT)
+        kwargs['limit'] = reserved
+        updates: List[types.Update] = []
+        try:
+            updates = await super().get_updates(*args, **kwargs)
+        finally:
+            for _ in range(reserved - len(updates)):
+                self.pending.release()
+        return updates
+
+    async def reserve(self, limit: int) -> int:
+        """Занятие от 1 до limit мест: ожидается только первое."""
+        await self.pending.acquire()
+        reserved = 1
+        while reserved < limit and not self.pending.locked():
+            await self.pending.acquire()
+            reserved += 1
+        return reserved
+
+    async def process_new_updates(self, updates: List[types.Update]) -> None:
+        """Распределение обновлений по очередям чатов.
+
+        Места заняты в get_updates, и внутри нет точек ожидания, поэтому
+        пакеты распределяются целиком и в порядке получения.
+        """
+        for update in updates:
+            chat_id = get_chat_id(update)
+            if chat_id is None:
+                chat_id = -update.update_id
+            previous = self.chat_tasks.get(chat_id)
+            task = asyncio.create_task(self.handle_update(update, previous))
+            self.chat_tasks[chat_id] = task
+            task.add_done_callback(
+                lambda done, key=chat_id: self.release(key, done))
+
+    async def handle_update(self, update: types.Update,
+                            previous: Optional[asyncio.Task]) -> None:
+        """Обработка обновления после предыдущего обновления того же чата."""
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.storage.run(self.sync_bot.process_new_updates,
+                                   [update])
+        except Exception as error:
+            logging.exception(f'Ошибка при обработке обновления: {error}')
+
+    def release(self, chat_id: int, task: asyncio.Task) -> None:
+        """Освобождение места в очереди после обработки обновления."""
+        if self.chat_tasks.get(chat_id) is task:
+            del self.chat_tasks[chat_id]
+        self.pending.release()
+
+
+async def serve(bot: TeleBot) -> None:
+    """Приём обновлений до остановки бота."""
+    runtime = AsyncRuntime(bot)
+    try:
+        await runtime.infinity_polling()
+    finally:
+        runtime.storage.close()
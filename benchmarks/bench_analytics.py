@@ -0,0 +1,216 @@
+"""Бенчмарк подготовки статистики: pandas против SQL и NumPy.
+
+Добавляет пользователю --rows расходов за последний год и доходы
+за месяц во временной БД и для каждого вида статистики готовит данные
+двумя способами: как раньше (read_sql_query, to_datetime, to_numeric,
+sort_values, sum, to_excel) и через analytics.py. Построение графика
+не входит в замер, он одинаковый; вместо него считается размер
+аргументов, передаваемых в процесс построения. Выводит медиану
+времени по --repeat повторам и пик памяти Python (tracemalloc,
+отдельным проходом).
+
+    python benchmarks/bench_analytics.py --rows 100000 --period '-3 month'
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'bench_analytics.db'))
+
+import pandas as pd  # noqa: E402
+
+from analytics import (INCOMES_HEADER, INCOMES_WIDTHS,  # noqa: E402
+                       TABLE_HEADER, TABLE_WIDTHS, read_points, read_rows,
+                       read_total, to_points, to_xlsx)
+from database import create_tables  # noqa: E402
+from db_functions import (SQL_FOR_CHART, connections,  # noqa: E402
+                          sql_for_chart, sql_for_graph, sql_for_graph_incomes,
+                          sql_for_graph_total, sql_for_incomes_total,
+                          sql_for_table, sql_insert_category)
+
+USER_ID = 1
+CATEGORIES = ['Еда', 'Транспорт', 'Кафе', 'Связь', 'Дом', 'Здоровье']
+# Запросы статистики в том виде, в каком их читал pandas
+PANDAS_SQL = {
+    'table': '''
+        SELECT e.amount, e.description, e.date_added,
+            c.name AS category_name
+        FROM expenses e
+        JOIN categories c ON e.category_id = c.id
+        WHERE e.client_id = ? AND e.date_added >= datetime('now', ?)
+        ORDER BY e.amount DESC
+        LIMIT 5
+    ''',
+    'graph': '''
+        SELECT amount, description, date_added
+        FROM expenses
+        WHERE client_id = ? AND date_added >= datetime('now', ?)
+    ''',
+    'chart': SQL_FOR_CHART,
+    'incomes': '''
+        SELECT amount, description, date_added
+        FROM incomes
+        WHERE client_id = ?
+            AND date_added >= datetime('now', 'start of month')
+    ''',
+}
+
+
+def seed(rows):
+    """Расходы за последний год и доходы за последние дни."""
+    for name in CATEGORIES:
+        sql_insert_category(name)
+    minutes = 365 * 24 * 60 // rows or 1
+    with connections.writer() as con:
+        con.executemany(
+            '''
+            INSERT INTO expenses
+                (amount, description, date_added, category_id, client_id)
+            VALUES (?, ?, datetime('now', ? || ' minutes'), ?, ?)
+            ''', ((index % 5000 + 0.5, f'Покупка {index % 500}',
+                   -index * minutes, index % len(CATEGORIES) + 1, USER_ID)
+                  for index in range(rows)))
+        con.executemany(
+            '''
+            INSERT INTO incomes (amount, description, date_added, client_id)
+            VALUES (?, ?, datetime('now', ? || ' hours'), ?)
+            ''', ((50000.0, 'Зарплата', -hours, USER_ID)
+                  for hours in range(0, 24 * 20, 6)))
+
+
+def pandas_frame(name, *params):
+    """Результат запроса в виде DataFrame."""
+    return pd.read_sql_query(PANDAS_SQL[name], connections.reader(),
+                             params=params)
+
+
+def pandas_excel(data):
+    """Таблица в xlsx через pandas и openpyxl."""
+    buffer = io.BytesIO()
+    data.to_excel(buffer, index=True)
+    return buffer.getvalue()
+
+
+def pandas_series(data):
+    """Подготовка точек графика, как в прежних обработчиках."""
+    data['date_added'] = pd.to_datetime(data['date_added'])
+    total = data['amount'].sum()
+    data['amount'] = pd.to_numeric(data['amount'], errors='coerce')
+    data = data.sort_values(by='date_added')
+    return data, total, ([date.to_pydatetime()
+                          for date in data['date_added']],
+                         data['amount'].tolist())
+
+
+def pandas_table(period):
+    """Таблица топ 5 расходов через pandas."""
+    data = pandas_frame('table', USER_ID, period)
+    return data['amount'].sum(), pandas_excel(data)
+
+
+def pandas_graph(period):
+    """График расходов через pandas."""
+    _, total, args = pandas_series(pandas_frame('graph', USER_ID, period))
+    return total, args
+
+
+def pandas_chart(period):
+    """Диаграмма расходов через pandas."""
+    data = pandas_frame('chart', USER_ID, period)
+    return data['total_amount'].sum(), (data['total_amount'].tolist(),
+                                        data['category'].tolist())
+
+
+def pandas_incomes(period):
+    """Таблица и график доходов через pandas."""
+    data, total, args = pandas_series(pandas_frame('incomes', USER_ID))
+    return total, args, pandas_excel(data)
+
+
+def lean_table(period):
+    """Таблица топ 5 расходов через analytics.py."""
+    rows = read_rows(sql_for_table, period, USER_ID)
+    return bool(rows), to_xlsx(TABLE_HEADER, rows, TABLE_WIDTHS)
+
+
+def lean_graph(period):
+    """График расходов через analytics.py."""
+    total = read_total(sql_for_graph_total, period, USER_ID)
+    points = read_points(sql_for_graph, period, USER_ID)
+    return total, (points['date'], points['amount'])
+
+
+def lean_chart(period):
+    """Диаграмма расходов через analytics.py."""
+    rows = read_rows(sql_for_chart, period, USER_ID)
+    return (sum(row[0] for row in rows),
+            ([row[0] for row in rows], [row[2] for row in rows]))
+
+
+def lean_incomes(period):
+    """Таблица и график доходов через analytics.py."""
+    total = read_total(sql_for_incomes_total, USER_ID)
+    rows = read_rows(sql_for_graph_incomes, USER_ID)
+    points = to_points(rows)
+    return (total, (points['date'], points['amount']),
+            to_xlsx(INCOMES_HEADER, rows, INCOMES_WIDTHS))
+
+
+SCENARIOS = {
+    'table': (pandas_table, lean_table),
+    'graph': (pandas_graph, lean_graph),
+    'chart': (pandas_chart, lean_chart),
+    'incomes': (pandas_incomes, lean_incomes),
+}
+
+
+def measure(func, period, repeat):
+    """Медиана времени, пик памяти и размер аргументов графика."""
+    func(period)
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(period)
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(period)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    plot_args = result[1] if isinstance(result[1], tuple) else ()
+    return {'median_ms': statistics.median(times) * 1000,
+            'python_peak_mb': peak / 1024 / 1024,
+            'plot_args_kb': len(pickle.dumps(plot_args)) / 1024}
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--period', default='-3 month')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_tables()
+    seed(args.rows)
+    results = {}
+    for name, (pandas_path, lean_path) in SCENARIOS.items():
+        results[name] = {
+            'pandas': measure(pandas_path, args.period, args.repeat),
+            'analytics': measure(lean_path, args.period, args.repeat),
+        }
+    print(json.dumps({'rows': args.rows, 'period': args.period,
+                      'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Бенчмарк выгрузки всей истории пользователя.
+
+Для каждого размера истории из --rows добавляет пользователю записи
+во временной БД и выгружает их в CSV и XLSX. Выводит время, размер
+файла и пик памяти Python (tracemalloc, отдельным проходом, чтобы
+не искажать время). Для сравнения выгружает CSV через pandas, как
+таблицы статистики.
+
+    python benchmarks/bench_export.py --rows 10000 100000 500000
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'bench_export.db'))
+
+import pandas as pd  # noqa: E402
+
+from database import create_tables  # noqa: E402
+from db_functions import (connections, sql_for_export_expenses,  # noqa: E402
+                          sql_insert_category, sql_select_id_category)
+from exporter import EXPORT_CHUNK_SIZE, export_history  # noqa: E402
+from storage import storage  # noqa: E402
+
+
+def seed(user_id, rows):
+    """Записи пользователя: каждая десятая - доход."""
+    if sql_select_id_category('Еда') is None:
+        sql_insert_category('Еда')
+    category_id = sql_select_id_category('Еда')[0]
+    with connections.writer() as con:
+        con.executemany(
+            '''
+            INSERT INTO expenses
+                (amount, description, date_added, category_id, client_id)
+            VALUES (?, ?, datetime('2020-01-01', ? || ' minutes'), ?, ?)
+            ''', ((index % 5000 + 0.5, f'Покупка {index % 500}', index,
+                   category_id, user_id)
+                  for index in range(rows) if index % 10))
+        con.executemany(
+            '''
+            INSERT INTO incomes (amount, description, date_added, client_id)
+            VALUES (?, ?, datetime('2020-01-01', ? || ' minutes'), ?)
+            ''', ((50000.0, 'Зарплата', index, user_id)
+                  for index in range(0, rows, 10)))
+
+
+def pandas_csv(user_id):
+    """Выгрузка расходов через DataFrame целиком в памяти."""
+    sql, params = sql_for_export_expenses(user_id)
+    data = pd.read_sql_query(sql, connections.reader(), params=params)
+    buffer = io.BytesIO()
+    data.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+def export_file(user_id, file_format):
+    """Выгрузка истории, как в боте."""
+    return export_history(
+        storage.export_records(user_id, EXPORT_CHUNK_SIZE), file_format)
+
+
+def measure(func, *args):
+    """Время одного вызова и пик памяти Python в повторном вызове."""
+    started = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'python_peak_mb': peak / 1024 / 1024}
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 500000])
+    args = parser.parse_args()
+
+    create_tables()
+    results = []
+    for user_id, rows in enumerate(args.rows, start=1):
+        seed(user_id, rows)
+        result = {'rows': rows}
+        for file_format in ('CSV', 'XLSX'):
+            export, stats = measure(export_file, user_id, file_format)
+            export.file.close()
+            result[file_format.lower()] = dict(
+                stats, file_name=export.file_name,
+                file_mb=export.size / 1024 / 1024)
+        _, result['pandas_csv'] = measure(pandas_csv, user_id)
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
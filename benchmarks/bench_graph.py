@@ -0,0 +1,99 @@
+"""Бенчмарк построения графика расходов при росте истории.
+
+Для каждого размера истории из --rows добавляет пользователю расходы
+за последний год во временной БД и для периодов 'Квартал' и 'Год'
+строит график двумя способами: по каждой записи, как раньше,
+и по суммам за интервалы из SQL с прореживанием LTTB. Выводит число
+точек, время запроса, время построения и размер PNG.
+
+    python benchmarks/bench_graph.py --rows 10000 100000 500000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'bench_graph.db'))
+
+from analytics import downsample, read_points  # noqa: E402
+from database import create_tables  # noqa: E402
+from db_functions import (connections, sql_for_graph,  # noqa: E402
+                          sql_insert_category, sql_select_id_category)
+from render import plot_line  # noqa: E402
+
+PERIODS = {'Квартал': '-3 month', 'Год': 'start of year'}
+SQL_FOR_ROWS = '''
+    SELECT date_added, amount
+    FROM expenses
+    WHERE client_id = ? AND date_added >= datetime('now', ?)
+    ORDER BY date_added
+'''
+
+
+def seed(user_id, rows):
+    """Расходы пользователя, равномерно за последний год."""
+    if sql_select_id_category('Еда') is None:
+        sql_insert_category('Еда')
+    category_id = sql_select_id_category('Еда')[0]
+    minutes = 365 * 24 * 60 // rows or 1
+    with connections.writer() as con:
+        con.executemany(
+            '''
+            INSERT INTO expenses
+                (amount, description, date_added, category_id, client_id)
+            VALUES (?, ?, datetime('now', ? || ' minutes'), ?, ?)
+            ''', ((index % 5000 + 0.5, f'Покупка {index % 500}',
+                   -index * minutes, category_id, user_id)
+                  for index in range(rows)))
+
+
+def raw_rows(period, user_id):
+    """Все записи расходов за период, как раньше."""
+    return SQL_FOR_ROWS, (user_id, period)
+
+
+def measure(points_func):
+    """Точки графика, время их получения и построения, размер PNG."""
+    started = time.perf_counter()
+    points = points_func()
+    query_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    png = plot_line(points['date'], points['amount'], 'Расход',
+                    label='Расходы по датам')
+    return {'points': len(points), 'query_seconds': query_seconds,
+            'render_seconds': time.perf_counter() - started,
+            'png_kb': len(png) / 1024}
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 500000])
+    args = parser.parse_args()
+
+    create_tables()
+    # Первое построение загружает matplotlib и шрифты
+    plot_line([], [], 'Прогрев')
+    results = []
+    for user_id, rows in enumerate(args.rows, start=1):
+        seed(user_id, rows)
+        for name, period in PERIODS.items():
+            results.append({
+                'rows': rows, 'period': name,
+                'rows_graph': measure(
+                    lambda: read_points(raw_rows, period, user_id)),
+                'bucketed_graph': measure(
+                    lambda: downsample(
+                        read_points(sql_for_graph, period, user_id))),
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
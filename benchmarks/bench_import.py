@@ -0,0 +1,105 @@
+"""Бенчмарк импорта выписок CSV и XLSX.
+
+Генерирует выписку из --rows строк, импортирует ее во временную БД,
+затем загружает тот же файл повторно (все строки должны оказаться
+повторами). Выводит время и скорость каждого прохода и пиковый RSS
+процесса после него (генерация файла тоже входит в этот пик).
+
+    python benchmarks/bench_import.py --rows 100000 --format csv xlsx
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'bench_import.db'))
+
+from database import create_tables  # noqa: E402
+from importer import import_statement  # noqa: E402
+
+HEADER = ['Дата операции', 'Сумма', 'Описание', 'Категория']
+CATEGORIES = ['Еда', 'Транспорт', 'Кафе', 'Связь', 'Дом', 'Здоровье']
+
+
+def statement_rows(rows):
+    """Строки выписки: в основном расходы, каждая десятая - доход."""
+    random.seed(1)
+    started = datetime(2024, 1, 1)
+    for index in range(rows):
+        date_added = started + timedelta(minutes=index * 7)
+        if index % 10 == 0:
+            yield [date_added, round(random.uniform(1000, 90000), 2),
+                   'Зачисление зарплаты', '']
+        else:
+            yield [date_added, -round(random.uniform(50, 5000), 2),
+                   f'Покупка {index % 500}', random.choice(CATEGORIES)]
+
+
+def make_csv(rows):
+    """Выписка CSV в формате банков: ";", запятая в суммах, cp1251."""
+    lines = [';'.join(HEADER)]
+    for date_added, amount, description, category in statement_rows(rows):
+        lines.append(';'.join([date_added.strftime('%d.%m.%Y %H:%M:%S'),
+                               f'{amount:.2f}'.replace('.', ','),
+                               description, category]))
+    return '\r\n'.join(lines).encode('cp1251')
+
+
+def make_xlsx(rows):
+    """Выписка XLSX, записанная в потоковом режиме openpyxl."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in statement_rows(rows):
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def run(data, file_name, user_id):
+    """Один проход импорта."""
+    stats = import_statement(io.BytesIO(data), file_name, user_id)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'rows': stats.rows, 'expenses': stats.expenses,
+            'incomes': stats.incomes, 'duplicates': stats.duplicates,
+            'errors': stats.errors, 'seconds': stats.elapsed,
+            'rows_per_s': stats.rows_per_second,
+            'peak_rss_mb': peak / 1024}
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--format', nargs='+', choices=['csv', 'xlsx'],
+                        default=['csv', 'xlsx'])
+    args = parser.parse_args()
+
+    create_tables()
+    results = []
+    for user_id, file_format in enumerate(args.format, start=1):
+        data = make_csv(args.rows) if file_format == 'csv' else make_xlsx(
+            args.rows)
+        file_name = f'statement.{file_format}'
+        results.append({
+            'format': file_format,
+            'file_mb': len(data) / 1024 / 1024,
+            'first_upload': run(data, file_name, user_id),
+            'second_upload': run(data, file_name, user_id),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Бенчмарк запросов статистики без индексов и с индексами миграции 2.
+
+Общее число записей растет, а число записей одного пользователя
+остается постоянным: с индексами время запросов не должно расти.
+
+    python benchmarks/bench_indexes.py --rows 10000 100000 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.gettempdir(),
+                                              'bench_unused.db'))
+
+from database import MIGRATIONS, db_connect, migrate  # noqa: E402
+from db_functions import (sql_for_chart, sql_for_graph,  # noqa: E402
+                          sql_for_graph_incomes, sql_for_table)
+
+INDEXES = ['ux_clients_telegram_id', 'ix_expenses_client_date',
+           'ix_expenses_client_id', 'ix_incomes_client_date',
+           'ix_incomes_client_id']
+ROWS_PER_USER = 500
+USER_ID = 1
+PERIODS = ['start of day', '-7 day', 'start of month', '-3 month',
+           'start of year']
+
+
+def fill(con, rows):
+    """Заполнение БД случайными записями."""
+    users = max(rows // ROWS_PER_USER, 1)
+    con.executemany('INSERT INTO categories (name) VALUES (?)',
+                    [(f'Категория {i}',) for i in range(20)])
+    con.executemany('INSERT INTO clients (telegram_id) VALUES (?)',
+                    [(str(i),) for i in range(1, users + 1)])
+
+    def records():
+        for i in range(rows):
+            days = random.random() * 730
+            yield (random.randint(1, 10000), f'Запись {i}',
+                   f'-{days:.5f} day', random.randint(1, 20), i % users + 1)
+
+    con.executemany(
+        '''
+        INSERT INTO expenses
+            (amount, description, date_added, category_id, client_id)
+        VALUES (?, ?, datetime('now', ?), ?, ?)
+        ''', records())
+    con.executemany(
+        '''
+        INSERT INTO incomes (amount, description, date_added, client_id)
+        VALUES (?, ?, datetime('now', ?), ?)
+        ''', (row[:3] + row[4:] for row in records()))
+    con.commit()
+
+
+def queries():
+    """Запросы бота для пользователя USER_ID."""
+    yield 'select_user_id', (
+        'SELECT * FROM clients WHERE telegram_id = ?', (str(USER_ID),))
+    yield 'records_10_expense', (
+        '''
+        SELECT e.id, e.amount, c.name, e.description, e.date_added
+        FROM expenses e JOIN categories c ON e.category_id = c.id
+        WHERE e.client_id = ? ORDER BY e.id DESC LIMIT 10
+        ''', (USER_ID,))
+    yield 'records_10_incomes', (
+        '''
+        SELECT id, amount, description, date_added FROM incomes
+        WHERE client_id = ? ORDER BY id DESC LIMIT 10
+        ''', (USER_ID,))
+    yield 'graph_incomes', sql_for_graph_incomes(USER_ID)
+    for period in PERIODS:
+        yield f'table[{period}]', sql_for_table(period, USER_ID)
+        yield f'graph[{period}]', sql_for_graph(period, USER_ID)
+        yield f'chart[{period}]', sql_for_chart(period, USER_ID)
+
+
+def measure(con, repeat):
+    """Среднее время запросов, мс."""
+    result = {}
+    for name, (sql, params) in queries():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            con.execute(sql, params).fetchall()
+        result[name] = (time.perf_counter() - started) / repeat * 1000
+    return result
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            con = db_connect(os.path.join(directory, f'bench_{rows}.db'))
+            migrate(con)
+            fill(con, rows)
+            for name in INDEXES:
+                con.execute(f'DROP INDEX {name}')
+            before = measure(con, args.repeat)
+            for statement in dict(MIGRATIONS)[2]:
+                con.execute(statement)
+            con.execute('ANALYZE')
+            after = measure(con, args.repeat)
+            con.close()
+            report.append({'rows': rows, 'before_ms': before,
+                           'after_ms': after})
+            print(f'{rows:>10} строк: '
+                  f'без индексов {sum(before.values()):9.2f} мс, '
+                  f'с индексами {sum(after.values()):7.2f} мс',
+                  file=sys.stderr)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Бенчмарк клавиатур: сборка в обработчике против готового JSON.
+
+Раньше каждый ответ собирал ReplyKeyboardMarkup заново, а TeleBot
+сериализовал его в JSON при отправке. Бенчмарк сравнивает среднее
+время получения клавиатуры, готовой к отправке, в обоих вариантах
+для меню, периодов и клавиатуры из --categories категорий.
+
+    python benchmarks/bench_keyboards.py --categories 30
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot import apihelper, types  # noqa: E402
+
+from keyboards import KeyboardRegistry  # noqa: E402
+
+MENU = [['Доход', 'Расход'], ['Статистика доходов', 'Статистика расходов']]
+PERIODS = [['День', 'Неделя', 'Месяц', 'Квартал', 'Год']]
+
+
+def build(rows):
+    """Новая клавиатура в JSON, как ее сериализует TeleBot."""
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for row in rows:
+        markup.add(*row)
+    return apihelper._convert_markup(markup)
+
+
+def measure(func, repeat):
+    """Среднее время вызова func() в мкс."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    categories = [(index, f'Категория {index}')
+                  for index in range(1, args.categories + 1)]
+    registry = KeyboardRegistry()
+    registry.add('menu', *MENU)
+    registry.add('periods', *PERIODS)
+    scenarios = {
+        'menu': (lambda: build(MENU),
+                 lambda: apihelper._convert_markup(registry.get('menu'))),
+        'periods': (lambda: build(PERIODS),
+                    lambda: apihelper._convert_markup(
+                        registry.get('periods'))),
+        'categories': (lambda: build([[name] for _, name in categories]),
+                       lambda: apihelper._convert_markup(
+                           registry.categories(list(categories)))),
+    }
+    results = {name: {'rebuilt_us': measure(rebuilt, args.repeat),
+                      'registry_us': measure(cached, args.repeat)}
+               for name, (rebuilt, cached) in scenarios.items()}
+    print(json.dumps({'categories': args.categories, 'results': results},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Бенчмарк времени запуска бота.
+
+Импортирует bot.py в отдельном процессе с python -X importtime и
+выводит общее время импорта, самые долгие модули верхнего уровня и
+то, какие тяжелые библиотеки загружены уже при импорте. Затем --runs
+раз запускает бота на фейковом сервере Bot API (benchmarks/load_test.py)
+и измеряет время от запуска процесса до ответа на первое сообщение
+и пиковое потребление памяти процесса бота.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from load_test import FakeBotAPI  # noqa: E402
+
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'openpyxl', 'aiohttp',
+                 'telebot.async_telebot']
+CHECK_MODULES = ('import sys, bot; print(",".join('
+                 f'name for name in {HEAVY_MODULES!r} '
+                 'if name in sys.modules))')
+RUN_BOT = '\n'.join([
+    'import os, sys',
+    'from telebot import apihelper',
+    'apihelper.API_URL = sys.argv[1]',
+    'if os.getenv("RUNTIME") == "async":',
+    '    from telebot import asyncio_helper',
+    '    asyncio_helper.API_URL = sys.argv[1]',
+    'import bot',
+    'bot.main()',
+])
+
+
+def bot_env():
+    """Окружение процесса бота с временной БД."""
+    data_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    return dict(os.environ, TOKEN='0:startup', UPDATE_MODE='polling',
+                DB_PATH=os.path.join(data_dir, 'finance_bot.db'),
+                LOG_FILE=os.path.join(data_dir, 'main.log'))
+
+
+def import_times(env):
+    """Время импорта bot.py и его прямых зависимостей, мс."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHECK_MODULES],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Вложенность импорта - по два пробела на уровень
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((depth, name.strip(), int(cumulative) / 1000))
+    total = next(ms for depth, name, ms in modules if name == 'bot')
+    top = sorted(((name, ms) for depth, name, ms in modules if depth == 1),
+                 key=lambda item: -item[1])
+    return {'import_bot_ms': total,
+            'slowest_imports_ms': dict(top[:10]),
+            'heavy_modules_loaded': [name for name in
+                                     result.stdout.strip().split(',')
+                                     if name]}
+
+
+def first_reply(env, timeout):
+    """Секунды от запуска процесса бота до ответа на /start."""
+    api = FakeBotAPI()
+    api.start()
+    api.push(1, '/start')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', RUN_BOT, api.url + '/bot{0}/{1}'],
+        cwd=ROOT, env=env)
+    try:
+        replied, _, _ = api.inboxes[1].get(timeout=timeout)
+    finally:
+        api.close()
+        process.terminate()
+        process.wait()
+    return replied - started
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    env = bot_env()
+    subprocess.run([sys.executable, '-c',
+                    'import database; database.create_tables()'],
+                   cwd=ROOT, env=env, check=True)
+    result = import_times(env)
+    replies = [first_reply(env, args.timeout) for _ in range(args.runs)]
+    result.update({
+        'runtime': os.getenv('RUNTIME', 'sync'),
+        'first_reply_s': {'median': statistics.median(replies),
+                          'min': min(replies), 'max': max(replies)},
+        'bot_peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    })
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Бенчмарк параметризованных запросов статистики против f-строк.
+
+Раньше текст запроса строился f-строкой для каждого пользователя и
+периода, и sqlite3 разбирал его заново при каждом вызове. Бенчмарк
+выполняет одни и те же запросы в обоих вариантах для многих
+пользователей и сравнивает среднее время одного запроса.
+
+    python benchmarks/bench_statements.py --users 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.gettempdir(),
+                                              'bench_unused.db'))
+
+from database import db_connect, migrate  # noqa: E402
+from db_functions import (sql_for_chart, sql_for_graph,  # noqa: E402
+                          sql_for_graph_incomes, sql_for_table)
+
+# Параметр запроса: ? или ?N
+PARAMETER = re.compile(r'\?(\d*)')
+PERIODS = ['start of day', '-7 day', 'start of month', '-3 month',
+           'start of year']
+QUERIES = {
+    'table': sql_for_table,
+    'graph': sql_for_graph,
+    'chart': sql_for_chart,
+    'graph_incomes': lambda period, user: sql_for_graph_incomes(user),
+}
+
+
+def inline(sql, params):
+    """Запрос с подставленными значениями, как в прежних f-строках."""
+    values = [f"'{value}'" if isinstance(value, str) else str(value)
+              for value in params]
+    positions = iter(values)
+    return PARAMETER.sub(
+        lambda match: (values[int(match.group(1)) - 1] if match.group(1)
+                       else next(positions)), sql)
+
+
+def fill(con, users):
+    """Несколько записей для каждого пользователя."""
+    con.execute("INSERT INTO categories (name) VALUES ('Еда')")
+    con.executemany(
+        '''
+        INSERT INTO expenses
+            (amount, description, date_added, category_id, client_id)
+        VALUES (?, 'Запись', datetime('now', ?), 1, ?)
+        ''',
+        ((random.randint(1, 1000), f'-{random.randint(0, 365)} day', user)
+         for user in range(users) for _ in range(5)))
+    con.executemany(
+        '''
+        INSERT INTO incomes (amount, description, client_id)
+        VALUES (?, 'Запись', ?)
+        ''', ((random.randint(1, 1000), user) for user in range(users)))
+    con.commit()
+
+
+def measure(con, calls, parameterised):
+    """Среднее время одного запроса, мкс."""
+    started = time.perf_counter()
+    for sql, params in calls:
+        if parameterised:
+            con.execute(sql, params).fetchall()
+        else:
+            con.execute(inline(sql, params)).fetchall()
+    return (time.perf_counter() - started) / len(calls) * 1_000_000
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        con = db_connect(os.path.join(directory, 'bench.db'))
+        migrate(con)
+        fill(con, args.users)
+        for name, query in QUERIES.items():
+            calls = [query(period, user) for user in range(args.users)
+                     for period in PERIODS]
+            random.shuffle(calls)
+            measure(con, calls[:100], True)
+            before = measure(con, calls, False)
+            after = measure(con, calls, True)
+            report[name] = {'f_string_us': before, 'parameterised_us': after}
+            print(f'{name:>14}: f-строка {before:7.1f} мкс, '
+                  f'параметры {after:7.1f} мкс', file=sys.stderr)
+        con.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Бенчмарк хранилищ данных: SQLite, в памяти и асинхронного.
+
+Добавляет пользователю --rows расходов за последний год в каждое
+хранилище и выводит медиану времени операций бота для SQLiteStorage
+и MemoryStorage. Затем в цикле событий выполняет --concurrency
+запросов суммы расходов за год: напрямую через SQLiteStorage и через
+AsyncStorage, и выводит наибольшую задержку цикла событий.
+
+    python benchmarks/bench_storage.py --rows 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'bench_storage.db'))
+
+from database import create_tables  # noqa: E402
+from storage import (DATE_FORMAT, AsyncStorage, MemoryStorage,  # noqa: E402
+                     SQLiteStorage, now_utc)
+
+USER_ID = 1
+PERIOD = '-3 month'
+CATEGORIES = ['Еда', 'Транспорт', 'Кафе', 'Связь', 'Дом', 'Здоровье']
+OPERATIONS = {
+    'expenses_page': lambda storage: storage.expenses_page(USER_ID),
+    'top_expenses': lambda storage: storage.top_expenses(PERIOD, USER_ID),
+    'expenses_total': lambda storage: storage.expenses_total(PERIOD,
+                                                             USER_ID),
+    'expense_points': lambda storage: storage.expense_points(PERIOD,
+                                                             USER_ID),
+    'category_totals': lambda storage: storage.category_totals(PERIOD,
+                                                               USER_ID),
+    'add_expense': lambda storage: storage.add_expense(100.0, 'Покупка', 1,
+                                                       USER_ID),
+}
+
+
+def seed(storage, rows):
+    """Расходы пользователя, равномерно за последний год."""
+    for name in CATEGORIES:
+        storage.add_category(name)
+    minutes = 365 * 24 * 60 // rows or 1
+    now = now_utc()
+    storage.import_records(
+        [(index % 5000 + 0.5, f'Покупка {index % 500}',
+          (now - timedelta(minutes=index * minutes)).strftime(DATE_FORMAT),
+          index % len(CATEGORIES) + 1, f'bench-{index}')
+         for index in range(rows)], [], USER_ID)
+
+
+def measure(func, storage, repeat):
+    """Медиана времени вызова func(storage) в мс."""
+    func(storage)
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(storage)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+async def loop_lag(call, concurrency):
+    """Наибольшая задержка цикла событий и время concurrency вызовов."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return {'max_loop_lag_ms': max(lags) * 1000, 'elapsed_ms': elapsed * 1000}
+
+
+async def compare_async(storage, concurrency):
+    """Суммы за год в цикле событий: напрямую и через AsyncStorage."""
+    async_storage = AsyncStorage(storage)
+
+    async def blocking():
+        return storage.expenses_total('start of year', USER_ID)
+
+    async def non_blocking():
+        return await async_storage.expenses_total('start of year', USER_ID)
+
+    try:
+        return {'sync_in_loop': await loop_lag(blocking, concurrency),
+                'async_storage': await loop_lag(non_blocking, concurrency)}
+    finally:
+        async_storage.close()
+
+
+def main():
+    """Запуск бенчмарка."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    create_tables()
+    backends = {'sqlite': SQLiteStorage(), 'memory': MemoryStorage()}
+    for storage in backends.values():
+        seed(storage, args.rows)
+    results = {
+        name: {backend: measure(func, storage, args.repeat)
+               for backend, storage in backends.items()}
+        for name, func in OPERATIONS.items()}
+    print(json.dumps({
+        'rows': args.rows, 'period': PERIOD, 'median_ms': results,
+        'event_loop': asyncio.run(
+            compare_async(backends['sqlite'], args.concurrency)),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""Нагрузочный тест бота с фейковым сервером Bot API.
+
+Скрипт поднимает локальный сервер, отвечающий на getUpdates,
+sendMessage, sendPhoto, sendDocument и editMessageText, и направляет
+на него TeleBot
+из bot.py, работающий с временной БД. Затем --users пользователей
+одновременно проходят сценарии: добавление, редактирование и удаление
+расхода, добавление дохода и все форматы статистики за все периоды.
+Шаг сценария - сообщение или нажатие кнопки и ожидание ответа бота с
+нужным текстом; время шага считается от отправки обновления до этого
+ответа. Лимиты частоты отправки по умолчанию сняты, чтобы измерялись
+БД и построение графиков (--telegram-limits оставляет настройки OUTBOX_*).
+
+    python benchmarks/load_test.py --users 50
+    RUNTIME=async python benchmarks/load_test.py --users 50 \\
+        --journeys expense_add statistics
+    WORKER_PROCESSES=4 python benchmarks/load_test.py --users 50
+    STORAGE_BACKEND=memory python benchmarks/load_test.py --users 50
+"""
+
+import argparse
+import email.parser
+import itertools
+import json
+import os
+import queue
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook_client import percentiles  # noqa: E402
+
+GREETING = 'Выберите опцию'
+PERIODS = ['День', 'Неделя', 'Месяц', 'Квартал', 'Год']
+FORMATS = ['Таблица', 'Диаграмма', 'График']
+RECORD_ID = re.compile(r'ID: (\d+)')
+
+
+class Press(NamedTuple):
+    """Нажатие кнопки под сообщением бота."""
+
+    message_id: int
+    data: str
+
+
+def last_record_id(replies):
+    """ID первой записи из страницы записей в ответах бота."""
+    for text, _, _ in replies:
+        match = RECORD_ID.search(text)
+        if match:
+            return match.group(1)
+    raise LookupError('В ответе бота нет списка записей')
+
+
+def pick_record(replies):
+    """Нажатие кнопки первой записи на странице записей."""
+    for _, markup, message_id in replies:
+        if markup and 'inline_keyboard' in markup:
+            button = json.loads(markup)['inline_keyboard'][0][0]
+            return Press(message_id, button['callback_data'])
+    raise LookupError('В ответе бота нет кнопок записей')
+
+
+JOURNEYS = {
+    'start': [('/start', GREETING)],
+    'income_add': [
+        ('Доход', 'Вы нажали'),
+        ('Добавить', 'Введите сумму дохода'),
+        ('1000', 'Введите описание дохода'),
+        ('зарплата', GREETING),
+    ],
+    'expense_add': [
+        ('Расход', 'Вы нажали'),
+        ('Добавить', 'Введите сумму расходов'),
+        ('250', 'Введите описание расхода'),
+        ('обед', 'Выберите категорию'),
+        ('Еда', GREETING),
+    ],
+    'expense_edit': [
+        ('Расход', 'Вы нажали'),
+        ('Редактировать', 'Выберите запись'),
+        (pick_record, 'Введите новую сумму'),
+        ('300', 'Введите новое описание'),
+        ('ужин', 'Выберите категорию'),
+        ('Транспорт', GREETING),
+    ],
+    'expense_delete': [
+        ('Расход', 'Вы нажали'),
+        ('Добавить', 'Введите сумму расходов'),
+        ('100', 'Введите описание расхода'),
+        ('такси', 'Выберите категорию'),
+        ('Транспорт', GREETING),
+        ('Расход', 'Вы нажали'),
+        ('Удалить', 'Выберите запись'),
+        (last_record_id, GREETING),
+    ],
+    'income_statistics': [('Статистика доходов', GREETING)],
+    'statistics': [
+        step
+        for period, report_format in itertools.product(PERIODS, FORMATS)
+        for step in [('Статистика расходов', 'Выберите период'),
+                     (period, 'Выберите формат'),
+                     (report_format, GREETING)]
+    ],
+}
+
+
+class FakeBotAPI:
+    """Фейковый Bot API: выдает обновления и запоминает ответы бота."""
+
+    def __init__(self):
+        self.updates = []
+        self.inboxes = defaultdict(queue.Queue)
+        self.condition = threading.Condition()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.calls = defaultdict(int)
+        self.closed = False
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 256
+        self.httpd.api = self
+
+    @property
+    def url(self):
+        """Адрес сервера."""
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def start(self):
+        """Запуск сервера в фоновом потоке."""
+        threading.Thread(target=self.httpd.serve_forever,
+                         daemon=True).start()
+
+    def close(self):
+        """Остановка сервера и освобождение ожидающих getUpdates."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.httpd.shutdown()
+
+    def push(self, chat_id, text):
+        """Новое сообщение пользователя или нажатие кнопки для бота."""
+        update_id = next(self.update_ids)
+        user = {'id': chat_id, 'is_bot': False,
+                'first_name': f'User{chat_id}'}
+        chat = {'id': chat_id, 'type': 'private'}
+        if isinstance(text, Press):
+            update = {
+                'update_id': update_id,
+                'callback_query': {
+                    'id': str(update_id), 'from': user,
+                    'chat_instance': str(chat_id), 'data': text.data,
+                    'message': {'message_id': text.message_id,
+                                'date': int(time.time()), 'chat': chat,
+                                'text': ''},
+                },
+            }
+        else:
+            update = {
+                'update_id': update_id,
+                'message': {
+                    'message_id': next(self.message_ids),
+                    'date': int(time.time()), 'chat': chat, 'from': user,
+                    'text': text,
+                },
+            }
+        with self.condition:
+            self.updates.append(update)
+            self.condition.notify_all()
+
+    def get_updates(self, params):
+        """Long polling: обновления с update_id не меньше offset."""
+        offset = int(params.get('offset', 0))
+        deadline = time.monotonic() + float(params.get('timeout', 0))
+        with self.condition:
+            self.updates = [update for update in self.updates
+                            if update['update_id'] >= offset]
+            while not self.updates and not self.closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+            limit = int(params.get('limit', 100))
+            return self.updates[:limit]
+
+    def reply(self, method, params):
+        """Ответ бота пользователю: попадает во входящие чата."""
+        chat_id = int(params['chat_id'])
+        message_id = (int(params['message_id'])
+                      if method == 'editMessageText'
+                      else next(self.message_ids))
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        text = params.get('text') or params.get('caption') or ''
+        if method in ('sendMessage', 'editMessageText'):
+            message['text'] = text
+        elif method == 'sendPhoto':
+            message['photo'] = [{'file_id': f'photo{message["message_id"]}',
+                                 'file_unique_id': 'photo',
+                                 'width': 640, 'height': 480}]
+        elif method == 'sendDocument':
+            message['document'] = {
+                'file_id': f'document{message["message_id"]}',
+                'file_unique_id': 'document'}
+        self.inboxes[chat_id].put((time.perf_counter(), method, text,
+                                   params.get('reply_markup'), message_id))
+        return message
+
+    def call(self, method, params):
+        """Результат метода Bot API."""
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Load',
+                    'username': 'load_bot'}
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument',
+                      'editMessageText'):
+            return self.reply(method, params)
+        return True
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Разбор запросов TeleBot (query, form и multipart)."""
+
+    def do_GET(self):
+        """Запросы AsyncTeleBot передают параметры в теле и для GET."""
+        self.handle_call()
+
+    def do_POST(self):
+        """Запросы с параметрами в теле."""
+        self.handle_call()
+
+    def handle_call(self):
+        """Вызов метода и ответ в формате Bot API."""
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        parts = urlsplit(self.path)
+        if parts.path == '/images':
+            return self.send_json([{'url': 'https://example.com/cat.jpg'}])
+        params = dict(parse_qsl(parts.query))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n'
+                + body)
+            for part in message.get_payload():
+                if part.get_filename() is None:
+                    params[part.get_param('name', header=(
+                        'content-disposition'))] = part.get_payload(
+                            decode=True).decode()
+        elif body:
+            params.update(parse_qsl(body.decode()))
+        method = parts.path.rsplit('/', 1)[-1]
+        self.send_json({'ok': True,
+                        'result': self.server.api.call(method, params)})
+
+    def send_json(self, data):
+        """Ответ в формате JSON."""
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Запросы не пишутся в лог."""
+
+
+def run_user(api, chat_id, journeys, timeout, results):
+    """Прохождение сценариев одним пользователем."""
+    inbox = api.inboxes[chat_id]
+    replies = []
+    for name in journeys:
+        for message, expected in JOURNEYS[name]:
+            try:
+                text = message(replies) if callable(message) else message
+            except LookupError:
+                results['errors'].append((name, 'no record id'))
+                break
+            replies = []
+            started = time.perf_counter()
+            api.push(chat_id, text)
+            deadline = time.monotonic() + timeout
+            finished = None
+            while finished is None:
+                try:
+                    sent_at, method, reply, markup, message_id = inbox.get(
+                        timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                replies.append((reply, markup, message_id))
+                if expected in reply:
+                    finished = sent_at
+            if finished is None:
+                results['errors'].append((name, text))
+                break
+            results['latency'].append(finished - started)
+            results['by_journey'][name].append(finished - started)
+
+
+def configure(args, api):
+    """Настройки бота до его импорта."""
+    data_dir = tempfile.mkdtemp(prefix='load_test_')
+    os.environ.update(
+        TOKEN='0:load', UPDATE_MODE='polling',
+        DB_PATH=os.path.join(data_dir, 'finance_bot.db'),
+        IMAGE_API_URLS=f'{api.url}/images',
+        TELEGRAM_API_URL=api.url + '/bot{0}/{1}')
+    if not args.telegram_limits:
+        os.environ.update(
+            OUTBOX_GLOBAL_RATE='1000000', OUTBOX_GLOBAL_BURST='1000000',
+            OUTBOX_CHAT_RATE='1000000', OUTBOX_CHAT_BURST='1000000',
+            OUTBOX_GROUP_RATE='1000000')
+    os.chdir(data_dir)
+
+
+def start_bot():
+    """Запуск bot.py с запросами к фейковому серверу."""
+    import bot
+    import database
+    from storage import STORAGE_BACKEND, storage
+
+    if STORAGE_BACKEND != 'memory':
+        database.create_tables()
+    for name in ('Еда', 'Транспорт'):
+        if storage.category_id(name) is None:
+            storage.add_category(name)
+    threading.Thread(target=bot.main, name='bot', daemon=True).start()
+    return bot
+
+
+def main():
+    """Запуск нагрузки."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--journeys', nargs='+', choices=list(JOURNEYS),
+                        default=list(JOURNEYS))
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--telegram-limits', action='store_true')
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    api.start()
+    configure(args, api)
+    bot = start_bot()
+
+    journeys = ['start'] + [name for name in args.journeys
+                            if name != 'start']
+    results = {'latency': [], 'errors': [], 'by_journey': defaultdict(list)}
+    threads = [threading.Thread(target=run_user, args=(
+        api, chat_id, journeys, args.timeout, results))
+        for chat_id in range(1, args.users + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    bot.bot.stop_polling()
+    bot.outbox.stop()
+    bot.render_engine.shutdown()
+    api.close()
+    report = {
+        'runtime': bot.RUNTIME,
+        'worker_processes': bot.WORKER_PROCESSES,
+        'storage_backend': bot.STORAGE_BACKEND,
+        'users': args.users,
+        'journeys': journeys,
+        'steps': len(results['latency']),
+        'errors': len(results['errors']),
+        'elapsed_s': elapsed,
+        'throughput_steps_per_s': len(results['latency']) / elapsed,
+        'latency': percentiles(results['latency']),
+        'latency_by_journey': {
+            name: percentiles(values)
+            for name, values in results['by_journey'].items()},
+        'api_calls': dict(api.calls),
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_children_mb': resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    if results['errors']:
+        report['failed_steps'] = results['errors'][:10]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Фейковый клиент Telegram для проверки режима webhook.
+
+Клиент отправляет POST-запросы с обновлениями от нескольких чатов
+и измеряет время ответа сервера, полную задержку до вызова
+обработчика и пропускную способность. По умолчанию поднимает
+локальный WebhookServer с ботом-заглушкой; с --url отправляет
+обновления на уже запущенный сервер (тогда измеряется только
+время ответа).
+
+    python benchmarks/webhook_client.py --updates 5000 --chats 200
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot import TeleBot  # noqa: E402
+
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+
+def make_update(update_id, chat_id):
+    """Обновление с текстовым сообщением от чата chat_id."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': str(update_id),
+        },
+    }
+
+
+def post(url, secret, update):
+    """Отправка обновления, возвращает код ответа."""
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port,
+                                            timeout=30)
+    body = json.dumps(update).encode()
+    connection.request('POST', parts.path, body=body, headers={
+        'Content-Type': 'application/json', SECRET_HEADER: secret})
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+def percentiles(values):
+    """p50/p95/p99 в миллисекундах."""
+    if len(values) < 2:
+        return {}
+    points = statistics.quantiles(values, n=100)
+    return {f'p{q}_ms': points[q - 1] * 1000 for q in (50, 95, 99)}
+
+
+def main():
+    """Запуск нагрузки."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--secret', default='local-secret')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--handler-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    sent_at = {}
+    handled_at = {}
+    done = threading.Event()
+    server = None
+    url = args.url
+    if url is None:
+        bot = TeleBot('0:local', threaded=False)
+
+        @bot.message_handler(func=lambda message: True)
+        def handle(message):
+            time.sleep(args.handler_ms / 1000)
+            handled_at[int(message.text)] = time.perf_counter()
+            if len(handled_at) == args.updates:
+                done.set()
+
+        server = WebhookServer(bot, host='127.0.0.1', port=0,
+                               secret=args.secret)
+        server.start()
+        url = f'http://127.0.0.1:{server.port}{server.path}'
+
+    acks = []
+
+    def send(update_id):
+        update = make_update(update_id, update_id % args.chats + 1)
+        sent_at[update_id] = time.perf_counter()
+        status = post(url, args.secret, update)
+        acks.append(time.perf_counter() - sent_at[update_id])
+        return status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = list(pool.map(send, range(1, args.updates + 1)))
+    errors = sum(status != 200 for status in statuses)
+    report = {'updates': args.updates, 'chats': args.chats,
+              'errors': errors, 'ack': percentiles(acks)}
+    if server is not None:
+        done.wait(timeout=60)
+        elapsed = max(handled_at.values()) - started
+        report['end_to_end'] = percentiles(
+            [handled_at[key] - sent_at[key] for key in handled_at])
+        report['throughput_per_s'] = len(handled_at) / elapsed
+        server.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,40 +2,66 @@
 
 import logging
 import os
-from typing import Dict, List, Literal, Tuple
+from concurrent.futures import BrokenExecutor, Future, TimeoutError
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, Literal, Optional, Tuple
 
-import matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
-import requests
 from dotenv import load_dotenv
-from telebot import TeleBot, types
-
-from db_functions import (add_user, db_connect, get_category_name,
-                          sql_all_category, sql_delete_expense,
-                          sql_delete_income, sql_for_chart, sql_for_graph,
-                          sql_for_graph_incomes, sql_for_table,
-                          sql_insert_category, sql_insert_expense,
-                          sql_insert_incomes, sql_records_10_expense,
-                          sql_records_10_incomes, sql_select_all_expenses_user,
-                          sql_select_all_incomes_user, sql_select_category,
-                          sql_select_id_category, sql_update_expense,
-                          sql_update_income)
+from telebot import TeleBot, apihelper, types
+
+from analytics import (INCOMES_HEADER, INCOMES_WIDTHS, TABLE_HEADER,
+                       TABLE_WIDTHS, downsample, to_points, to_xlsx)
+from cache import stats_cache, stats_key
+from exporter import (EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_MAX_FILE_SIZE,
+                      export_history)
+from images import image_pool
+from importer import (StatementError, download_document, import_statement,
+                      is_statement)
+from keyboards import keyboards, records_keyboard
+from metrics import (METRICS_PORT, PROFILER_ENABLED, instrument_bot, profiler,
+                     start_metrics_server, timer)
+from outbox import OUTBOX_GLOBAL_BURST, OUTBOX_GLOBAL_RATE, Outbox
+from render import RenderBusyError, plot_line, plot_pie, render_engine
+from runtime import WORKER_PROCESSES, run_async, run_polling
+from states import State, state_store
+from storage import RECORDS_PAGE_SIZE, STORAGE_BACKEND, storage
 from strings import (DELETE_RECORDS_ID, EDIT_RECORDS_ID, ERROR_NUMBER,
                      ERROR_NUMBER_ID, ERROR_RECORD_EMPTY, ERROR_RECORDS_ID,
-                     HELP_MSG, RETURN_MENU, send_instruction)
+                     ERROR_RENDER_BUSY, EXPORT_FORMAT, EXPORT_STARTED,
+                     EXPORT_TOO_LARGE, HELP_MSG, IMPORT_STARTED,
+                     IMPORT_UNSUPPORTED, RECORDS_STALE, RETURN_MENU,
+                     send_instruction)
+from supervisor import WorkerChannel, run_supervisor, serve_worker
+from webhook import (UPDATE_MODE, WEBHOOK_BATCH_SIZE, WEBHOOK_QUEUE_SIZE,
+                     run_webhook)
 
-matplotlib.use('Agg')
 load_dotenv()
 
 secret_token = os.getenv('TOKEN')
-bot = TeleBot(token=secret_token)
+# Адрес своего сервера Bot API, например 'http://localhost:8081/bot{0}/{1}'
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL
+    # Файлы отдает тот же сервер: .../file/bot{0}/{1}
+    apihelper.FILE_URL = TELEGRAM_API_URL.replace('/bot{0}/',
+                                                  '/file/bot{0}/')
+# sync - polling с пулом потоков TeleBot, async - AsyncTeleBot (runtime.py)
+RUNTIME = os.getenv('RUNTIME', 'sync')
+# Обработчики вызываются из собственных пулов режимов приема
+# обновлений, сообщения одного чата - по порядку
+bot = TeleBot(token=secret_token, threaded=False)
+# Общий лимит Telegram делится между процессами-обработчиками
+outbox = Outbox(bot, global_rate=OUTBOX_GLOBAL_RATE / WORKER_PROCESSES,
+                global_burst=max(1, OUTBOX_GLOBAL_BURST // WORKER_PROCESSES))
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
-    filename='main.log',
-    filemode='w'
+    handlers=[RotatingFileHandler(
+        os.getenv('LOG_FILE', 'main.log'),
+        maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        backupCount=int(os.getenv('LOG_BACKUP_COUNT', 5)),
+        encoding='utf-8')]
 )
 
 BUTTONS = ['Доход', 'Расход', 'Статистика доходов', 'Статистика расходов']
@@ -46,36 +72,78 @@ PERIODS = {
     'Квартал': '-3 month',
     'Год': 'start of year'
 }
+# Кнопки периодов для фильтра обработчика
+PERIOD_BUTTONS = frozenset(PERIODS)
+# Начало данных кнопок страниц записей: 'records:вид:действие:...'
+RECORDS_CALLBACK = 'records'
+RECORD_PAGES = {'income': storage.incomes_page,
+                'expense': storage.expenses_page}
+RECORDS_HEADER = {'income': 'Записи доходов:',
+                  'expense': 'Записи расходов:'}
+NO_RECORDS = {'edit': 'Нет записей для редактирования.',
+              'delete': 'Нет записей для удаления.'}
+# Сообщение со страницей записей чата: (id, текст), пока чат в списке
+records_messages: Dict[int, Tuple[int, str]] = {}
 ALL_CONTENT_TYPES = ['text', 'photo', 'sticker', 'document', 'video',
                      'audio', 'voice', 'location', 'contact', 'poll',
                      'venue', 'animation']
 
+keyboards.add('menu', BUTTONS[:2], BUTTONS[2:])
+keyboards.add('income', ['Добавить', 'Редактировать', 'Удалить', 'Назад'])
+keyboards.add('expense', ['Добавить', 'Редактировать', 'Удалить',
+                          'Добавить категорию', 'Назад'])
+keyboards.add('return', [RETURN_MENU])
+keyboards.add('periods', PERIODS)
+keyboards.add('stats_formats', ['Таблица', 'Диаграмма', 'График', 'Меню'])
+keyboards.add('export_formats', [*EXPORT_FORMATS, 'Меню'])
 
-con = db_connect()
+
+def set_state(message: types.Message, state: State, **data) -> None:
+    """Ожидание следующего сообщения чата в состоянии state."""
+    state_store.set(message.chat.id, state, data)
+
+
+@bot.message_handler(
+    func=lambda message: state_store.get(message.chat.id) is not None,
+    content_types=ALL_CONTENT_TYPES)
+def handle_state(message: types.Message) -> None:
+    """Передача сообщения обработчику текущего шага диалога."""
+    current = state_store.pop(message.chat.id)
+    if current is None:
+        return start(message)
+    state, data = current
+    handler = STATE_HANDLERS[state]
+    with timer('handler', handler.__name__):
+        handler(message, **data)
+    if (state in RECORD_ID_STATES.values()
+            and not in_state(message.chat.id, state)):
+        close_records_page(message.chat.id)
+
+
+def in_state(chat_id: int, state: State) -> bool:
+    """Чат ожидает следующего сообщения в состоянии state."""
+    current = state_store.get(chat_id)
+    return current is not None and current[0] == state
 
 
 @bot.message_handler(commands=['start'])
 def start(message: types.Message) -> None:
     """Стартовое сообщение."""
     name = message.from_user.first_name
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-
-    keyboard.add(*BUTTONS[:2])
-    keyboard.add(*BUTTONS[2:])
-
-    bot.send_message(
+    outbox.send_message(
         chat_id=message.chat.id,
         text=(f'Привет, {name}!\n Я бюджет-трекер для подробной '
               'информации используй команду /help. Выберите опцию:'),
-        reply_markup=keyboard,
+        reply_markup=keyboards.get('menu'),
     )
-    add_user(message.chat.id)
+    storage.add_user(message.chat.id)
 
 
 @bot.message_handler(commands=['help'])
 def help_commands(message: types.Message) -> None:
     """Помощь."""
-    bot.reply_to(message, HELP_MSG)
+    outbox.send_message(message.chat.id, HELP_MSG,
+                        reply_to_message_id=message.message_id)
 
 
 @bot.message_handler(func=lambda message: message.text in BUTTONS)
@@ -94,36 +162,27 @@ def handle_option(message: types.Message) -> None:
 def send_action_keyboard(message: types.Message,
                          action_type: Literal['income', 'expense']) -> None:
     """Кнопки у Дохода/Расхода."""
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-
-    if action_type == 'income':
-        keyboard.add('Добавить', 'Редактировать', 'Удалить', 'Назад')
-        text = (send_instruction(message.text))
-    elif action_type == 'expense':
-        keyboard.add('Добавить', 'Редактировать', 'Удалить',
-                     'Добавить категорию', 'Назад')
-        text = (send_instruction(message.text))
-    else:
+    if action_type not in ('income', 'expense'):
         return start(message)
 
-    bot.send_message(
+    outbox.send_message(
         chat_id=message.chat.id,
-        text=text,
-        reply_markup=keyboard,
+        text=send_instruction(message.text),
+        reply_markup=keyboards.get(action_type),
     )
-    bot.register_next_step_handler(message, process_action, action_type)
+    set_state(message, State.ACTION, action_type=action_type)
 
 
 def process_action(message: types.Message,
                    action_type: Literal['income', 'expense']) -> None:
     """Функции для Дохода/Расхода."""
     if message.text == 'Добавить':
-        hide_keyboard = types.ReplyKeyboardRemove()
         text = 'Введите сумму расходов, указав число в рублях:' if \
             action_type == 'expense' else 'Введите сумму дохода, ' \
                                           'указав число в рублях:'
-        bot.send_message(message.chat.id, text, reply_markup=hide_keyboard)
-        bot.register_next_step_handler(message, adding_records, action_type)
+        outbox.send_message(message.chat.id, text,
+                            reply_markup=keyboards.get('remove'))
+        set_state(message, State.ADD_AMOUNT, action_type=action_type)
     elif message.text == 'Редактировать':
         edit_function = edit_expense if \
             action_type == 'expense' else edit_income
@@ -137,7 +196,7 @@ def process_action(message: types.Message,
     elif message.text == 'Назад':
         start(message)
     else:
-        bot.send_message(message.chat.id, 'Таких функций нет')
+        outbox.send_message(message.chat.id, 'Таких функций нет')
         start(message)
 
 
@@ -147,17 +206,14 @@ def adding_records(message: types.Message,
     try:
         amount = float(message.text.strip())
         if action_type == 'income':
-            bot.send_message(message.chat.id, 'Введите описание дохода:')
-            bot.register_next_step_handler(
-                message, add_description_income, amount)
+            outbox.send_message(message.chat.id, 'Введите описание дохода:')
+            set_state(message, State.INCOME_DESCRIPTION, amount=amount)
         elif action_type == 'expense':
-            hide_keyboard = types.ReplyKeyboardRemove()
-            bot.send_message(message.chat.id, 'Введите описание расхода:',
-                             reply_markup=hide_keyboard)
-            bot.register_next_step_handler(
-                message, process_expense_description, amount)
+            outbox.send_message(message.chat.id, 'Введите описание расхода:',
+                                reply_markup=keyboards.get('remove'))
+            set_state(message, State.EXPENSE_DESCRIPTION, amount=amount)
     except ValueError:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             'Ошибка, вы отправили некорректную сумму.')
         start(message)
@@ -165,75 +221,195 @@ def adding_records(message: types.Message,
 
 def add_category(message: types.Message) -> None:
     """Добавление новой категории."""
-    hide_keyboard = types.ReplyKeyboardRemove()
-    bot.send_message(
+    outbox.send_message(
         message.chat.id, 'Введите новую категорию:',
-        reply_markup=hide_keyboard)
+        reply_markup=keyboards.get('remove'))
+    set_state(message, State.NEW_CATEGORY)
 
-    def handle_new_category(msg):
-        new_category = str(msg.text)
 
-        if sql_select_category(new_category) is not None:
-            bot.send_message(
-                msg.chat.id,
-                f'Категория "{new_category}" уже существует. '
-                f'Пожалуйста, введите другое название.')
-            return add_category(msg)
+def handle_new_category(message: types.Message) -> None:
+    """Сохранение новой категории."""
+    new_category = str(message.text)
 
-        sql_insert_category(new_category)
-        bot.send_message(
-            msg.chat.id, f'Категория "{new_category}" успешно добавлена!')
-        start(msg)
+    if storage.category_id(new_category) is not None:
+        outbox.send_message(
+            message.chat.id,
+            f'Категория "{new_category}" уже существует. '
+            f'Пожалуйста, введите другое название.')
+        return add_category(message)
 
-    bot.register_next_step_handler(message, handle_new_category)
+    storage.add_category(new_category)
+    outbox.send_message(
+        message.chat.id, f'Категория "{new_category}" успешно добавлена!')
+    start(message)
 
 
 def add_description_income(message: types.Message, amount: float) -> None:
     """Добавление новой записи дохода в БД."""
-    sql_insert_incomes(amount, message.text, message.chat.id)
-    bot.send_message(message.chat.id, 'Доход успешно добавлен!')
+    storage.add_income(amount, message.text, message.chat.id)
+    outbox.send_message(message.chat.id, 'Доход успешно добавлен!')
     start(message)
 
 
-def edit_income(message: types.Message) -> None:
-    """Лист последних 10 записей дохода -> изменение записи."""
-    list_income = sql_records_10_incomes(message.chat.id)
-    if not list_income:
-        bot.send_message(message.chat.id,
-                         'Нет записей для редактирования.')
+def record_line(kind: str, record: tuple) -> str:
+    """Строка записи дохода или расхода в списке."""
+    if kind == 'income':
+        return (f'ID: {record[0]}, Сумма: {record[1]}, '
+                f'Описание: {record[2]}, Дата: {record[3]}')
+    return (f'ID: {record[0]}, Сумма: {record[1]}, Категория: {record[2]}, '
+            f'Описание: {record[3]}, Дата: {record[4]}')
+
+
+def records_page(chat_id: int, kind: str, action: str,
+                 before_id: Optional[int] = None,
+                 after_id: Optional[int] = None
+                 ) -> Optional[Tuple[str, types.InlineKeyboardMarkup]]:
+    """Страница записей: текст и кнопки выбора записи и соседних страниц.
+
+    Записи выбираются по ключу: с id меньше before_id или больше
+    after_id, поэтому любая страница - один запрос по индексу. Лишняя
+    запись в запросе показывает, есть ли следующая страница. Если
+    соседняя страница пуста (записи удалены), показывается первая;
+    None - записей нет.
+    """
+    rows = RECORD_PAGES[kind](chat_id, before_id, after_id,
+                              RECORDS_PAGE_SIZE + 1)
+    if after_id is None:
+        has_older = len(rows) > RECORDS_PAGE_SIZE
+        has_newer = before_id is not None
+        rows = rows[:RECORDS_PAGE_SIZE]
+    else:
+        has_older = True
+        has_newer = len(rows) > RECORDS_PAGE_SIZE
+        rows = rows[-RECORDS_PAGE_SIZE:]
+    if not rows:
+        if before_id is None and after_id is None:
+            return None
+        return records_page(chat_id, kind, action)
+    description = 2 if kind == 'income' else 3
+    markup = records_keyboard(
+        f'{RECORDS_CALLBACK}:{kind}:{action}',
+        [(row[0], f'{row[0]}: {row[1]} {row[description]}') for row in rows],
+        newer_id=rows[0][0] if has_newer else None,
+        older_id=rows[-1][0] if has_older else None)
+    lines = [RECORDS_HEADER[kind]] + [record_line(kind, row) for row in rows]
+    return '\n'.join(lines), markup
+
+
+def show_records(message: types.Message, kind: str, action: str) -> None:
+    """Первая страница записей и ожидание выбора записи.
+
+    Запись выбирается кнопкой под страницей или вводом ее ID.
+    """
+    page = records_page(message.chat.id, kind, action)
+    if page is None:
+        outbox.send_message(message.chat.id, NO_RECORDS[action])
         return start(message)
-    response = 'Последние 10 записей:\n'
-    for record in list_income:
-        response += f'ID: {record[0]}, ' \
-                    f'Сумма: {record[1]}, ' \
-                    f'Описание: {record[2]}, ' \
-                    f'Дата: {record[3]}\n'
-    bot.send_message(message.chat.id, response)
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(RETURN_MENU)
-    bot.send_message(message.chat.id,
-                     EDIT_RECORDS_ID,
-                     reply_markup=keyboard)
-    bot.register_next_step_handler(message, edit_income_by_id)
+    text, markup = page
+    # Состояние ставится до отправки: страница запоминается, только
+    # если чат еще в списке
+    state = RECORD_ID_STATES[kind, action]
+    set_state(message, state)
+    outbox.send_message(message.chat.id, text,
+                        reply_markup=markup).add_done_callback(
+        lambda sent: remember_records_page(message.chat.id, state, sent))
+    outbox.send_message(message.chat.id,
+                        EDIT_RECORDS_ID if action == 'edit'
+                        else DELETE_RECORDS_ID,
+                        reply_markup=keyboards.get('return'))
+
+
+def remember_records_page(chat_id: int, state: State,
+                          sent: Future) -> None:
+    """Запоминание отправленной страницы записей, чтобы убрать ее кнопки."""
+    if sent.exception() is not None:
+        return
+    page = sent.result()
+    records_messages[chat_id] = (page.message_id, page.text)
+    # Чат мог уйти из списка, пока страница отправлялась
+    if not in_state(chat_id, state):
+        close_records_page(chat_id)
+
+
+def close_records_page(chat_id: int) -> None:
+    """Удаление кнопок страницы записей, когда чат ушел из списка."""
+    page = records_messages.pop(chat_id, None)
+    if page is not None:
+        outbox.edit_message_text(chat_id, *page)
+
+
+def read_record_id(message: types.Message, kind: str,
+                   action: str) -> Optional[int]:
+    """ID записи из сообщения, при ошибке ID запрашивается снова."""
+    try:
+        return int(message.text)
+    except ValueError:
+        outbox.send_message(message.chat.id, ERROR_NUMBER_ID)
+        set_state(message, RECORD_ID_STATES[kind, action])
+        return None
+
+
+@bot.callback_query_handler(
+    func=lambda call: call.data.startswith(RECORDS_CALLBACK + ':'))
+def handle_records_page(call: types.CallbackQuery) -> None:
+    """Кнопки под страницей записей: соседняя страница или выбор записи.
+
+    Страница заменяется в том же сообщении, новых сообщений нет.
+    Кнопки действуют, только пока чат ждет выбора записи этого списка:
+    после выхода из списка они не должны менять записи и сбивать
+    текущий диалог.
+    """
+    _, kind, action, command, record_id = call.data.split(':')
+    message = call.message
+    state = RECORD_ID_STATES[kind, action]
+    current = records_messages.get(message.chat.id)
+    if (not in_state(message.chat.id, state) or current is not None
+            and current[0] != message.message_id):
+        bot.answer_callback_query(call.id, RECORDS_STALE)
+        outbox.edit_message_text(message.chat.id, message.message_id,
+                                 message.text)
+        return
+    bot.answer_callback_query(call.id)
+    if command == 'pick':
+        # Кнопки выбранной страницы больше не нужны
+        records_messages.pop(message.chat.id, None)
+        outbox.edit_message_text(message.chat.id, message.message_id,
+                                 message.text)
+        # Ответы адресованы пользователю, а не автору страницы - боту
+        message.from_user = call.from_user
+        state_store.pop(message.chat.id)
+        return RECORD_ACTIONS[kind, action](message, int(record_id))
+    key = 'before_id' if command == 'older' else 'after_id'
+    page = records_page(message.chat.id, kind, action,
+                        **{key: int(record_id)})
+    text, markup = page if page is not None else (NO_RECORDS[action], None)
+    records_messages[message.chat.id] = (message.message_id, text)
+    outbox.edit_message_text(message.chat.id, message.message_id, text,
+                             reply_markup=markup)
+
+
+def edit_income(message: types.Message) -> None:
+    """Страница записей дохода -> изменение записи."""
+    show_records(message, 'income', 'edit')
 
 
 def edit_income_by_id(message: types.Message) -> None:
-    """Изменение записи Дохода по id."""
+    """Изменение записи Дохода по введенному id."""
     if message.text == RETURN_MENU:
         return start(message)
-    try:
-        income_id = int(message.text)
-    except ValueError:
-        bot.send_message(
-            message.chat.id,
-            ERROR_NUMBER_ID)
-        return edit_income(message)
-    choice_income = sql_select_all_incomes_user(income_id, message.chat.id)
+    income_id = read_record_id(message, 'income', 'edit')
+    if income_id is not None:
+        select_income(message, income_id)
+
+
+def select_income(message: types.Message, income_id: int) -> None:
+    """Выбор записи Дохода для изменения."""
+    choice_income = storage.get_income(income_id, message.chat.id)
     if not choice_income:
-        bot.send_message(message.chat.id, ERROR_RECORDS_ID)
-        return edit_income(message)
-    bot.send_message(message.chat.id, 'Введите новую сумму:')
-    bot.register_next_step_handler(message, process_new_amount, income_id)
+        outbox.send_message(message.chat.id, ERROR_RECORDS_ID)
+        return set_state(message, State.EDIT_INCOME_ID)
+    outbox.send_message(message.chat.id, 'Введите новую сумму:')
+    set_state(message, State.EDIT_INCOME_AMOUNT, income_id=income_id)
 
 
 def process_new_amount(message: types.Message, income_id: int) -> None:
@@ -243,59 +419,43 @@ def process_new_amount(message: types.Message, income_id: int) -> None:
         if new_amount < 1:
             raise ValueError(ERROR_NUMBER)
     except ValueError:
-        bot.send_message(message.chat.id, ERROR_NUMBER)
+        outbox.send_message(message.chat.id, ERROR_NUMBER)
         return edit_income(message)
-    bot.send_message(message.chat.id, 'Введите новое описание:')
-    bot.register_next_step_handler(message, finalize_edit, income_id,
-                                   new_amount)
+    outbox.send_message(message.chat.id, 'Введите новое описание:')
+    set_state(message, State.EDIT_INCOME_DESCRIPTION,
+              income_id=income_id, amount=new_amount)
 
 
 def finalize_edit(message: types.Message,
                   income_id: int, amount: float) -> None:
     """Редактирование описания у записи дохода."""
-    sql_update_income(amount, message.text, income_id)
-    bot.send_message(message.chat.id, 'Доход успешно обновлен!')
+    storage.update_income(amount, message.text, income_id, message.chat.id)
+    outbox.send_message(message.chat.id, 'Доход успешно обновлен!')
     start(message)
 
 
 def delete_income(message: types.Message) -> None:
-    """Вывод всех записей дохода для удаления."""
-    list_income = sql_records_10_incomes(message.chat.id)
-    if not list_income:
-        bot.send_message(message.chat.id, 'Нет записей для удаления.')
-        return start(message)
-    response = 'Последние 10 записей:\n'
-    for record in list_income:
-        response += f'ID: {record[0]}, ' \
-                    f'Сумма: {record[1]}, ' \
-                    f'Описание: {record[2]}, ' \
-                    f'Дата: {record[3]}\n'
-    bot.send_message(message.chat.id, response)
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(RETURN_MENU)
-    bot.send_message(message.chat.id,
-                     DELETE_RECORDS_ID,
-                     reply_markup=keyboard)
-    bot.register_next_step_handler(message, process_delete_id)
+    """Страница записей дохода для удаления."""
+    show_records(message, 'income', 'delete')
 
 
 def process_delete_id(message: types.Message) -> None:
-    """Удаление записи Дохода."""
+    """Удаление записи Дохода по введенному id."""
     if message.text == RETURN_MENU:
         return start(message)
-    try:
-        income_id = int(message.text)
-    except ValueError:
-        bot.send_message(
-            message.chat.id,
-            ERROR_NUMBER_ID)
-        return delete_income(message)
-    choice_income = sql_select_all_incomes_user(income_id, message.chat.id)
+    income_id = read_record_id(message, 'income', 'delete')
+    if income_id is not None:
+        remove_income(message, income_id)
+
+
+def remove_income(message: types.Message, income_id: int) -> None:
+    """Удаление записи Дохода."""
+    choice_income = storage.get_income(income_id, message.chat.id)
     if not choice_income:
-        bot.send_message(message.chat.id, ERROR_RECORDS_ID)
+        outbox.send_message(message.chat.id, ERROR_RECORDS_ID)
         return start(message)
-    sql_delete_income(income_id, message.chat.id)
-    bot.send_message(message.chat.id, 'Доход успешно удален!')
+    storage.delete_income(income_id, message.chat.id)
+    outbox.send_message(message.chat.id, 'Доход успешно удален!')
     start(message)
 
 
@@ -303,20 +463,15 @@ def process_expense_description(message: types.Message,
                                 amount: float) -> None:
     """Добавление описания у новой записи расхода."""
     description = message.text.strip()
-    categories = sql_all_category()
-
-    if categories:
-        category_buttons = [cat[1] for cat in categories]
-        category_keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        for category in category_buttons:
-            category_keyboard.add(category)
-        bot.send_message(message.chat.id, 'Выберите категорию:',
-                         reply_markup=category_keyboard)
-        bot.register_next_step_handler(
-            message, process_expense_category,
-            amount, description, categories)
+    category_keyboard = keyboards.categories(storage.categories())
+
+    if category_keyboard is not None:
+        outbox.send_message(message.chat.id, 'Выберите категорию:',
+                            reply_markup=category_keyboard)
+        set_state(message, State.EXPENSE_CATEGORY,
+                  amount=amount, description=description)
     else:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             'Нет категорий. '
             'Укажи новую категорию и попробуй заново создать запись о расходе')
@@ -325,72 +480,49 @@ def process_expense_description(message: types.Message,
 
 
 def process_expense_category(message: types.Message, amount: float,
-                             description: str,
-                             categories: List[Tuple[int, str]]) -> None:
+                             description: str) -> None:
     """Выбор категории у новой записи расхода."""
     selected_category = message.text.strip()
-
-    category_id = None
-    for cat in categories:
-        if cat[1] == selected_category:
-            category_id = cat[0]
-            break
+    category_id = storage.category_id(selected_category)
 
     if category_id is None:
         if selected_category == 'Назад':
             return process_action(message, 'expense')
-        bot.send_message(message.chat.id,
-                         'Категория не найдена. Пожалуйста, выберите снова.')
+        outbox.send_message(
+            message.chat.id,
+            'Категория не найдена. Пожалуйста, выберите снова.')
         return process_expense_description(message,
                                            amount)
-    sql_insert_expense(amount, description, category_id, message.chat.id)
-    bot.send_message(message.chat.id,
-                     f'Расход в размере {amount} с описанием "{description}" '
-                     f'успешно добавлен в категорию "{selected_category}".')
+    storage.add_expense(amount, description, category_id, message.chat.id)
+    outbox.send_message(
+        message.chat.id,
+        f'Расход в размере {amount} с описанием "{description}" '
+        f'успешно добавлен в категорию "{selected_category}".')
     start(message)
 
 
 def edit_expense(message: types.Message) -> None:
-    """Вывод 10 записей расхода -> для редактирования."""
-    list_expense = sql_records_10_expense(message.chat.id)
-    if not list_expense:
-        bot.send_message(message.chat.id,
-                         'Нет записей расходов для редактирования.')
-        return start(message)
-    response = 'Последние 10 записей:\n'
-    for record in list_expense:
-        response += f'ID: {record[0]}, ' \
-                    f'Сумма: {record[1]}, ' \
-                    f'Категория: {record[2]}, ' \
-                    f'Описание: {record[3]}, ' \
-                    f'Дата: {record[4]}\n'
-    bot.send_message(message.chat.id, response)
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(RETURN_MENU)
-    bot.send_message(message.chat.id,
-                     EDIT_RECORDS_ID,
-                     reply_markup=keyboard)
-    bot.register_next_step_handler(message, process_edit_id_expense)
+    """Страница записей расхода -> для редактирования."""
+    show_records(message, 'expense', 'edit')
 
 
 def process_edit_id_expense(message: types.Message) -> None:
-    """Выбор записи расхода по id для редактирования."""
+    """Выбор записи расхода по введенному id для редактирования."""
     if message.text == RETURN_MENU:
         return start(message)
-    try:
-        expense_id = int(message.text)
-    except ValueError:
-        bot.send_message(
-            message.chat.id,
-            'Пожалуйста, введите действительный ID (целое число)')
-        return edit_expense(message)
-    choice_expense = sql_select_all_expenses_user(expense_id, message.chat.id)
+    expense_id = read_record_id(message, 'expense', 'edit')
+    if expense_id is not None:
+        select_expense(message, expense_id)
+
+
+def select_expense(message: types.Message, expense_id: int) -> None:
+    """Выбор записи расхода для редактирования."""
+    choice_expense = storage.get_expense(expense_id, message.chat.id)
     if not choice_expense:
-        bot.send_message(message.chat.id, 'Запись с таким ID не найдена.')
-        return edit_expense(message)
-    bot.send_message(message.chat.id, 'Введите новую сумму:')
-    bot.register_next_step_handler(
-        message, process_new_amount_expense, expense_id)
+        outbox.send_message(message.chat.id, ERROR_RECORDS_ID)
+        return set_state(message, State.EDIT_EXPENSE_ID)
+    outbox.send_message(message.chat.id, 'Введите новую сумму:')
+    set_state(message, State.EDIT_EXPENSE_AMOUNT, expense_id=expense_id)
 
 
 def process_new_amount_expense(message: types.Message,
@@ -401,13 +533,13 @@ def process_new_amount_expense(message: types.Message,
         if new_amount < 1:
             raise ValueError(ERROR_NUMBER)
     except ValueError:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             ERROR_NUMBER)
         return process_edit_id_expense(message)
-    bot.send_message(message.chat.id, 'Введите новое описание:')
-    bot.register_next_step_handler(message, process_new_category_expense,
-                                   expense_id, new_amount)
+    outbox.send_message(message.chat.id, 'Введите новое описание:')
+    set_state(message, State.EDIT_EXPENSE_DESCRIPTION,
+              expense_id=expense_id, new_amount=new_amount)
 
 
 def process_new_category_expense(message: types.Message,
@@ -415,21 +547,16 @@ def process_new_category_expense(message: types.Message,
                                  new_amount: float) -> None:
     """Редактирование описания у редактируемой записи."""
     new_description = message.text.strip()
-    categories = sql_all_category()
-    if categories:
-        category_buttons = [cat[1] for cat in
-                            categories]
-        category_keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        for category in category_buttons:
-            category_keyboard.add(category)
-        category_keyboard.add('Назад')
-        bot.send_message(message.chat.id, 'Выберите категорию:',
-                         reply_markup=category_keyboard)
-        bot.register_next_step_handler(
-            message,
-            finalize_edit_expense, expense_id, new_amount, new_description)
+    category_keyboard = keyboards.categories(storage.categories(),
+                                             back=True)
+    if category_keyboard is not None:
+        outbox.send_message(message.chat.id, 'Выберите категорию:',
+                            reply_markup=category_keyboard)
+        set_state(message, State.EDIT_EXPENSE_CATEGORY,
+                  expense_id=expense_id, new_amount=new_amount,
+                  new_description=new_description)
     else:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             'Нет категорий. Пожалуйста, добавьте категорию сначала.')
         return process_new_amount_expense(message, expense_id)
@@ -438,83 +565,61 @@ def process_new_category_expense(message: types.Message,
 def finalize_edit_expense(message: types.Message, expense_id: int,
                           new_amount: float, new_description: str) -> None:
     """Выбор категории для записи Расхода."""
-    category_result = sql_select_id_category(message.text)
-    if category_result:
-        sql_update_expense(new_amount, new_description,
-                           category_result[0], expense_id)
-        bot.send_message(message.chat.id, 'Расход успешно обновлен!')
+    category_id = storage.category_id(message.text)
+    if category_id is not None:
+        storage.update_expense(new_amount, new_description, category_id,
+                               expense_id, message.chat.id)
+        outbox.send_message(message.chat.id, 'Расход успешно обновлен!')
         start(message)
     else:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             'Категория не найдена! Пожалуйста, введите корректную категорию.')
-        bot.register_next_step_handler(
-            message,
-            finalize_edit_expense, expense_id, new_amount, new_description)
+        set_state(message, State.EDIT_EXPENSE_CATEGORY,
+                  expense_id=expense_id, new_amount=new_amount,
+                  new_description=new_description)
 
 
 def delete_expense(message: types.Message) -> None:
-    """Вывод 10 записей расхода перед удалением."""
-    list_income = sql_records_10_expense(message.chat.id)
-    if not list_income:
-        bot.send_message(message.chat.id, 'Нет записей для удаления.')
-        return start(message)
-    response = 'Последние 10 записей:\n'
-    for record in list_income:
-        response += (f'ID: {record[0]}, '
-                     f'Сумма: {record[1]}, '
-                     f'Описание: {record[2]}, '
-                     f'Категория: {record[3]}'
-                     f'Дата: {record[4]}\n')
-    bot.send_message(message.chat.id, response)
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(RETURN_MENU)
-    bot.send_message(message.chat.id,
-                     DELETE_RECORDS_ID,
-                     reply_markup=keyboard)
-    bot.register_next_step_handler(message, process_delete_id_expense)
+    """Страница записей расхода перед удалением."""
+    show_records(message, 'expense', 'delete')
 
 
 def process_delete_id_expense(message: types.Message) -> None:
-    """Удаление записи Расхода."""
+    """Удаление записи Расхода по введенному id."""
     if message.text == RETURN_MENU:
         return start(message)
-    try:
-        income_id = int(message.text)
-    except ValueError:
-        bot.send_message(
-            message.chat.id,
-            'Пожалуйста, введите действительный ID (целое число)')
-        return edit_expense(message)
-    choice_income = sql_select_all_expenses_user(income_id, message.chat.id)
-    if not choice_income:
-        bot.send_message(message.chat.id, 'Запись с таким ID не найдена.')
+    expense_id = read_record_id(message, 'expense', 'delete')
+    if expense_id is not None:
+        remove_expense(message, expense_id)
+
+
+def remove_expense(message: types.Message, expense_id: int) -> None:
+    """Удаление записи Расхода."""
+    choice_expense = storage.get_expense(expense_id, message.chat.id)
+    if not choice_expense:
+        outbox.send_message(message.chat.id, ERROR_RECORDS_ID)
         return start(message)
-    sql_delete_expense(income_id, message.chat.id)
-    bot.send_message(message.chat.id, 'Расход успешно удален!')
+    storage.delete_expense(expense_id, message.chat.id)
+    outbox.send_message(message.chat.id, 'Расход успешно удален!')
     start(message)
 
 
 def ask_period(message: types.Message) -> None:
     """Кнопки для выбора периода."""
-    markup = types.ReplyKeyboardMarkup(
-        resize_keyboard=True)
-    markup.add(*list(PERIODS.keys()))
-    bot.send_message(message.chat.id, 'Выберите период:', reply_markup=markup)
+    outbox.send_message(message.chat.id, 'Выберите период:',
+                        reply_markup=keyboards.get('periods'))
 
 
 @bot.message_handler(
-    func=lambda message: message.text in list(PERIODS.keys()))
+    func=lambda message: message.text in PERIOD_BUTTONS)
 def handle_period_selection(message: types.Message) -> None:
     """Кнопки для выбора периода для получения статистики по Расходам."""
     user_periods = PERIODS.get(message.text)
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add('Таблица', 'Диаграмма', 'График', 'Меню')
-    bot.send_message(message.chat.id,
-                     'Выберите формат отображения:',
-                     reply_markup=markup)
-    bot.register_next_step_handler(message, handle_format_selection,
-                                   user_periods)
+    outbox.send_message(message.chat.id,
+                        'Выберите формат отображения:',
+                        reply_markup=keyboards.get('stats_formats'))
+    set_state(message, State.STATS_FORMAT, user_periods=user_periods)
 
 
 def handle_format_selection(message: types.Message,
@@ -533,29 +638,146 @@ def handle_format_selection(message: types.Message,
         else:
             raise ValueError()
     except ValueError:
-        bot.send_message(message.chat.id, 'Неверный выбор формата')
+        outbox.send_message(message.chat.id, 'Неверный выбор формата')
         start(message)
 
 
+@bot.message_handler(commands=['export'])
+def export_command(message: types.Message) -> None:
+    """Кнопки для выбора формата выгрузки всей истории."""
+    outbox.send_message(message.chat.id, EXPORT_FORMAT,
+                        reply_markup=keyboards.get('export_formats'))
+    set_state(message, State.EXPORT_FORMAT)
+
+
+def process_export_format(message: types.Message) -> None:
+    """Выгрузка всех доходов и расходов в выбранном формате."""
+    if message.text not in EXPORT_FORMATS:
+        if message.text != 'Меню':
+            outbox.send_message(message.chat.id, 'Неверный выбор формата')
+        return start(message)
+    outbox.send_message(message.chat.id, EXPORT_STARTED,
+                        reply_markup=keyboards.get('remove'))
+    with timer('query', export_history.__name__):
+        export = export_history(
+            storage.export_records(message.chat.id, EXPORT_CHUNK_SIZE),
+            message.text)
+    if not export.rows:
+        export.file.close()
+        outbox.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+        return start(message)
+    if export.size > EXPORT_MAX_FILE_SIZE:
+        export.file.close()
+        outbox.send_message(message.chat.id, EXPORT_TOO_LARGE)
+        return start(message)
+    outbox.send_document(message.chat.id, export.file,
+                         visible_file_name=export.file_name,
+                         caption=f'Записей: {export.rows}'
+                         ).add_done_callback(lambda _: export.file.close())
+    start(message)
+
+
+STATE_HANDLERS: Dict[State, Callable[..., None]] = {
+    State.ACTION: process_action,
+    State.ADD_AMOUNT: adding_records,
+    State.NEW_CATEGORY: handle_new_category,
+    State.INCOME_DESCRIPTION: add_description_income,
+    State.EDIT_INCOME_ID: edit_income_by_id,
+    State.EDIT_INCOME_AMOUNT: process_new_amount,
+    State.EDIT_INCOME_DESCRIPTION: finalize_edit,
+    State.DELETE_INCOME_ID: process_delete_id,
+    State.EXPENSE_DESCRIPTION: process_expense_description,
+    State.EXPENSE_CATEGORY: process_expense_category,
+    State.EDIT_EXPENSE_ID: process_edit_id_expense,
+    State.EDIT_EXPENSE_AMOUNT: process_new_amount_expense,
+    State.EDIT_EXPENSE_DESCRIPTION: process_new_category_expense,
+    State.EDIT_EXPENSE_CATEGORY: finalize_edit_expense,
+    State.DELETE_EXPENSE_ID: process_delete_id_expense,
+    State.STATS_FORMAT: handle_format_selection,
+    State.EXPORT_FORMAT: process_export_format,
+}
+# Состояние ввода ID записи и действие с выбранной записью
+RECORD_ID_STATES = {
+    ('income', 'edit'): State.EDIT_INCOME_ID,
+    ('income', 'delete'): State.DELETE_INCOME_ID,
+    ('expense', 'edit'): State.EDIT_EXPENSE_ID,
+    ('expense', 'delete'): State.DELETE_EXPENSE_ID,
+}
+RECORD_ACTIONS: Dict[Tuple[str, str], Callable[[types.Message, int], None]] = {
+    ('income', 'edit'): select_income,
+    ('income', 'delete'): remove_income,
+    ('expense', 'edit'): select_expense,
+    ('expense', 'delete'): remove_expense,
+}
+
+
+def render_statistics(message: types.Message,
+                      plot: Callable[..., bytes], *args,
+                      **kwargs) -> Optional[bytes]:
+    """Построение графика в пуле процессов.
+
+    None - пул перегружен, не успел или сломан; пользователь получает
+    сообщение об этом, а обработчик отвечает без графика.
+    """
+    try:
+        with timer('render', plot.__name__):
+            return render_engine.render(plot, *args, **kwargs)
+    except (RenderBusyError, TimeoutError, BrokenExecutor):
+        logging.warning(f'Не удалось построить график для {message.chat.id}')
+        outbox.send_message(message.chat.id, ERROR_RENDER_BUSY)
+        return None
+
+
+def send_total(message: types.Message, total: float) -> None:
+    """Ответ текстом, когда график построить не удалось."""
+    outbox.send_message(message.chat.id,
+                        f'Всего расходов за выбранный период: {total}')
+    start(message)
+
+
+def remember_file_id(report: dict, kind: Literal['photo', 'document'],
+                     sent: Future) -> None:
+    """Замена файла отчета на file_id после успешной отправки."""
+    if sent.exception() is not None:
+        return
+    message = sent.result()
+    report[kind] = (message.photo[-1].file_id if kind == 'photo'
+                    else message.document.file_id)
+
+
+def send_report_photo(chat_id: int, report: dict,
+                      caption: Optional[str] = None) -> None:
+    """Отправка графика отчета, повторно - по file_id."""
+    outbox.send_photo(chat_id, report['photo'], caption=caption
+                      ).add_done_callback(
+        lambda sent: remember_file_id(report, 'photo', sent))
+
+
+def send_report_document(chat_id: int, report: dict, file_name: str) -> None:
+    """Отправка таблицы отчета, повторно - по file_id."""
+    outbox.send_document(chat_id, report['document'],
+                         visible_file_name=file_name).add_done_callback(
+        lambda sent: remember_file_id(report, 'document', sent))
+
+
 def show_table_statistics(message: types.Message,
                           user_periods: Dict[str, str]) -> None:
     """Статистика в виде таблице (топ 5 больших затрат)."""
     client_id = message.chat.id
-    top_expenses = pd.read_sql_query(
-        sql_for_table(user_periods, client_id), con)
-    total_expenses = top_expenses['amount'].sum()
-    if not total_expenses:
-        bot.send_message(message.chat.id, ERROR_RECORD_EMPTY)
-        return start(message)
-    file_name = f'top_expenses_{client_id}.xlsx'
-    top_expenses.to_excel(file_name, index=True)
-
-    with open(file_name, 'rb') as file:
-        bot.send_document(message.chat.id, file)
-        bot.send_message(
-            message.chat.id,
-            'Таблица - Топ 5 крупных затрат за указанный период отправлен')
-    os.remove(file_name)
+    key = stats_key(client_id, user_periods, 'table')
+    report = stats_cache.get(key)
+    if report is None:
+        top_expenses = storage.top_expenses(user_periods, client_id)
+        if not top_expenses:
+            outbox.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+            return start(message)
+        report = {'document': to_xlsx(TABLE_HEADER, top_expenses,
+                                      TABLE_WIDTHS)}
+        stats_cache.put(key, report)
+    send_report_document(message.chat.id, report, 'top_expenses.xlsx')
+    outbox.send_message(
+        message.chat.id,
+        'Таблица - Топ 5 крупных затрат за указанный период отправлен')
     start(message)
 
 
@@ -563,43 +785,26 @@ def show_graph_statistics(message: types.Message,
                           user_periods: Dict[str, str]) -> None:
     """Статистика в виде графика."""
     client_id = message.chat.id
-    choice_expenses = pd.read_sql_query(
-        sql_for_graph(user_periods, client_id), con)
-
-    # преобразование столбца date_added и amount к нужному формату
-    choice_expenses['date_added'] = pd.to_datetime(
-        choice_expenses['date_added'])
-    total_expenses = choice_expenses['amount'].sum()
-    if not total_expenses:
-        bot.send_message(message.chat.id, ERROR_RECORD_EMPTY)
-        return start(message)
-    choice_expenses['amount'] = pd.to_numeric(choice_expenses['amount'],
-                                              errors='coerce')
-    choice_expenses = choice_expenses.sort_values(by='date_added')
-    file_name = f'expenses_{client_id}.xlsx'
-    choice_expenses.to_excel(file_name, index=True)
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(choice_expenses['date_added'], choice_expenses['amount'],
-             marker='o', linewidth=2,
-             color='skyblue', label='Расходы по датам')
-    plt.xlabel('Дата')
-    plt.ylabel('Сумма, руб')
-    plt.title('Расход за выбранный период')
-    plt.xticks(rotation=45)
-    plt.grid()
-    plt.legend()
-    graph_file_name = f'choice_expenses_graph_{client_id}.png'
-    plt.tight_layout()
-    plt.savefig(graph_file_name)
-    plt.close()
-    with open(graph_file_name, 'rb') as graph_file:
-        bot.send_photo(message.chat.id, graph_file)
-
-    bot.send_message(message.chat.id,
-                     f'Всего расходов за выбранный период: {total_expenses}')
-    os.remove(file_name)
-    os.remove(graph_file_name)
+    key = stats_key(client_id, user_periods, 'graph')
+    report = stats_cache.get(key)
+    if report is None:
+        total_expenses = storage.expenses_total(user_periods, client_id)
+        if not total_expenses:
+            outbox.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+            return start(message)
+        points = downsample(storage.expense_points(user_periods, client_id))
+        graph = render_statistics(
+            message, plot_line, points['date'], points['amount'],
+            'Расход за выбранный период', label='Расходы по датам')
+        if graph is None:
+            return send_total(message, total_expenses)
+        report = {'photo': graph, 'total': total_expenses}
+        stats_cache.put(key, report)
+    send_report_photo(message.chat.id, report)
+
+    outbox.send_message(
+        message.chat.id,
+        f'Всего расходов за выбранный период: {report["total"]}')
     start(message)
 
 
@@ -607,78 +812,85 @@ def show_chart_statistics(message: types.Message,
                           user_periods: Dict[str, str]) -> None:
     """Статистика в виде круговой диаграммы с распределением по категориям."""
     client_id = message.chat.id
-    category_expenses = pd.read_sql_query(
-        sql_for_chart(user_periods, client_id), con)
-    # Получаем категории по id
-    category_expenses['category'] = category_expenses['category_id'].apply(
-        get_category_name)
-
-    total_expenses = category_expenses['total_amount'].sum()
-    if not total_expenses:
-        bot.send_message(message.chat.id, ERROR_RECORD_EMPTY)
-        return start(message)
-    plt.figure(figsize=(10, 6))
-    plt.pie(
-        category_expenses['total_amount'],
-        labels=category_expenses['category'],
-        autopct='%.1f%%',
-    )
-    plt.title('Распределение расходов по категориям')
-    plt.axis('equal')
-
-    graph_file_name = f'category_expenses_graph_{client_id}.png'
-    plt.savefig(graph_file_name)
-    plt.close()
-
-    with open(graph_file_name, 'rb') as graph_file:
-        bot.send_photo(message.chat.id, graph_file)
-
-    total_expenses = category_expenses['total_amount'].sum()
-    bot.send_message(message.chat.id,
-                     f'Всего расходов за выбранный период: {total_expenses}')
-    os.remove(graph_file_name)
+    key = stats_key(client_id, user_periods, 'chart')
+    report = stats_cache.get(key)
+    if report is None:
+        category_expenses = storage.category_totals(user_periods, client_id)
+        # Суммы по категориям уже посчитаны хранилищем
+        total_expenses = sum(row[0] for row in category_expenses)
+        if not total_expenses:
+            outbox.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+            return start(message)
+        graph = render_statistics(
+            message, plot_pie, [row[0] for row in category_expenses],
+            [row[2] for row in category_expenses],
+            'Распределение расходов по категориям')
+        if graph is None:
+            return send_total(message, total_expenses)
+        report = {'photo': graph, 'total': total_expenses}
+        stats_cache.put(key, report)
+    send_report_photo(message.chat.id, report)
+
+    outbox.send_message(
+        message.chat.id,
+        f'Всего расходов за выбранный период: {report["total"]}')
     start(message)
 
 
 def show_table_statistics_incomes(message: types.Message) -> None:
     """Отображение статистики дохода за месяц."""
     client_id = message.chat.id
-    choice_expenses = pd.read_sql_query(sql_for_graph_incomes(client_id), con)
-    choice_expenses['date_added'] = pd.to_datetime(
-        choice_expenses['date_added'])
-    total_expenses = choice_expenses['amount'].sum()
-    if not total_expenses:
-        bot.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+    key = stats_key(client_id, 'start of month', 'incomes')
+    report = stats_cache.get(key)
+    if report is None:
+        total_incomes = storage.month_incomes_total(client_id)
+        if not total_incomes:
+            outbox.send_message(message.chat.id, ERROR_RECORD_EMPTY)
+            return start(message)
+        incomes = storage.month_incomes(client_id)
+        points = downsample(to_points(incomes))
+        graph = render_statistics(
+            message, plot_line, points['date'], points['amount'],
+            'Доходы за месяц', grid_axis='y')
+        if graph is None:
+            outbox.send_message(message.chat.id,
+                                f'Всего доходов за месяц: {total_incomes}')
+            return start(message)
+        report = {'document': to_xlsx(INCOMES_HEADER, incomes,
+                                      INCOMES_WIDTHS),
+                  'photo': graph, 'total': total_incomes}
+        stats_cache.put(key, report)
+
+    send_report_document(message.chat.id, report, 'incomes.xlsx')
+    outbox.send_message(message.chat.id, 'Таблица доходов за месяц')
+    send_report_photo(message.chat.id, report,
+                      caption=f'Всего доходов за месяц: {report["total"]}')
+    start(message)
+
+
+@bot.message_handler(content_types=['document'])
+def handle_document(message: types.Message) -> None:
+    """Импорт выписки из файла CSV или XLSX."""
+    document = message.document
+    if not is_statement(document.file_name):
+        outbox.send_message(message.chat.id, IMPORT_UNSUPPORTED)
+        return start(message)
+    outbox.send_message(message.chat.id, IMPORT_STARTED)
+    try:
+        with download_document(bot, document) as file:
+            stats = import_statement(file, document.file_name,
+                                     message.chat.id)
+    except StatementError as error:
+        outbox.send_message(message.chat.id,
+                            f'Не удалось загрузить выписку: {error}')
         return start(message)
-    choice_expenses['amount'] = pd.to_numeric(choice_expenses['amount'],
-                                              errors='coerce')
-    choice_expenses = choice_expenses.sort_values(by='date_added')
-    file_name = f'incomes_{client_id}.xlsx'
-    choice_expenses.to_excel(file_name, index=True)
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(choice_expenses['date_added'], choice_expenses['amount'],
-             marker='o', linewidth=2,
-             color='skyblue', label='Доходы по датам')
-    plt.xlabel('Дата')
-    plt.ylabel('Сумма, руб')
-    plt.title('Доходы за месяц')
-    plt.xticks(rotation=45)
-    plt.grid(axis='y')
-
-    graph_file_name = f'choice_incomes_graph_{client_id}.png'
-    plt.tight_layout()
-    plt.savefig(graph_file_name)
-    plt.close()
-
-    with open(file_name, 'rb') as file:
-        bot.send_document(message.chat.id, file)
-        bot.send_message(message.chat.id, 'Таблица доходов за месяц')
-    with open(graph_file_name, 'rb') as graph_file:
-        bot.send_photo(message.chat.id, graph_file,
-                       caption=f'Всего доходов за месяц: {total_expenses}')
-    os.remove(file_name)
-    os.remove(graph_file_name)
+    outbox.send_message(
+        message.chat.id,
+        f'Выписка загружена: расходов - {stats.expenses}, '
+        f'доходов - {stats.incomes}, повторов пропущено - '
+        f'{stats.duplicates}, строк с ошибками - {stats.errors}. '
+        f'Обработано {stats.rows} строк за {stats.elapsed:.1f} с '
+        f'({stats.rows_per_second:.0f} строк/с).')
     start(message)
 
 
@@ -687,27 +899,49 @@ def error_message(message: types.Message) -> None:
     """Отправка сообщения при некорректном запросе."""
     chat = message.chat
     chat_id = chat.id
-    bot.send_photo(chat.id, get_new_image())
-    bot.send_message(chat_id=chat_id,
-                     text='Я вас не понял, используйте /start')
+    photo = image_pool.get()
+    outbox.send_photo(chat.id, photo).add_done_callback(
+        lambda sent: sent.exception() is None and image_pool.remember(
+            photo, sent.result().photo[-1].file_id))
+    outbox.send_message(chat_id=chat_id,
+                        text='Я вас не понял, используйте /start')
 
 
-def get_new_image():
-    """Получение фотографий."""
-    try:
-        response = requests.get('https://api.thecatapi.com/v1/images/search')
-    except Exception as error:
-        logging.error(f'Ошибка при запросе к основному API: {error}')
-        new_url = 'https://api.thedogapi.com/v1/images/search'
-        response = requests.get(new_url)
-    response = response.json()
-    random_cat = response[0].get('url')
-    return random_cat
+instrument_bot(bot)
+
+
+def start_services(metrics_port: int = METRICS_PORT) -> None:
+    """Запуск фоновых служб: метрик, графиков, картинок и отправки."""
+    if metrics_port:
+        start_metrics_server(port=metrics_port)
+    if PROFILER_ENABLED:
+        profiler.start()
+    render_engine.start()
+    state_store.start()
+    image_pool.start()
+    outbox.start()
+
+
+def run_worker(index: int, channel: WorkerChannel) -> None:
+    """Запуск процесса-обработчика номер index (supervisor.py)."""
+    start_services(METRICS_PORT and METRICS_PORT + index)
+    serve_worker(bot, channel)
 
 
 def main():
     """Запсук бота."""
-    bot.polling(none_stop=True)
+    if WORKER_PROCESSES > 1:
+        if STORAGE_BACKEND == 'memory':
+            logging.warning('STORAGE_BACKEND=memory: у каждого процесса '
+                            'свои данные, записи чата видны только ему')
+        return run_supervisor(secret_token, run_worker)
+    start_services()
+    if UPDATE_MODE == 'webhook':
+        run_webhook(bot)
+    elif RUNTIME == 'async':
+        run_async(bot)
+    else:
+        run_polling(bot, WEBHOOK_QUEUE_SIZE, WEBHOOK_BATCH_SIZE)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+"""Код для кэширования статистики пользователей."""
+
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Hashable, Optional, Tuple
+
+STATS_CACHE_SIZE = int(os.getenv('STATS_CACHE_SIZE', 1024))
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 600))
+
+
+class DataVersions:
+    """Версии данных пользователей, растут при каждом изменении записей."""
+
+    def __init__(self) -> None:
+        self.versions: Dict[int, int] = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> int:
+        """Текущая версия данных пользователя."""
+        return self.versions.get(int(user_id), 0)
+
+    def bump(self, user_id: int) -> None:
+        """Увеличение версии данных пользователя."""
+        with self.lock:
+            self.versions[int(user_id)] += 1
+
+
+class StatsCache:
+    """LRU-кэш готовых отчетов с ограничением по времени жизни.
+
+    Отчет - словарь с байтами графика/таблицы и итоговой суммой. После
+    отправки байты заменяются на file_id Telegram, и повторный отчет
+    отправляется без загрузки файла.
+    """
+
+    def __init__(self, max_size: int = STATS_CACHE_SIZE,
+                 ttl: float = STATS_CACHE_TTL) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        """Отчет из кэша или None."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, report = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return report
+
+    def put(self, key: Hashable, report: dict) -> None:
+        """Сохранение отчета в кэш."""
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, report)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+data_versions = DataVersions()
+stats_cache = StatsCache()
+
+
+def stats_key(client_id: int, period: str,
+              report_format: str) -> Tuple[int, str, str, int]:
+    """Ключ отчета с учетом версии данных пользователя."""
+    return (client_id, period, report_format, data_versions.get(client_id))
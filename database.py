@@ -1,34 +1,60 @@
 """Код для создании БД."""
 
+import os
 import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 
+DB_PATH = os.getenv('DB_PATH', 'finance_bot.db')
+STATEMENT_CACHE_SIZE = int(os.getenv('STATEMENT_CACHE_SIZE', 256))
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
 
-def db_connect():
-    """Код для подключения к БД."""
-    return sqlite3.connect('finance_bot.db', check_same_thread=False)
-
+# Пересчет дневных итогов по исходным записям.
+REBUILD_ROLLUPS = [
+    'DELETE FROM expenses_daily',
+    '''
+    INSERT INTO expenses_daily (client_id, day, category_id, total, count)
+    SELECT client_id, date(date_added), IFNULL(category_id, 0),
+        SUM(amount), COUNT(*)
+    FROM expenses
+    WHERE client_id IS NOT NULL
+    GROUP BY 1, 2, 3
+    ''',
+    'DELETE FROM incomes_daily',
+    '''
+    INSERT INTO incomes_daily (client_id, day, total, count)
+    SELECT client_id, date(date_added), SUM(amount), COUNT(*)
+    FROM incomes
+    WHERE client_id IS NOT NULL
+    GROUP BY 1, 2
+    ''',
+]
 
-def create_tables():
-    """Код для создании БД."""
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute(
+# Миграции схемы: (версия, список запросов). Новые миграции добавляются
+# в конец списка, уже примененные миграции не изменяются.
+MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (1, [
         '''
         CREATE TABLE IF NOT EXISTS clients(
             id INTEGER PRIMARY KEY,
             telegram_id TEXT NOT NULL
             )
-        '''
-    )
-    cur.execute(
+        ''',
         '''
         CREATE TABLE IF NOT EXISTS categories(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE
             )
-        '''
-    )
-    cur.execute(
+        ''',
         '''
         CREATE TABLE IF NOT EXISTS incomes(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,9 +64,7 @@ def create_tables():
             client_id INTEGER,
             FOREIGN KEY (client_id) REFERENCES clients(id)
             )
-        '''
-    )
-    cur.execute(
+        ''',
         '''
         CREATE TABLE IF NOT EXISTS expenses(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -52,9 +76,269 @@ def create_tables():
             FOREIGN KEY (category_id) REFERENCES categories(id),
             FOREIGN KEY (client_id) REFERENCES clients(id)
             )
+        ''',
+    ]),
+    (2, [
+        '''
+        DELETE FROM clients
+        WHERE id NOT IN (SELECT MIN(id) FROM clients GROUP BY telegram_id)
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_clients_telegram_id
+        ON clients(telegram_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS ix_expenses_client_date
+        ON expenses(client_id, date_added, category_id, amount)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS ix_expenses_client_id
+        ON expenses(client_id, id DESC)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS ix_incomes_client_date
+        ON incomes(client_id, date_added, amount)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS ix_incomes_client_id
+        ON incomes(client_id, id DESC)
+        ''',
+    ]),
+    (3, [
+        '''
+        CREATE TABLE IF NOT EXISTS expenses_daily(
+            client_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (client_id, day, category_id)
+            ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS incomes_daily(
+            client_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (client_id, day)
+            ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_expenses_daily_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO expenses_daily
+                (client_id, day, category_id, total, count)
+            VALUES (NEW.client_id, date(NEW.date_added),
+                    IFNULL(NEW.category_id, 0), NEW.amount, 1)
+            ON CONFLICT (client_id, day, category_id) DO UPDATE
+            SET total = total + excluded.total, count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_expenses_daily_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            UPDATE expenses_daily
+            SET total = total - OLD.amount, count = count - 1
+            WHERE client_id = OLD.client_id
+                AND day = date(OLD.date_added)
+                AND category_id = IFNULL(OLD.category_id, 0);
+            DELETE FROM expenses_daily
+            WHERE client_id = OLD.client_id
+                AND day = date(OLD.date_added)
+                AND category_id = IFNULL(OLD.category_id, 0)
+                AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_expenses_daily_update
+        AFTER UPDATE OF amount, date_added, category_id, client_id
+        ON expenses
+        BEGIN
+            UPDATE expenses_daily
+            SET total = total - OLD.amount, count = count - 1
+            WHERE client_id = OLD.client_id
+                AND day = date(OLD.date_added)
+                AND category_id = IFNULL(OLD.category_id, 0);
+            DELETE FROM expenses_daily
+            WHERE client_id = OLD.client_id
+                AND day = date(OLD.date_added)
+                AND category_id = IFNULL(OLD.category_id, 0)
+                AND count <= 0;
+            INSERT INTO expenses_daily
+                (client_id, day, category_id, total, count)
+            VALUES (NEW.client_id, date(NEW.date_added),
+                    IFNULL(NEW.category_id, 0), NEW.amount, 1)
+            ON CONFLICT (client_id, day, category_id) DO UPDATE
+            SET total = total + excluded.total, count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_incomes_daily_insert
+        AFTER INSERT ON incomes
+        BEGIN
+            INSERT INTO incomes_daily (client_id, day, total, count)
+            VALUES (NEW.client_id, date(NEW.date_added), NEW.amount, 1)
+            ON CONFLICT (client_id, day) DO UPDATE
+            SET total = total + excluded.total, count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_incomes_daily_delete
+        AFTER DELETE ON incomes
+        BEGIN
+            UPDATE incomes_daily
+            SET total = total - OLD.amount, count = count - 1
+            WHERE client_id = OLD.client_id AND day = date(OLD.date_added);
+            DELETE FROM incomes_daily
+            WHERE client_id = OLD.client_id AND day = date(OLD.date_added)
+                AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tr_incomes_daily_update
+        AFTER UPDATE OF amount, date_added, client_id ON incomes
+        BEGIN
+            UPDATE incomes_daily
+            SET total = total - OLD.amount, count = count - 1
+            WHERE client_id = OLD.client_id AND day = date(OLD.date_added);
+            DELETE FROM incomes_daily
+            WHERE client_id = OLD.client_id AND day = date(OLD.date_added)
+                AND count <= 0;
+            INSERT INTO incomes_daily (client_id, day, total, count)
+            VALUES (NEW.client_id, date(NEW.date_added), NEW.amount, 1)
+            ON CONFLICT (client_id, day) DO UPDATE
+            SET total = total + excluded.total, count = count + 1;
+        END
+        ''',
+        *REBUILD_ROLLUPS,
+    ]),
+    (4, [
+        '''
+        CREATE TABLE IF NOT EXISTS chat_states(
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+            )
+        ''',
+    ]),
+    (5, [
+        'ALTER TABLE expenses ADD COLUMN import_key TEXT',
+        'ALTER TABLE incomes ADD COLUMN import_key TEXT',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_expenses_import_key
+        ON expenses(client_id, import_key) WHERE import_key IS NOT NULL
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_incomes_import_key
+        ON incomes(client_id, import_key) WHERE import_key IS NOT NULL
+        ''',
+    ]),
+]
+
+
+def db_connect(path: str = DB_PATH, read_only: bool = False):
+    """Код для подключения к БД."""
+    con = sqlite3.connect(path, check_same_thread=False,
+                          cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in PRAGMAS.items():
+        con.execute(f'PRAGMA {name} = {value}')
+    if read_only:
+        con.execute('PRAGMA query_only = ON')
+    return con
+
+
+class ConnectionManager:
+    """Соединения с БД для потоков бота.
+
+    Каждый поток читает через собственное соединение, а все изменения
+    идут через одно общее соединение под блокировкой. В режиме WAL
+    чтение не блокируется записью.
+    """
+
+    def __init__(self, path: str = DB_PATH) -> None:
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.write_con: Optional[sqlite3.Connection] = None
+
+    def reader(self) -> sqlite3.Connection:
+        """Соединение на чтение для текущего потока."""
+        con = getattr(self.local, 'con', None)
+        if con is None:
+            con = self.local.con = db_connect(self.path, read_only=True)
+        return con
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на запись, транзакция фиксируется при выходе."""
+        with self.write_lock:
+            if self.write_con is None:
+                self.write_con = db_connect(self.path)
+            with self.write_con:
+                yield self.write_con
+
+
+def get_schema_version(con) -> int:
+    """Версия схемы БД (0 - схема не создана)."""
+    cur = con.cursor()
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT DEFAULT (datetime('now'))
+            )
         '''
     )
-    con.commit()
+    cur.execute('SELECT MAX(version) FROM schema_version')
+    return cur.fetchone()[0] or 0
+
+
+def migrate(con, target: Optional[int] = None) -> int:
+    """Применение миграций до версии target (по умолчанию - последней).
+
+    Миграция и запись ее версии - одна транзакция. sqlite3 сам не
+    открывает транзакцию перед CREATE и ALTER, и прерванная миграция
+    оставляла часть изменений без версии, поэтому BEGIN выполняется
+    явно: DDL в SQLite откатывается вместе с остальными запросами.
+    """
+    isolation_level = con.isolation_level
+    con.isolation_level = None
+    try:
+        version = get_schema_version(con)
+        for number, statements in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                for statement in statements:
+                    con.execute(statement)
+                con.execute('INSERT INTO schema_version (version) VALUES (?)',
+                            (number,))
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+            version = number
+    finally:
+        con.isolation_level = isolation_level
+    return version
+
+
+def rebuild_rollups(con) -> None:
+    """Пересчет таблиц дневных итогов expenses_daily и incomes_daily."""
+    with con:
+        for statement in REBUILD_ROLLUPS:
+            con.execute(statement)
+
+
+def create_tables():
+    """Код для создании БД."""
+    con = db_connect()
+    migrate(con)
     con.close()
 
 
@@ -62,6 +346,11 @@ def main():
     """Код для запуска создания БД."""
     create_tables()
     print('Таблицы успешно созданы')
+    if 'rebuild' in sys.argv[1:]:
+        con = db_connect()
+        rebuild_rollups(con)
+        con.close()
+        print('Дневные итоги пересчитаны')
 
 
 if __name__ == '__main__':
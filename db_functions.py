@@ -1,236 +1,470 @@
 """Код для запросов к БД."""
 
-from database import db_connect
+import threading
+
+from cache import data_versions
+from database import ConnectionManager
+from metrics import instrument_functions
+from write_queue import WRITE_BEHIND, WriteQueue
+
+connections = ConnectionManager()
+write_queue = WriteQueue(connections) if WRITE_BEHIND else None
+
+
+def execute_write(sql, params=()):
+    """Выполнение изменения (через очередь записи, если она включена)."""
+    if write_queue is not None:
+        write_queue.execute(sql, params)
+        return
+    with connections.writer() as con:
+        con.execute(sql, params)
+
+
+class CategoryIndex:
+    """Категории в памяти процесса: id -> имя и имя -> id.
+
+    Загружается из БД при первом обращении и пополняется при добавлении
+    категорий. Если категории нет в индексе (например, ее добавил другой
+    процесс), она ищется в БД и добавляется в индекс.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Загрузка всех категорий из БД."""
+        rows = connections.reader().execute(
+            '''
+            SELECT id, name FROM categories
+            '''
+        ).fetchall()
+        with self.lock:
+            self.by_id = dict(rows)
+            self.by_name = {name: category_id for category_id, name in rows}
+            self.loaded = True
+
+    def add(self, category_id, name):
+        """Добавление категории в индекс."""
+        with self.lock:
+            self.by_id[category_id] = name
+            self.by_name[name] = category_id
+
+    def get_id(self, name):
+        """Id категории по имени или None."""
+        if not self.loaded:
+            self.load()
+        category_id = self.by_name.get(name)
+        if category_id is None:
+            row = connections.reader().execute(
+                '''
+                SELECT id FROM categories WHERE name = ?
+                ''', (name,)).fetchone()
+            if row is not None:
+                category_id = row[0]
+                self.add(category_id, name)
+        return category_id
+
+    def get_name(self, category_id):
+        """Имя категории по id или None."""
+        if not self.loaded:
+            self.load()
+        name = self.by_id.get(category_id)
+        if name is None:
+            row = connections.reader().execute(
+                '''
+                SELECT name FROM categories WHERE id = ?
+                ''', (category_id,)).fetchone()
+            if row is not None:
+                name = row[0]
+                self.add(category_id, name)
+        return name
+
+    def items(self):
+        """Список (id, имя) всех категорий.
+
+        Последний id в БД сверяется с индексом, чтобы в списке были
+        и категории, добавленные другими процессами.
+        """
+        last_id = connections.reader().execute(
+            '''
+            SELECT MAX(id) FROM categories
+            '''
+        ).fetchone()[0]
+        if not self.loaded or (last_id is not None
+                               and last_id not in self.by_id):
+            self.load()
+        return sorted(self.by_id.items())
+
+
+category_index = CategoryIndex()
+# Наибольший id строки SQLite: первая страница - записи с id меньше него
+MAX_ROW_ID = 2 ** 63 - 1
+# Страницы записей по ключу id: 'older' - записи с id < ?, новые сверху,
+# 'newer' - записи с id > ?, старые сверху. Оба запроса идут по индексу
+# (client_id, id) и читают не больше limit строк при любой глубине.
+SQL_PAGE_INCOMES = {
+    'older': '''
+        SELECT id, amount, description, date_added FROM incomes
+        WHERE client_id = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''',
+    'newer': '''
+        SELECT id, amount, description, date_added FROM incomes
+        WHERE client_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''',
+}
+SQL_PAGE_EXPENSES = {
+    'older': '''
+        SELECT e.id, e.amount, c.name AS category_name, e.description,
+            e.date_added
+        FROM expenses e
+        JOIN categories c ON e.category_id = c.id
+        WHERE e.client_id = ? AND e.id < ?
+        ORDER BY e.id DESC
+        LIMIT ?
+    ''',
+    'newer': '''
+        SELECT e.id, e.amount, c.name AS category_name, e.description,
+            e.date_added
+        FROM expenses e
+        JOIN categories c ON e.category_id = c.id
+        WHERE e.client_id = ? AND e.id > ?
+        ORDER BY e.id
+        LIMIT ?
+    ''',
+}
+
 
-con = db_connect()
-cur = con.cursor()
+def page_rows(queries, user_id, before_id, after_id, limit):
+    """До limit записей перед before_id или после after_id, новые сверху.
+
+    Без before_id и after_id - самые новые записи.
+    """
+    if after_id is not None:
+        rows = connections.reader().execute(
+            queries['newer'], (user_id, after_id, limit)).fetchall()
+        rows.reverse()
+        return rows
+    if before_id is None:
+        before_id = MAX_ROW_ID
+    return connections.reader().execute(
+        queries['older'], (user_id, before_id, limit)).fetchall()
 
 
 def sql_select_user_id(user_id):
     """Поиск пользователя в БД."""
-    cur.execute(
+    return connections.reader().execute(
         '''
         SELECT * FROM clients WHERE telegram_id = ?
-        ''', (str(user_id),))
-    return cur.fetchone()
+        ''', (str(user_id),)).fetchone()
 
 
 def sql_insert_user_id(user_id):
     """Добавление пользователя в БД."""
-    cur.execute(
+    execute_write(
         '''
-        INSERT INTO clients (telegram_id) VALUES (?)
+        INSERT OR IGNORE INTO clients (telegram_id) VALUES (?)
         ''', (str(user_id),))
-    con.commit()
 
 
 def sql_select_category(name):
     """Список всех категорий."""
-    cur.execute(
-        '''
-        SELECT * FROM categories WHERE name = ?
-        ''', (name,))
-    return cur.fetchone()
+    category_id = category_index.get_id(name)
+    return None if category_id is None else (category_id, name)
 
 
 def sql_select_id_category(name):
     """Поиск категории по имени."""
-    cur.execute(
-        '''
-        SELECT id FROM categories WHERE name = ?
-        ''', (name,))
-    return cur.fetchone()
+    category_id = category_index.get_id(name)
+    return None if category_id is None else (category_id,)
 
 
 def sql_select_name_category(category_id):
     """Поиск имени категории по id."""
-    cur.execute(
-        '''
-        SELECT name FROM categories WHERE id = ?
-        ''', (category_id,))
-    return cur.fetchone()
+    name = category_index.get_name(category_id)
+    return None if name is None else (name,)
 
 
 def sql_insert_category(name):
     """Добавлени имени категории."""
-    cur.execute(
+    execute_write(
         '''
         INSERT INTO categories (name) VALUES (?)
         ''', (name,))
-    con.commit()
+    category_index.get_id(name)
 
 
 def sql_all_category():
     """Поиск id и имени всех категорий."""
-    cur.execute(
-        '''
-        SELECT id, name FROM categories
-        '''
-    )
-    return cur.fetchall()
+    return category_index.items()
 
 
 def sql_insert_incomes(amount, description, user_id):
     """Добавление записи дозода."""
-    cur.execute(
+    execute_write(
         '''
         INSERT INTO incomes
             (amount, description, client_id) VALUES (?, ?, ?)
         ''', (amount, description, user_id,)
     )
-    con.commit()
-
+    data_versions.bump(user_id)
 
-def sql_records_10_incomes(user_id):
-    """Вывод 10 записей дохода."""
-    cur.execute(
-        '''
-        SELECT id, amount, description, date_added FROM incomes
-        WHERE client_id = ?
-        ORDER BY id DESC
-        LIMIT 10
-        ''', (user_id,))
 
-    return cur.fetchall()
+def sql_page_incomes(user_id, before_id=None, after_id=None, limit=10):
+    """Страница записей дохода, новые сверху (см. page_rows)."""
+    return page_rows(SQL_PAGE_INCOMES, user_id, before_id, after_id, limit)
 
 
 def sql_select_all_incomes_user(income_id, user_id):
     """Запрос для проверки авторства записи."""
-    cur.execute(
+    return connections.reader().execute(
         '''
         SELECT * FROM incomes WHERE id = ? AND client_id = ?
-        ''', (income_id, user_id,))
-    return cur.fetchone()
+        ''', (income_id, user_id,)).fetchone()
 
 
-def sql_update_income(amount, description, income_id):
+def sql_update_income(amount, description, income_id, user_id):
     """Обновление записи о доходе."""
-    cur.execute(
+    execute_write(
         '''
         UPDATE incomes
         SET amount = ?, description = ?
-        WHERE id = ?
+        WHERE id = ? AND client_id = ?
         ''',
-        (amount, description, income_id,))
-    con.commit()
+        (amount, description, income_id, user_id,))
+    data_versions.bump(user_id)
 
 
 def sql_delete_income(income_id, user_id):
     """Удаление записи дохода."""
-    cur.execute(
+    execute_write(
         '''
         DELETE FROM incomes
         WHERE id = ? AND client_id = ?
         ''', (income_id, user_id))
-    con.commit()
+    data_versions.bump(user_id)
 
 
 def sql_insert_expense(amount, description, category_id, user_id):
     """Добавление записи расхода."""
-    cur.execute(
+    execute_write(
         '''
         INSERT INTO expenses
-            (amount, description, category_id, client_id) VALUES (?, ?, ?, ?)
+            (amount, description, category_id, client_id)
+        VALUES (?, ?, ?, ?)
         ''',
         (amount, description, category_id, user_id,))
-    con.commit()
+    data_versions.bump(user_id)
 
 
-def sql_records_10_expense(user_id):
-    """Вывод 10 записей расхода."""
-    cur.execute(
-        '''
-        SELECT e.id, e.amount, c.name
-            AS category_name, e.description, e.date_added
-        FROM expenses e
-        JOIN categories c ON e.category_id = c.id
-        WHERE e.client_id = ?
-        ORDER BY e.id DESC
-        LIMIT 10
-        ''', (user_id,))
-    return cur.fetchall()
+def sql_page_expense(user_id, before_id=None, after_id=None, limit=10):
+    """Страница записей расхода, новые сверху (см. page_rows)."""
+    return page_rows(SQL_PAGE_EXPENSES, user_id, before_id, after_id, limit)
 
 
 def sql_select_all_expenses_user(expense_id, user_id):
     """Запрос для проверки авторства."""
-    cur.execute(
+    return connections.reader().execute(
         '''
         SELECT * FROM expenses WHERE id = ? AND client_id = ?
-        ''', (expense_id, user_id,))
-    return cur.fetchone()
+        ''', (expense_id, user_id,)).fetchone()
 
 
-def sql_update_expense(amount, description, category_id, expense_id):
+def sql_update_expense(amount, description, category_id, expense_id,
+                       user_id):
     """Обновление записи расхода."""
-    cur.execute(
+    execute_write(
         '''
         UPDATE expenses
         SET amount = ?, description = ?, category_id = ?
-        WHERE id = ?''',
-        (amount, description, category_id, expense_id,))
-    con.commit()
+        WHERE id = ? AND client_id = ?''',
+        (amount, description, category_id, expense_id, user_id,))
+    data_versions.bump(user_id)
 
 
 def sql_delete_expense(expense_id, user_id):
     """Удаление записи расхода."""
-    cur.execute(
+    execute_write(
         '''
         DELETE FROM expenses
         WHERE id = ? AND client_id = ?
         ''', (expense_id, user_id,))
-    con.commit()
+    data_versions.bump(user_id)
+
+
+def sql_import_records(expenses, incomes, user_id):
+    """Добавление пакета импортированных записей, повторы пропускаются.
+
+    expenses - строки (amount, description, date_added, category_id,
+    import_key), incomes - (amount, description, date_added, import_key).
+    Возвращает число добавленных расходов и доходов.
+    """
+    with connections.writer() as con:
+        added_expenses = con.executemany(
+            '''
+            INSERT OR IGNORE INTO expenses
+                (amount, description, date_added, category_id, import_key,
+                 client_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', [row + (user_id,) for row in expenses]).rowcount
+        added_incomes = con.executemany(
+            '''
+            INSERT OR IGNORE INTO incomes
+                (amount, description, date_added, import_key, client_id)
+            VALUES (?, ?, ?, ?, ?)
+            ''', [row + (user_id,) for row in incomes]).rowcount
+    data_versions.bump(user_id)
+    return added_expenses, added_incomes
+
+
+SQL_FOR_TABLE = '''
+    SELECT e.date_added, e.amount, e.description, c.name AS category_name
+    FROM expenses e
+    JOIN categories c ON e.category_id = c.id
+    WHERE e.client_id = ? AND e.date_added >= datetime('now', ?)
+    ORDER BY e.amount DESC
+    LIMIT 5
+'''
+# Расходы периода по дням (?1 - пользователь, ?2 - период): целые дни
+# после границы периода берутся из дневных итогов expenses_daily, день
+# границы - из записей не раньше нее. Сумма за период совпадает
+# с SQL_FOR_GRAPH_TOTAL, а исходные записи читаются не больше чем за день.
+SQL_PERIOD_DAYS = '''
+    WITH bounds AS (
+        SELECT datetime('now', ?2) AS start,
+            date('now', ?2, '+1 day') AS next_day
+    ),
+    period_days AS (
+        SELECT r.day, r.category_id, r.total
+        FROM expenses_daily r, bounds
+        WHERE r.client_id = ?1 AND r.day >= bounds.next_day
+        UNION ALL
+        SELECT date(e.date_added), IFNULL(e.category_id, 0), e.amount
+        FROM expenses e, bounds
+        WHERE e.client_id = ?1 AND e.date_added >= bounds.start
+            AND e.date_added < bounds.next_day
+    )
+'''
+# Суммы расходов для графика по интервалам. Дни и недели считаются
+# по SQL_PERIOD_DAYS, часы - по исходным записям.
+SQL_FOR_GRAPH = {
+    'hour': '''
+        SELECT strftime('%Y-%m-%d %H:00:00', date_added) AS bucket,
+            SUM(amount)
+        FROM expenses
+        WHERE client_id = ? AND date_added >= datetime('now', ?)
+        GROUP BY bucket
+        ORDER BY bucket
+    ''',
+    'day': SQL_PERIOD_DAYS + '''
+        SELECT day, SUM(total)
+        FROM period_days
+        GROUP BY day
+        ORDER BY day
+    ''',
+    'week': SQL_PERIOD_DAYS + '''
+        SELECT date(day, '-6 days', 'weekday 1') AS bucket, SUM(total)
+        FROM period_days
+        GROUP BY bucket
+        ORDER BY bucket
+    ''',
+}
+# Интервал графика для каждого периода, по умолчанию - день
+PERIOD_BUCKETS = {
+    'start of day': 'hour',
+    'start of year': 'week',
+}
+SQL_FOR_GRAPH_TOTAL = '''
+    SELECT COALESCE(SUM(amount), 0)
+    FROM expenses
+    WHERE client_id = ? AND date_added >= datetime('now', ?)
+'''
+SQL_FOR_CHART = SQL_PERIOD_DAYS + '''
+    SELECT SUM(r.total) as total_amount, r.category_id,
+        COALESCE(c.name, 'Неизвестная категория') AS category
+    FROM period_days r
+    LEFT JOIN categories c ON r.category_id = c.id
+    GROUP BY r.category_id
+'''
+SQL_FOR_GRAPH_INCOMES = '''
+    SELECT date_added, amount, description
+    FROM incomes
+    WHERE client_id = ? AND date_added >= datetime('now', 'start of month')
+    ORDER BY date_added
+'''
+SQL_FOR_INCOMES_TOTAL = '''
+    SELECT COALESCE(SUM(amount), 0)
+    FROM incomes
+    WHERE client_id = ? AND date_added >= datetime('now', 'start of month')
+'''
+SQL_FOR_EXPORT_EXPENSES = '''
+    SELECT e.date_added, 'Расход', e.amount, c.name, e.description
+    FROM expenses e
+    LEFT JOIN categories c ON e.category_id = c.id
+    WHERE e.client_id = ?
+    ORDER BY e.date_added
+'''
+SQL_FOR_EXPORT_INCOMES = '''
+    SELECT date_added, 'Доход', amount, NULL, description
+    FROM incomes
+    WHERE client_id = ?
+    ORDER BY date_added
+'''
 
 
 def sql_for_table(periods, user_id):
     """Вывод записей расходов на выбранный период."""
-    return (
-        f'''
-        SELECT e.amount, e.description, e.date_added, c.name AS category_name
-        FROM expenses e
-        JOIN categories c ON e.category_id = c.id
-        WHERE e.date_added >= datetime("now", "{periods}")
-            AND e.client_id = {user_id}
-        ORDER BY e.amount DESC
-        LIMIT 5
-        '''
-    )
+    return SQL_FOR_TABLE, (user_id, periods)
 
 
 def sql_for_graph(periods, user_id):
-    """Вывод записей расходов для графика."""
-    return (
-        f'''
-        SELECT amount, description, date_added
-        FROM expenses
-        WHERE date_added >= datetime("now", "{periods}")
-        AND client_id = {user_id}
-        '''
-    )
+    """Суммы расходов для графика по часам, дням или неделям периода.
+
+    Число точек не зависит от числа записей, а их сумма равна
+    sql_for_graph_total.
+    """
+    bucket = PERIOD_BUCKETS.get(periods, 'day')
+    return SQL_FOR_GRAPH[bucket], (user_id, periods)
+
+
+def sql_for_graph_total(periods, user_id):
+    """Сумма расходов на выбранный период."""
+    return SQL_FOR_GRAPH_TOTAL, (user_id, periods)
 
 
 def sql_for_chart(periods, user_id):
-    """Вывод записей расходов для диаграммы."""
-    return (
-        f'''
-        SELECT SUM(amount) as total_amount, category_id
-        FROM expenses
-        WHERE date_added >= datetime("now", "{periods}")
-            AND client_id = {user_id}
-        GROUP BY category_id
-        '''
-    )
+    """Суммы расходов по категориям для диаграммы.
+
+    Суммы берутся в основном из дневных итогов expenses_daily, их общая
+    сумма равна sql_for_graph_total.
+    """
+    return SQL_FOR_CHART, (user_id, periods)
 
 
 def sql_for_graph_incomes(user_id):
     """Вывод записей доходов для графика."""
-    return (
-        f'''
-        SELECT amount, description, date_added
-        FROM incomes
-        WHERE date_added >= datetime("now", "start of month")
-        AND client_id = {user_id}
-        '''
-    )
+    return SQL_FOR_GRAPH_INCOMES, (user_id,)
+
+
+def sql_for_incomes_total(user_id):
+    """Сумма доходов за месяц."""
+    return SQL_FOR_INCOMES_TOTAL, (user_id,)
+
+
+def sql_for_export_expenses(user_id):
+    """Вывод всех записей расходов для выгрузки."""
+    return SQL_FOR_EXPORT_EXPENSES, (user_id,)
+
+
+def sql_for_export_incomes(user_id):
+    """Вывод всех записей доходов для выгрузки."""
+    return SQL_FOR_EXPORT_INCOMES, (user_id,)
 
 
 def add_user(telegram_id):
@@ -242,5 +476,7 @@ def add_user(telegram_id):
 
 def get_category_name(category_id):
     """Функция для получения названий категорий по ID для диаграммы."""
-    result = sql_select_name_category(category_id)
-    return result[0] if result else 'Неизвестная категория'
+    return category_index.get_name(category_id) or 'Неизвестная категория'
+
+
+instrument_functions(globals(), 'db')
@@ -0,0 +1,191 @@
+"""Код для выгрузки всей истории доходов и расходов в файл."""
+
+import csv
+import io
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from typing import IO, Iterable, List, Sequence
+from xml.sax.saxutils import escape
+
+from spreadsheets import (EXCEL_EPOCH, SPOOL_SIZE, XLSX_MAIN, XLSX_PACKAGE,
+                          XLSX_RELATIONSHIPS)
+
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+# CSV больше этого размера отправляется в архиве ZIP
+EXPORT_COMPRESS_SIZE = int(os.getenv('EXPORT_COMPRESS_SIZE', 1024 * 1024))
+# Бот может отправить файл не больше 50 МБ
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+EXPORT_FORMATS = ('CSV', 'XLSX')
+# Те же названия колонок, что понимает импорт выписок (importer.py)
+HEADER = ['Дата', 'Тип', 'Сумма', 'Категория', 'Описание']
+# Символы, запрещенные в XML 1.0
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        f'<Types xmlns="{XLSX_PACKAGE}/content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        f'<Relationships xmlns="{XLSX_PACKAGE}/relationships">'
+        f'<Relationship Id="rId1" Type="{XLSX_RELATIONSHIPS}/'
+        'officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        f'<workbook xmlns="{XLSX_MAIN}" xmlns:r="{XLSX_RELATIONSHIPS}">'
+        '<sheets><sheet name="История" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        f'<Relationships xmlns="{XLSX_PACKAGE}/relationships">'
+        f'<Relationship Id="rId1" Type="{XLSX_RELATIONSHIPS}/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{XLSX_RELATIONSHIPS}/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'),
+    # Стиль 1 - встроенный формат даты и времени (numFmtId 22)
+    'xl/styles.xml': (
+        f'<styleSheet xmlns="{XLSX_MAIN}">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font>'
+        '</fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/>'
+        '<diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+        'borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" '
+        'borderId="0" xfId="0"/><xf numFmtId="22" fontId="0" fillId="0" '
+        'borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" '
+        'builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+XLSX_SHEET_START = f'<worksheet xmlns="{XLSX_MAIN}">'
+XLSX_SHEET_END = '</sheetData></worksheet>'
+# Ширина колонок выгрузки в символах
+HEADER_WIDTHS = [18, 12, 12, 12, 40]
+
+
+class HistoryExport:
+    """Файл выгрузки истории, готовый к отправке."""
+
+    def __init__(self, file: IO[bytes], file_name: str, rows: int) -> None:
+        self.file = file
+        self.file_name = file_name
+        self.rows = rows
+        self.size = file.seek(0, io.SEEK_END)
+        file.seek(0)
+
+
+def write_csv(file: IO[bytes], records: Iterable[List[tuple]]) -> int:
+    """Запись истории в CSV, возвращает число строк."""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='',
+                            write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    rows = 0
+    for chunk in records:
+        writer.writerows(chunk)
+        rows += len(chunk)
+    text.detach()
+    return rows
+
+
+def xlsx_cell(value) -> str:
+    """Ячейка XLSX: строка, дата или число."""
+    if value is None:
+        return '<c/>'
+    if isinstance(value, str):
+        text = escape(INVALID_XML.sub('', value))
+        return ('<c t="inlineStr"><is><t xml:space="preserve">'
+                f'{text}</t></is></c>')
+    if isinstance(value, datetime):
+        days = (value - EXCEL_EPOCH) / timedelta(days=1)
+        return f'<c s="1"><v>{days}</v></c>'
+    return f'<c><v>{value}</v></c>'
+
+
+def write_sheet(file: IO[bytes], header: Sequence[str],
+                chunks: Iterable[Iterable[Sequence]],
+                widths: Sequence[int] = ()) -> int:
+    """Запись книги XLSX с одним листом, возвращает число строк.
+
+    Строки приходят частями и пишутся в архив сразу: openpyxl в режиме
+    write_only держит весь лист в памяти, если не установлен lxml.
+    """
+    rows = 0
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            cols = ''.join(f'<col min="{index}" max="{index}" '
+                           f'width="{width}" customWidth="1"/>'
+                           for index, width in enumerate(widths, start=1))
+            if cols:
+                cols = f'<cols>{cols}</cols>'
+            sheet.write(f'{XLSX_SHEET_START}{cols}<sheetData>'.encode())
+            for chunk in itertools.chain([[header]], chunks):
+                sheet.write(''.join(
+                    '<row>' + ''.join(map(xlsx_cell, row)) + '</row>'
+                    for row in chunk).encode())
+                rows += len(chunk)
+            sheet.write(XLSX_SHEET_END.encode())
+    # Заголовок не считается
+    return rows - 1
+
+
+def parse_dates(chunk: List[tuple]) -> List[tuple]:
+    """Замена даты из БД в первой колонке на datetime."""
+    return [(date_added and datetime.fromisoformat(date_added), *values)
+            for date_added, *values in chunk]
+
+
+def write_xlsx(file: IO[bytes], records: Iterable[List[tuple]]) -> int:
+    """Запись истории в XLSX, возвращает число строк."""
+    return write_sheet(file, HEADER, map(parse_dates, records),
+                       HEADER_WIDTHS)
+
+
+def compress(file: IO[bytes], file_name: str) -> IO[bytes]:
+    """Упаковка файла в архив ZIP по частям."""
+    archive_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    file.seek(0)
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(file_name, 'w') as member:
+            shutil.copyfileobj(file, member)
+    file.close()
+    return archive_file
+
+
+def export_history(records: Iterable[List[tuple]],
+                   file_format: str) -> HistoryExport:
+    """Выгрузка записей пользователя в CSV или XLSX.
+
+    records - части строк (дата, тип, сумма, категория, описание),
+    например из storage.export_records. Файл пишется во временный файл,
+    который остается в памяти только до SPOOL_SIZE. XLSX уже сжат,
+    большой CSV упаковывается в ZIP.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    if file_format == 'XLSX':
+        return HistoryExport(file, 'history.xlsx', write_xlsx(file, records))
+    rows = write_csv(file, records)
+    file_name = 'history.csv'
+    if file.tell() > EXPORT_COMPRESS_SIZE:
+        file = compress(file, file_name)
+        file_name += '.zip'
+    return HistoryExport(file, file_name, rows)
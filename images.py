@@ -0,0 +1,107 @@
+"""Код для подбора картинок к ответу на непонятные сообщения."""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+IMAGE_API_URLS = os.getenv(
+    'IMAGE_API_URLS',
+    'https://api.thecatapi.com/v1/images/search,'
+    'https://api.thedogapi.com/v1/images/search').split(',')
+IMAGE_POOL_SIZE = int(os.getenv('IMAGE_POOL_SIZE', 20))
+IMAGE_REQUEST_TIMEOUT = float(os.getenv('IMAGE_REQUEST_TIMEOUT', 3))
+IMAGE_RETRY_INTERVAL = float(os.getenv('IMAGE_RETRY_INTERVAL', 30))
+FALLBACK_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'static', 'fallback.png')
+
+Photo = Union[str, bytes]
+
+
+class ImagePool:
+    """Запас картинок, который пополняется в фоновом потоке.
+
+    Картинки запрашиваются у IMAGE_API_URLS через общую сессию
+    с таймаутом. Выдача картинки не делает запросов: сначала выдаются
+    ссылки из запаса, затем file_id уже отправленных картинок, затем
+    картинка из static/fallback.png.
+    """
+
+    def __init__(self, urls: List[str] = IMAGE_API_URLS,
+                 size: int = IMAGE_POOL_SIZE,
+                 timeout: float = IMAGE_REQUEST_TIMEOUT) -> None:
+        self.urls = urls
+        self.size = size
+        self.timeout = timeout
+        self.pool: deque = deque(maxlen=size)
+        self.sent: deque = deque(maxlen=size)
+        self.fallback: Optional[Photo] = None
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=2))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=2))
+        self.wanted = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Запуск фонового пополнения запаса."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='image-pool', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        """Пополнение запаса до size картинок по мере расходования."""
+        while True:
+            while len(self.pool) < self.size:
+                url = self.fetch()
+                if url is None:
+                    time.sleep(IMAGE_RETRY_INTERVAL)
+                    break
+                self.pool.append(url)
+            else:
+                self.wanted.wait()
+                self.wanted.clear()
+
+    def fetch(self) -> Optional[str]:
+        """Ссылка на новую картинку или None, если все API недоступны."""
+        for api_url in self.urls:
+            try:
+                response = self.session.get(api_url, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json()[0]['url']
+            except Exception as error:
+                logging.error(f'Ошибка при запросе к {api_url}: {error}')
+        return None
+
+    def get(self) -> Photo:
+        """Картинка для отправки: ссылка, file_id или байты."""
+        self.start()
+        self.wanted.set()
+        try:
+            return self.pool.popleft()
+        except IndexError:
+            pass
+        if self.sent:
+            return random.choice(self.sent)
+        if self.fallback is None:
+            with open(FALLBACK_IMAGE, 'rb') as file:
+                self.fallback = file.read()
+        return self.fallback
+
+    def remember(self, photo: Photo, file_id: str) -> None:
+        """Сохранение file_id отправленной картинки для повторной отправки."""
+        if isinstance(photo, bytes):
+            self.fallback = file_id
+        elif file_id not in self.sent:
+            self.sent.append(file_id)
+
+
+image_pool = ImagePool()
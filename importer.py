@@ -0,0 +1,382 @@
+"""Код для импорта выписок из файлов CSV и XLSX."""
+
+import csv
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import zlib
+from calendar import monthrange
+from datetime import date, datetime, timedelta, timezone
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+import requests
+from telebot import TeleBot, types
+from telebot.apihelper import ApiException
+
+from spreadsheets import EXCEL_EPOCH, SPOOL_SIZE, XLSX_MAIN, XLSX_RELATIONSHIPS
+from storage import UTC_OFFSET, storage
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))
+IMPORT_DEFAULT_CATEGORY = os.getenv('IMPORT_DEFAULT_CATEGORY', 'Прочее')
+IMPORT_DOWNLOAD_TIMEOUT = float(os.getenv('IMPORT_DOWNLOAD_TIMEOUT', 60))
+# Бот может скачать из Telegram файл не больше 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Пространства имен в именах тегов и атрибутов ElementTree
+XLSX = f'{{{XLSX_MAIN}}}'
+RELATIONSHIP = f'{{{XLSX_RELATIONSHIPS}}}'
+SAMPLE_SIZE = 64 * 1024
+EXTENSIONS = ('.csv', '.xlsx')
+# Ошибки разбора поврежденного или чужого файла
+READ_ERRORS = (zipfile.BadZipFile, zlib.error, ElementTree.ParseError,
+               csv.Error, KeyError, IndexError, ValueError, EOFError)
+
+COLUMNS = {
+    'amount': ('сумма', 'сумма операции', 'сумма платежа', 'amount', 'sum'),
+    'description': ('описание', 'назначение', 'назначение платежа',
+                    'комментарий', 'description', 'memo'),
+    'date': ('дата', 'дата операции', 'дата платежа', 'date'),
+    'category': ('категория', 'category'),
+    'kind': ('тип', 'тип операции', 'type'),
+}
+INCOME_KINDS = ('доход', 'пополнение', 'зачисление', 'поступление', 'income')
+EXPENSE_KINDS = ('расход', 'списание', 'покупка', 'оплата', 'expense')
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+                '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y',
+                '%d/%m/%Y', '%d.%m.%y')
+NOT_A_NUMBER = re.compile(r'[^\d,.\-]')
+TIME_PATTERN = (r'(?:[ T](?P<hour>\d{1,2}):(?P<minute>\d{2})'
+                r'(?::(?P<second>\d{2}))?)?')
+ISO_DATE = re.compile(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})'
+                      + TIME_PATTERN)
+DOTTED_DATE = re.compile(
+    r'(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})'
+    + TIME_PATTERN)
+
+
+class StatementError(ValueError):
+    """Файл нельзя импортировать; текст ошибки показывается пользователю."""
+
+
+class ImportStats:
+    """Итоги импорта выписки."""
+
+    def __init__(self) -> None:
+        self.expenses = 0
+        self.incomes = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Скорость импорта, строк в секунду."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def is_statement(file_name: Optional[str]) -> bool:
+    """Файл с расширением, которое умеет читать импорт."""
+    return bool(file_name) and file_name.lower().endswith(EXTENSIONS)
+
+
+def download_document(bot: TeleBot, document: types.Document) -> IO[bytes]:
+    """Скачивание документа из Telegram во временный файл по частям."""
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        raise StatementError('файл больше 20 МБ')
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        url = bot.get_file_url(document.file_id)
+        with requests.get(url, stream=True,
+                          timeout=IMPORT_DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, file)
+    except (ApiException, requests.RequestException, OSError) as error:
+        file.close()
+        raise StatementError('не удалось скачать файл') from error
+    file.seek(0)
+    return file
+
+
+def read_csv(file: IO[bytes]) -> Iterator[Sequence]:
+    """Строки CSV: кодировка и разделитель определяются по началу файла."""
+    sample = file.read(SAMPLE_SIZE)
+    file.seek(0)
+    try:
+        sample.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as error:
+        # Файл может обрываться посередине многобайтного символа
+        encoding = ('utf-8-sig' if error.start >= len(sample) - 3
+                    else 'cp1251')
+    text = sample.decode(encoding, errors='ignore')
+    try:
+        dialect = csv.Sniffer().sniff(text.split('\n', 1)[0], ';,\t')
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(io.TextIOWrapper(file, encoding=encoding,
+                                           newline=''), dialect)
+
+
+def read_statement(file: IO[bytes], file_name: str) -> Iterator[Sequence]:
+    """Строки выписки CSV или XLSX.
+
+    Ошибки разбора файла превращаются в StatementError, чтобы
+    пользователь получил ответ, а не молчание бота.
+    """
+    rows = (read_xlsx(file) if file_name.lower().endswith('.xlsx')
+            else read_csv(file))
+    try:
+        yield from rows
+    except StatementError:
+        raise
+    except READ_ERRORS as error:
+        raise StatementError('файл поврежден или имеет неверный '
+                             'формат') from error
+
+
+def xlsx_first_sheet(archive: zipfile.ZipFile) -> str:
+    """Путь к первому листу книги внутри архива XLSX."""
+    with archive.open('xl/workbook.xml') as xml:
+        sheet = ElementTree.parse(xml).find(f'{XLSX}sheets/{XLSX}sheet')
+    if sheet is None:
+        raise StatementError('в книге нет листов')
+    relation = sheet.get(f'{RELATIONSHIP}id')
+    with archive.open('xl/_rels/workbook.xml.rels') as xml:
+        for item in ElementTree.parse(xml).getroot():
+            if item.get('Id') == relation:
+                target = item.get('Target')
+                return (target.lstrip('/') if target.startswith('/')
+                        else f'xl/{target}')
+    raise StatementError('в книге нет листов')
+
+
+def xlsx_cell(cell: ElementTree.Element, strings: List[str]):
+    """Значение ячейки XLSX: строка, число или bool."""
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        text = cell.find(f'{XLSX}is')
+        return None if text is None else ''.join(text.itertext())
+    value = cell.find(f'{XLSX}v')
+    if value is None or value.text is None:
+        return None
+    if cell_type == 's':
+        return strings[int(value.text)]
+    if cell_type == 'b':
+        return value.text == '1'
+    if cell_type in ('str', 'e'):
+        return value.text
+    return float(value.text)
+
+
+def xlsx_column(reference: str) -> int:
+    """Номер колонки (с 0) по адресу ячейки вида "AB12"."""
+    column = 0
+    for char in reference:
+        if char.isdigit():
+            break
+        column = column * 26 + ord(char) - 64
+    return column - 1
+
+
+def read_xlsx(file: IO[bytes]) -> Iterator[Sequence]:
+    """Строки первого листа XLSX, лист читается потоком.
+
+    Разбор XML идет напрямую через iterparse: openpyxl в режиме
+    read_only в несколько раз медленнее. Даты в XLSX хранятся числами,
+    их переводит parse_date.
+    """
+    with zipfile.ZipFile(file) as archive:
+        strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as xml:
+                for _, element in ElementTree.iterparse(xml):
+                    if element.tag == f'{XLSX}si':
+                        strings.append(''.join(element.itertext()))
+                        element.clear()
+        with archive.open(xlsx_first_sheet(archive)) as xml:
+            parent = None
+            for event, element in ElementTree.iterparse(
+                    xml, ('start', 'end')):
+                if event == 'start':
+                    if element.tag == f'{XLSX}sheetData':
+                        parent = element
+                    continue
+                if element.tag != f'{XLSX}row':
+                    continue
+                row = []
+                for cell in element.iter(f'{XLSX}c'):
+                    reference = cell.get('r')
+                    if reference is not None:
+                        row.extend([None] * (xlsx_column(reference)
+                                             - len(row)))
+                    row.append(xlsx_cell(cell, strings))
+                yield row
+                # Обработанные строки удаляются, чтобы память не росла
+                parent.clear()
+
+
+def map_columns(header: Sequence) -> Dict[str, int]:
+    """Номера колонок выписки по их названиям."""
+    names = [str(name or '').strip().lower() for name in header]
+    columns = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    if 'amount' not in columns:
+        raise StatementError('нет колонки "Сумма"')
+    return columns
+
+
+def parse_amount(value) -> float:
+    """Сумма из числа или строки вида "-1 234,56 ₽"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = NOT_A_NUMBER.sub('', str(value).replace('−', '-'))
+    # Десятичный разделитель - последний из встретившихся
+    if text.rfind(',') > text.rfind('.'):
+        text = text.replace('.', '').replace(',', '.')
+    else:
+        text = text.replace(',', '')
+    return float(text)
+
+
+def parse_date(value) -> str:
+    """Дата в формате, в котором хранится date_added."""
+    if isinstance(value, (int, float)):
+        return (EXCEL_EPOCH + timedelta(seconds=round(value * 86400))
+                ).isoformat(sep=' ')
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, date):
+        return f'{value.isoformat()} 00:00:00'
+    text = str(value).strip()
+    # Частые форматы разбираются без strptime, он в разы медленнее
+    match = ISO_DATE.fullmatch(text) or DOTTED_DATE.fullmatch(text)
+    if match is not None:
+        year, month, day, hour, minute, second = (
+            int(part or 0) for part in match.group(
+                'year', 'month', 'day', 'hour', 'minute', 'second'))
+        if (1 <= month <= 12 and 1 <= day <= monthrange(year, month)[1]
+                and hour < 24 and minute < 60 and second < 60):
+            return (f'{year:04}-{month:02}-{day:02} '
+                    f'{hour:02}:{minute:02}:{second:02}')
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        return parsed.strftime('%Y-%m-%d %H:%M:%S')
+    raise ValueError(f'Неизвестный формат даты: {text}')
+
+
+def is_income(amount: float, kind) -> bool:
+    """Доход ли операция: по колонке "Тип", иначе по знаку суммы."""
+    kind = str(kind or '').strip().lower()
+    if kind.startswith(INCOME_KINDS):
+        return True
+    if kind.startswith(EXPENSE_KINDS):
+        return False
+    return amount > 0
+
+
+def category_id(name: str) -> int:
+    """Id существующей категории, иначе IMPORT_DEFAULT_CATEGORY.
+
+    Категории общие для всех пользователей, поэтому категории из
+    выписки не добавляются.
+    """
+    found = storage.category_id(name)
+    if found is not None:
+        return found
+    found = storage.category_id(IMPORT_DEFAULT_CATEGORY)
+    if found is not None:
+        return found
+    return storage.add_category(IMPORT_DEFAULT_CATEGORY)
+
+
+def import_statement(file: IO[bytes], file_name: str,
+                     user_id: int) -> ImportStats:
+    """Импорт выписки пакетами по IMPORT_BATCH_SIZE строк.
+
+    Каждой строке присваивается ключ из ее содержимого и номера
+    повтора такой же строки в файле, поэтому при повторной загрузке
+    того же файла уже добавленные строки пропускаются, а одинаковые
+    операции одной выписки добавляются все. Для повторов хранятся
+    только хэши содержимого, а не текст строк.
+    """
+    stats = ImportStats()
+    rows = read_statement(file, file_name)
+    header = next(rows, None)
+    if header is None:
+        raise StatementError('файл пустой')
+    columns = map_columns(header)
+    now = (datetime.now(timezone.utc) + UTC_OFFSET).strftime(
+        '%Y-%m-%d %H:%M:%S')
+    categories: Dict[str, int] = {}
+    repeats: Dict[bytes, int] = {}
+    expenses: List[Tuple] = []
+    incomes: List[Tuple] = []
+
+    def value(row: Sequence, field: str):
+        index = columns.get(field)
+        return row[index] if index is not None and index < len(row) else None
+
+    def flush() -> None:
+        added_expenses, added_incomes = storage.import_records(
+            expenses, incomes, user_id)
+        stats.duplicates += (len(expenses) + len(incomes)
+                             - added_expenses - added_incomes)
+        stats.expenses += added_expenses
+        stats.incomes += added_incomes
+        expenses.clear()
+        incomes.clear()
+
+    for row in rows:
+        if not any(cell not in (None, '') for cell in row):
+            continue
+        stats.rows += 1
+        try:
+            amount = parse_amount(value(row, 'amount'))
+            raw_date = value(row, 'date')
+            dated = raw_date not in (None, '')
+            date_added = parse_date(raw_date) if dated else now
+        except (TypeError, ValueError):
+            stats.errors += 1
+            continue
+        if not amount:
+            stats.errors += 1
+            continue
+        description = str(value(row, 'description') or '').strip()
+        income = is_income(amount, value(row, 'kind'))
+        amount = abs(amount)
+        category = (str(value(row, 'category') or '').strip()
+                    or IMPORT_DEFAULT_CATEGORY)
+        content = hashlib.blake2b(
+            f'{income}|{date_added if dated else ""}|{amount}|{description}|'
+            f'{"" if income else category}'.encode(),
+            digest_size=16).digest()
+        repeat = repeats.get(content, 0)
+        repeats[content] = repeat + 1
+        key = f'{content.hex()}:{repeat}'
+        if income:
+            incomes.append((amount, description, date_added, key))
+        else:
+            if category not in categories:
+                categories[category] = category_id(category)
+            expenses.append((amount, description, date_added,
+                             categories[category], key))
+        if len(expenses) + len(incomes) >= IMPORT_BATCH_SIZE:
+            flush()
+    flush()
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
@@ -0,0 +1,97 @@
+"""Код для клавиатур бота: готовые в JSON и кнопки страниц записей."""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from telebot import types
+
+BACK_BUTTON = 'Назад'
+NEWER_BUTTON = '« Новее'
+OLDER_BUTTON = 'Старее »'
+# Подпись кнопки записи длиннее обрезается
+RECORD_BUTTON_LENGTH = 40
+
+
+def reply_keyboard(*rows: Sequence[str]) -> str:
+    """Клавиатура ответа в JSON.
+
+    Кнопки каждой группы rows добавляются через add, то есть
+    переносятся по три в ряд, как при сборке клавиатуры в обработчике.
+    """
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for row in rows:
+        markup.add(*row)
+    return markup.to_json()
+
+
+class KeyboardRegistry:
+    """Клавиатуры ответа в готовом JSON.
+
+    Постоянные клавиатуры собираются один раз при регистрации, и TeleBot
+    отправляет строку как есть, без сборки и сериализации на каждый
+    ответ. Клавиатура категорий собирается заново, только когда
+    изменился список категорий.
+    """
+
+    def __init__(self) -> None:
+        self.keyboards: Dict[str, str] = {
+            'remove': types.ReplyKeyboardRemove().to_json()}
+        # back -> (категории, клавиатура)
+        self.category_keyboards: Dict[bool, Tuple[List[Tuple[int, str]],
+                                                  str]] = {}
+
+    def add(self, name: str, *rows: Sequence[str]) -> None:
+        """Регистрация постоянной клавиатуры из групп кнопок rows."""
+        self.keyboards[name] = reply_keyboard(*rows)
+
+    def get(self, name: str) -> str:
+        """Постоянная клавиатура по имени."""
+        return self.keyboards[name]
+
+    def categories(self, categories: List[Tuple[int, str]],
+                   back: bool = False) -> Optional[str]:
+        """Клавиатура категорий (id, имя) по одной в ряд или None.
+
+        back - добавить кнопку BACK_BUTTON последним рядом.
+        """
+        if not categories:
+            return None
+        cached = self.category_keyboards.get(back)
+        if cached is not None and cached[0] == categories:
+            return cached[1]
+        rows = [[name] for _, name in categories]
+        if back:
+            rows.append([BACK_BUTTON])
+        keyboard = reply_keyboard(*rows)
+        self.category_keyboards[back] = (categories, keyboard)
+        return keyboard
+
+
+keyboards = KeyboardRegistry()
+
+
+def records_keyboard(prefix: str, records: Sequence[Tuple[int, str]],
+                     newer_id: Optional[int] = None,
+                     older_id: Optional[int] = None
+                     ) -> types.InlineKeyboardMarkup:
+    """Кнопки страницы записей (id, подпись) по одной в ряд.
+
+    Кнопка записи передает '{prefix}:pick:{id}', кнопки соседних
+    страниц - '{prefix}:newer:{id}' и '{prefix}:older:{id}'. Кнопка
+    страницы есть, только если ее id указан.
+    """
+    markup = types.InlineKeyboardMarkup()
+    for record_id, label in records:
+        if len(label) > RECORD_BUTTON_LENGTH:
+            label = label[:RECORD_BUTTON_LENGTH - 1] + '…'
+        markup.row(types.InlineKeyboardButton(
+            label, callback_data=f'{prefix}:pick:{record_id}'))
+    pages = []
+    if newer_id is not None:
+        pages.append(types.InlineKeyboardButton(
+            NEWER_BUTTON, callback_data=f'{prefix}:newer:{newer_id}'))
+    if older_id is not None:
+        pages.append(types.InlineKeyboardButton(
+            OLDER_BUTTON, callback_data=f'{prefix}:older:{older_id}'))
+    if pages:
+        markup.row(*pages)
+    return markup
@@ -0,0 +1,248 @@
+"""Код для сбора метрик времени выполнения и их выдачи по HTTP."""
+
+import bisect
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# 0 - HTTP-сервер метрик не запускается, метрики только собираются
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', 0.005))
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+KINDS = {
+    'handler': 'Время обработчиков сообщений',
+    'db': 'Время функций db_functions',
+    'query': 'Время запросов статистики',
+    'render': 'Время построения графиков',
+    'send': 'Время запросов к Bot API',
+}
+
+
+class Histogram:
+    """Гистограмма времени выполнения с числом вызовов и ошибок."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool) -> None:
+        """Учет одного вызова."""
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.errors += error
+
+
+class Registry:
+    """Гистограммы по виду и имени измеряемого кода."""
+
+    def __init__(self) -> None:
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, seconds: float,
+                error: bool = False) -> None:
+        """Учет одного вызова name."""
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[kind, name] = Histogram()
+            histogram.observe(seconds, error)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus."""
+        with self.lock:
+            items = sorted((key, list(histogram.counts), histogram.total,
+                            histogram.errors)
+                           for key, histogram in self.histograms.items())
+        lines: List[str] = []
+        for kind, description in KINDS.items():
+            metric = f'bot_{kind}_seconds'
+            lines += [f'# HELP {metric} {description}, секунд.',
+                      f'# TYPE {metric} histogram']
+            for (item_kind, name), counts, total, _ in items:
+                if item_kind != kind:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{name="{name}",'
+                                 f'le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{name}"}} {total}')
+                lines.append(f'{metric}_count{{name="{name}"}} {cumulative}')
+            errors = f'bot_{kind}_errors_total'
+            lines += [f'# HELP {errors} {description}: число ошибок.',
+                      f'# TYPE {errors} counter']
+            lines += [f'{errors}{{name="{name}"}} {error_count}'
+                      for (item_kind, name), _, _, error_count in items
+                      if item_kind == kind]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def timer(kind: str, name: str) -> Iterator[None]:
+    """Измерение времени выполнения блока кода."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        registry.observe(kind, name, time.perf_counter() - started, error)
+
+
+def timed(kind: str) -> Callable[[Callable], Callable]:
+    """Декоратор: измерение времени каждого вызова функции."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(kind, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_functions(namespace: dict, kind: str) -> None:
+    """Обертка timed для всех функций, определенных в модуле namespace."""
+    for name, value in list(namespace.items()):
+        if (callable(value) and not isinstance(value, type)
+                and not name.startswith('_')
+                and getattr(value, '__module__', None)
+                == namespace['__name__']):
+            namespace[name] = timed(kind)(value)
+
+
+def instrument_bot(bot) -> None:
+    """Обертка timed для обработчиков сообщений и нажатий кнопок."""
+    for handler in bot.message_handlers + bot.callback_query_handlers:
+        handler['function'] = timed('handler')(handler['function'])
+
+
+def collapse(frame) -> str:
+    """Стек вызовов в виде "файл:функция;файл:функция" от корня."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Профилировщик, периодически снимающий стеки всех потоков.
+
+    Результат - число попаданий каждого стека в формате collapsed
+    stacks (flamegraph.pl, speedscope). Включается и выключается
+    без перезапуска бота.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.thread: Optional[threading.Thread] = None
+        self.running = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Включение профилирования с очисткой прошлых результатов."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stacks.clear()
+            self.samples = 0
+            self.running.set()
+            self.thread = threading.Thread(
+                target=self.run, name='profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Выключение профилирования, результаты сохраняются."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running.clear()
+        if thread is not None:
+            thread.join()
+
+    def run(self) -> None:
+        """Снятие стеков раз в interval секунд."""
+        own = threading.get_ident()
+        while self.running.is_set():
+            stacks = [collapse(frame) for ident, frame
+                      in sys._current_frames().items() if ident != own]
+            with self.lock:
+                self.samples += 1
+                self.stacks.update(stacks)
+            time.sleep(self.interval)
+
+    def render(self) -> str:
+        """Стеки в формате collapsed stacks, частые - первыми."""
+        with self.lock:
+            return ''.join(f'{stack} {count}\n'
+                           for stack, count in self.stacks.most_common())
+
+
+profiler = SamplingProfiler()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics, GET /profile, POST /profile/start и /profile/stop."""
+
+    def do_GET(self) -> None:
+        """Выдача метрик и результатов профилирования."""
+        if self.path == '/metrics':
+            return self.reply(200, registry.render(),
+                              'text/plain; version=0.0.4')
+        if self.path == '/profile':
+            return self.reply(200, profiler.render())
+        self.reply(404, '')
+
+    def do_POST(self) -> None:
+        """Включение и выключение профилировщика."""
+        if self.path == '/profile/start':
+            profiler.start()
+        elif self.path == '/profile/stop':
+            profiler.stop()
+        else:
+            return self.reply(404, '')
+        self.reply(200, '')
+
+    def reply(self, status: int, text: str,
+              content_type: str = 'text/plain') -> None:
+        """Ответ с текстом text."""
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Запросы не пишутся в лог."""
+
+
+def start_metrics_server(host: str = METRICS_HOST,
+                         port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    """Запуск HTTP-сервера метрик в фоновом потоке."""
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics',
+                     daemon=True).start()
+    logging.info(f'Метрики доступны на порту {httpd.server_address[1]}')
+    return httpd
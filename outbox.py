@@ -0,0 +1,359 @@
+"""Код для отправки сообщений с ограничением частоты запросов к Telegram."""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from telebot import TeleBot, types
+from telebot.apihelper import ApiTelegramException
+
+from metrics import timer
+
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', 30))
+OUTBOX_GLOBAL_BURST = float(os.getenv('OUTBOX_GLOBAL_BURST', 30))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', 1))
+OUTBOX_CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', 3))
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', 20 / 60))
+OUTBOX_LINGER = float(os.getenv('OUTBOX_LINGER', 0.05))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 8))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', 3))
+# Со скольких чатов, одновременно получивших 429, пауза становится общей
+OUTBOX_GLOBAL_PAUSE_CHATS = int(os.getenv('OUTBOX_GLOBAL_PAUSE_CHATS', 2))
+MAX_MESSAGE_LENGTH = 4096
+TEXT_SEPARATOR = '\n\n'
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+
+class TokenBucket:
+    """Ограничение частоты: rate запросов в секунду, до burst подряд."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now: float) -> None:
+        """Пополнение токенов за прошедшее время."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего запроса (0 - можно сейчас)."""
+        self.refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self) -> None:
+        """Расход токена на запрос."""
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Запрет запросов на seconds секунд (ответ 429 от Telegram)."""
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        """Токены полностью восстановились и бакет можно забыть."""
+        self.refill(now)
+        return self.tokens >= self.burst and self.paused_until <= now
+
+
+class Outgoing:
+    """Исходящий запрос к Bot API, ожидающий отправки."""
+
+    def __init__(self, method: str, chat_id: int, kwargs: dict,
+                 priority: int, not_before: float) -> None:
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.not_before = not_before
+        self.futures: List[Future] = [Future()]
+        self.retries = 0
+
+    def merge(self, text: str, kwargs: dict, not_before: float) -> bool:
+        """Присоединение текста к этому сообщению, если это возможно."""
+        if self.method != 'send_message':
+            return False
+        markup = kwargs.get('reply_markup')
+        options = {key: value for key, value in kwargs.items()
+                   if key != 'reply_markup'}
+        current = {key: value for key, value in self.kwargs.items()
+                   if key not in ('text', 'reply_markup')}
+        merged = self.kwargs['text'] + TEXT_SEPARATOR + text
+        # Кнопки под сообщением относятся к его тексту, и такое
+        # сообщение может изменяться, поэтому оно не объединяется
+        if (current != options
+                or isinstance(self.kwargs.get('reply_markup'),
+                              types.InlineKeyboardMarkup)
+                or isinstance(markup, types.InlineKeyboardMarkup)
+                or len(merged) > MAX_MESSAGE_LENGTH):
+            return False
+        self.kwargs['text'] = merged
+        # Клавиатура ответа действует до следующей, поэтому остается
+        # последняя из объединенных сообщений
+        if markup is not None:
+            self.kwargs['reply_markup'] = markup
+        self.not_before = not_before
+        self.futures.append(Future())
+        return True
+
+
+class Outbox:
+    """Очередь исходящих сообщений с ограничением частоты отправки.
+
+    Сообщения одного чата отправляются строго по порядку и не чаще
+    лимита чата, все сообщения вместе - не чаще глобального лимита.
+    Текст, поставленный в очередь сразу за другим текстом того же чата,
+    дописывается к нему, пока тот ждет отправки не дольше linger секунд.
+    Из готовых к отправке чатов первыми обслуживаются чаты с
+    PRIORITY_HIGH. При ответе 429 чат приостанавливается на retry_after.
+    Telegram не сообщает, какой лимит превышен: если на паузе уже
+    global_pause_chats чатов, превышен общий лимит бота, и на
+    retry_after приостанавливается вся отправка.
+    """
+
+    def __init__(self, bot: TeleBot,
+                 global_rate: float = OUTBOX_GLOBAL_RATE,
+                 global_burst: float = OUTBOX_GLOBAL_BURST,
+                 chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: float = OUTBOX_CHAT_BURST,
+                 group_rate: float = OUTBOX_GROUP_RATE,
+                 linger: float = OUTBOX_LINGER,
+                 workers: int = OUTBOX_WORKERS,
+                 global_pause_chats: int = OUTBOX_GLOBAL_PAUSE_CHATS
+                 ) -> None:
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.linger = linger
+        self.workers = workers
+        self.global_pause_chats = global_pause_chats
+        self.chats: Dict[int, Deque[Outgoing]] = {}
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.lanes: Tuple[Deque[int], ...] = (deque(), deque())
+        self.delayed: List[Tuple[float, int, int]] = []
+        self.scheduled: Set[int] = set()
+        self.in_flight: Set[int] = set()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+        self.pruned = time.monotonic()
+
+    def start(self) -> None:
+        """Запуск потока отправки."""
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix='outbox')
+            self.thread = threading.Thread(
+                target=self.run, name='outbox', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Остановка после отправки всех сообщений из очереди."""
+        with self.condition:
+            if self.thread is None:
+                return
+            while self.chats or self.in_flight:
+                self.condition.wait()
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.executor.shutdown()
+        self.thread = None
+
+    def send_message(self, chat_id: int, text: str,
+                     priority: int = PRIORITY_HIGH, **kwargs) -> Future:
+        """Постановка текстового сообщения в очередь."""
+        now = time.monotonic()
+        with self.condition:
+            queue = self.chats.get(chat_id)
+            # В очереди лежат только еще не отправленные сообщения
+            if queue and queue[-1].merge(text, kwargs, now + self.linger):
+                return queue[-1].futures[-1]
+            kwargs['text'] = text
+            return self.put(Outgoing('send_message', chat_id, kwargs,
+                                     priority, now + self.linger))
+
+    def send_photo(self, chat_id: int, photo,
+                   priority: int = PRIORITY_LOW, **kwargs) -> Future:
+        """Постановка фотографии в очередь."""
+        kwargs['photo'] = photo
+        with self.condition:
+            return self.put(Outgoing('send_photo', chat_id, kwargs,
+                                     priority, time.monotonic()))
+
+    def send_document(self, chat_id: int, document,
+                      priority: int = PRIORITY_LOW, **kwargs) -> Future:
+        """Постановка документа в очередь."""
+        kwargs['document'] = document
+        with self.condition:
+            return self.put(Outgoing('send_document', chat_id, kwargs,
+                                     priority, time.monotonic()))
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str,
+                          priority: int = PRIORITY_HIGH,
+                          **kwargs) -> Future:
+        """Постановка в очередь изменения текста и кнопок сообщения."""
+        kwargs.update(message_id=message_id, text=text)
+        with self.condition:
+            return self.put(Outgoing('edit_message_text', chat_id, kwargs,
+                                     priority, time.monotonic()))
+
+    def put(self, item: Outgoing) -> Future:
+        """Добавление запроса в очередь чата (под condition)."""
+        self.start()
+        queue = self.chats.setdefault(item.chat_id, deque())
+        queue.append(item)
+        if len(queue) == 1:
+            self.schedule(item.chat_id, time.monotonic())
+        return item.futures[0]
+
+    def bucket(self, chat_id: int) -> TokenBucket:
+        """Лимит частоты отправки в чат."""
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self.buckets[chat_id] = TokenBucket(
+                rate, self.chat_burst)
+        return bucket
+
+    def schedule(self, chat_id: int, now: float) -> None:
+        """Постановка чата в очередь на отправку его первого сообщения."""
+        if chat_id in self.in_flight or chat_id in self.scheduled:
+            return
+        item = self.chats[chat_id][0]
+        ready_at = max(now + self.bucket(chat_id).delay(now),
+                       item.not_before)
+        self.scheduled.add(chat_id)
+        if ready_at <= now:
+            self.lanes[item.priority].append(chat_id)
+        else:
+            heapq.heappush(self.delayed,
+                           (ready_at, next(self.counter), chat_id))
+        self.condition.notify()
+
+    def next_item(self, now: float) -> Tuple[Optional[Outgoing], float]:
+        """Следующий запрос к отправке или время ожидания (под condition)."""
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self.delayed)
+            queue = self.chats[chat_id]
+            ready_at = max(now + self.bucket(chat_id).delay(now),
+                           queue[0].not_before)
+            if ready_at > now:
+                heapq.heappush(self.delayed,
+                               (ready_at, next(self.counter), chat_id))
+                break
+            self.lanes[queue[0].priority].append(chat_id)
+        wait = self.delayed[0][0] - now if self.delayed else None
+        if not any(self.lanes):
+            return None, wait
+        delay = self.global_bucket.delay(now)
+        if delay > 0:
+            return None, delay
+        lane = next(lane for lane in self.lanes if lane)
+        chat_id = lane.popleft()
+        self.scheduled.discard(chat_id)
+        self.in_flight.add(chat_id)
+        self.global_bucket.take()
+        self.bucket(chat_id).take()
+        return self.chats[chat_id].popleft(), 0
+
+    def run(self) -> None:
+        """Выбор запросов по лимитам и передача их в пул отправки."""
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                item, wait = self.next_item(now)
+                if item is None:
+                    self.condition.wait(wait)
+                    continue
+                self.executor.submit(self.deliver, item)
+                if now - self.pruned > 60:
+                    self.prune(now)
+
+    def deliver(self, item: Outgoing) -> None:
+        """Отправка одного запроса в Telegram."""
+        if item.retries:
+            # Файл мог быть прочитан при прошлой попытке
+            for value in item.kwargs.values():
+                if hasattr(value, 'seek'):
+                    value.seek(0)
+        try:
+            with timer('send', item.method):
+                result = getattr(self.bot, item.method)(
+                    chat_id=item.chat_id, **item.kwargs)
+        except ApiTelegramException as error:
+            if (error.error_code == 429
+                    and item.retries < OUTBOX_MAX_RETRIES):
+                retry_after = error.result_json.get(
+                    'parameters', {}).get('retry_after', 1)
+                logging.warning(f'Лимит Telegram для чата {item.chat_id}, '
+                                f'повтор через {retry_after} с')
+                item.retries += 1
+                return self.finish(item, retry_after=retry_after)
+            self.fail(item, error)
+        except Exception as error:
+            self.fail(item, error)
+        else:
+            for future in item.futures:
+                future.set_result(result)
+        self.finish(item)
+
+    def fail(self, item: Outgoing, error: Exception) -> None:
+        """Передача ошибки отправки ожидающим ответа."""
+        logging.error(f'Ошибка отправки {item.method} '
+                      f'в чат {item.chat_id}: {error}')
+        for future in item.futures:
+            future.set_exception(error)
+
+    def finish(self, item: Outgoing,
+               retry_after: Optional[float] = None) -> None:
+        """Освобождение чата после отправки запроса."""
+        with self.condition:
+            now = time.monotonic()
+            chat_id = item.chat_id
+            queue = self.chats[chat_id]
+            if retry_after is not None:
+                self.bucket(chat_id).pause(now, retry_after)
+                queue.appendleft(item)
+                self.pause_all(now, retry_after)
+            self.in_flight.discard(chat_id)
+            if queue:
+                self.schedule(chat_id, now)
+            else:
+                del self.chats[chat_id]
+            self.condition.notify_all()
+
+    def pause_all(self, now: float, retry_after: float) -> None:
+        """Общая пауза, если 429 получили сразу несколько чатов."""
+        paused = sum(1 for bucket in self.buckets.values()
+                     if bucket.paused_until > now)
+        if paused >= self.global_pause_chats:
+            logging.warning(f'Общий лимит Telegram: {paused} чатов на паузе, '
+                            f'отправка приостановлена на {retry_after} с')
+            self.global_bucket.pause(now, retry_after)
+
+    def prune(self, now: float) -> None:
+        """Удаление лимитов чатов, которым давно ничего не отправлялось."""
+        for chat_id in [chat_id for chat_id, bucket in self.buckets.items()
+                        if chat_id not in self.chats and bucket.idle(now)]:
+            del self.buckets[chat_id]
+        self.pruned = now
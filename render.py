@@ -0,0 +1,149 @@
+"""Код для построения графиков в пуле процессов."""
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+from typing import Callable, Optional, Sequence
+
+from runtime import WORKER_PROCESSES
+
+# Ядра делятся между пулами процессов-обработчиков
+RENDER_WORKERS = int(os.getenv(
+    'RENDER_WORKERS', max(1, (os.cpu_count() or 1) // WORKER_PROCESSES)))
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', 30))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', RENDER_WORKERS * 4))
+
+
+class RenderBusyError(Exception):
+    """Очередь на построение графиков заполнена."""
+
+
+def save_figure(plt) -> bytes:
+    """Сохранение текущей фигуры в PNG и закрытие фигуры."""
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png')
+    plt.close()
+    return buffer.getvalue()
+
+
+def plot_line(dates: Sequence, amounts: Sequence[float], title: str,
+              label: Optional[str] = None, grid_axis: str = 'both') -> bytes:
+    """График сумм по датам (datetime или массив datetime64)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(dates, amounts, marker='o', linewidth=2,
+             color='skyblue', label=label)
+    plt.xlabel('Дата')
+    plt.ylabel('Сумма, руб')
+    plt.title(title)
+    plt.xticks(rotation=45)
+    plt.grid(axis=grid_axis)
+    if label:
+        plt.legend()
+    plt.tight_layout()
+    return save_figure(plt)
+
+
+def plot_pie(values: Sequence[float], labels: Sequence[str],
+             title: str) -> bytes:
+    """Круговая диаграмма."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.pie(values, labels=labels, autopct='%.1f%%')
+    plt.title(title)
+    plt.axis('equal')
+    return save_figure(plt)
+
+
+class RenderEngine:
+    """Пул процессов для построения графиков.
+
+    Функции построения выполняются в отдельных процессах и возвращают
+    PNG в виде байтов. Если в очереди уже queue_size задач, новая задача
+    не принимается (RenderBusyError), а ожидание результата ограничено
+    timeout секундами (concurrent.futures.TimeoutError).
+
+    Процессы запускаются через spawn: fork процесса с потоками отправки,
+    записи и картинок может унаследовать занятые блокировки. Если
+    процесс пула завершился, пул сломан (BrokenExecutor): задачи
+    получают эту ошибку, а следующая задача запускает новый пул.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS,
+                 timeout: float = RENDER_TIMEOUT,
+                 queue_size: int = RENDER_QUEUE_SIZE) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> ProcessPoolExecutor:
+        """Запуск пула процессов."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def discard(self, executor: ProcessPoolExecutor) -> None:
+        """Отказ от сломанного пула: следующая задача запустит новый."""
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+        logging.error('Пул построения графиков сломан, будет перезапущен')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func: Callable[..., bytes], *args, **kwargs) -> Future:
+        """Постановка задачи в очередь на построение.
+
+        Если пул сломался до постановки, задача ставится в новый пул.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise RenderBusyError()
+        try:
+            executor = self.start()
+            try:
+                future = executor.submit(func, *args, **kwargs)
+            except BrokenExecutor:
+                self.discard(executor)
+                executor = self.start()
+                future = executor.submit(func, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(
+            lambda done: self.finish(executor, done))
+        return future
+
+    def finish(self, executor: ProcessPoolExecutor, future: Future) -> None:
+        """Освобождение места в очереди после задачи."""
+        self.slots.release()
+        if (not future.cancelled()
+                and isinstance(future.exception(), BrokenExecutor)):
+            self.discard(executor)
+
+    def render(self, func: Callable[..., bytes], *args, **kwargs) -> bytes:
+        """Построение графика с ожиданием результата."""
+        return self.submit(func, *args, **kwargs).result(timeout=self.timeout)
+
+    def shutdown(self) -> None:
+        """Остановка пула процессов."""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+
+render_engine = RenderEngine()
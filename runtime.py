@@ -0,0 +1,144 @@
+"""Код для режимов приема и обработки обновлений."""
+
+import logging
+import os
+import queue
+import threading
+from typing import List, Optional
+
+from telebot import TeleBot, types
+
+HANDLER_WORKERS = int(os.getenv('HANDLER_WORKERS', 32))
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', 256))
+# Больше 1 - обновления обрабатываются в нескольких процессах
+# (supervisor.py)
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+
+
+def get_chat_id(update: types.Update) -> Optional[int]:
+    """Получение id чата, к которому относится обновление."""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    return None
+
+
+class ChatQueues:
+    """Пул потоков-обработчиков с ограниченной очередью у каждого.
+
+    Обновления распределяются по очередям по id чата, поэтому сообщения
+    одного чата обрабатываются по порядку. Каждый поток забирает из
+    очереди до batch_size обновлений и передает их боту одним вызовом.
+    """
+
+    def __init__(self, bot: TeleBot, workers: int, queue_size: int,
+                 batch_size: int, name: str = 'handler') -> None:
+        self.bot = bot
+        self.batch_size = batch_size
+        self.name = name
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads: List[threading.Thread] = []
+
+    def put(self, update: types.Update,
+            timeout: Optional[float] = None) -> bool:
+        """Постановка обновления в очередь (False - очередь заполнена)."""
+        chat_id = get_chat_id(update)
+        key = update.update_id if chat_id is None else chat_id
+        try:
+            self.queues[key % len(self.queues)].put(update, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def work(self, updates: queue.Queue) -> None:
+        """Обработка обновлений одной очереди пакетами."""
+        while True:
+            batch: List[Optional[types.Update]] = [updates.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            batch = [update for update in batch if update is not None]
+            if batch:
+                try:
+                    self.bot.process_new_updates(batch)
+                except Exception as error:
+                    logging.exception(
+                        f'Ошибка при обработке обновлений: {error}')
+            if stop:
+                return
+
+    def start(self) -> None:
+        """Запуск потоков-обработчиков."""
+        for index, updates in enumerate(self.queues):
+            thread = threading.Thread(target=self.work, args=(updates,),
+                                      name=f'{self.name}-{index}',
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        """Остановка после обработки обновлений из очередей."""
+        for updates in self.queues:
+            updates.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class ChatPolling(TeleBot):
+    """Long polling, передающий обновления пулу ChatQueues.
+
+    Пул TeleBot проверяет фильтры обработчиков в потоке polling, а сами
+    обработчики вызывает в любом порядке: два быстрых сообщения чата
+    проходили фильтр шага диалога вместе. Здесь обновления одного чата
+    обрабатываются по порядку, а пока очередь чата заполнена, новые
+    обновления не запрашиваются.
+    """
+
+    def __init__(self, bot: TeleBot, workers: int, queue_size: int,
+                 batch_size: int) -> None:
+        super().__init__(token=bot.token, threaded=False)
+        self.handlers = ChatQueues(bot, workers, queue_size, batch_size)
+
+    def process_new_updates(self, updates: List[types.Update]) -> None:
+        """Постановка обновлений в очереди чатов."""
+        for update in updates:
+            self.handlers.put(update)
+            # Смещение getUpdates сдвигает process_new_updates TeleBot,
+            # который здесь не вызывается
+            self.last_update_id = max(self.last_update_id, update.update_id)
+
+
+def run_polling(bot: TeleBot, queue_size: int, batch_size: int) -> None:
+    """Запуск бота в режиме long polling с пулом ChatQueues."""
+    polling = ChatPolling(bot, HANDLER_WORKERS, queue_size, batch_size)
+    polling.handlers.start()
+    try:
+        polling.polling(none_stop=True)
+    finally:
+        polling.handlers.stop()
+
+
+def run_async(bot: TeleBot) -> None:
+    """Запуск бота в асинхронном режиме.
+
+    aiohttp и AsyncTeleBot нужны только здесь, поэтому импортируются
+    при запуске, а не при импорте модуля. Адреса Bot API берутся те же,
+    что у синхронного бота (TELEGRAM_API_URL).
+    """
+    import asyncio
+
+    from telebot import apihelper, asyncio_helper
+
+    from async_runtime import serve
+
+    asyncio_helper.API_URL = apihelper.API_URL or asyncio_helper.API_URL
+    asyncio_helper.FILE_URL = apihelper.FILE_URL
+    asyncio.run(serve(bot))
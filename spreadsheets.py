@@ -0,0 +1,12 @@
+"""Общие константы для чтения и записи файлов CSV и XLSX."""
+
+from datetime import datetime
+
+# Временный файл больше этого размера переносится из памяти на диск
+SPOOL_SIZE = 1024 * 1024
+# Даты XLSX - число дней от 30.12.1899
+EXCEL_EPOCH = datetime(1899, 12, 30)
+XLSX_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_RELATIONSHIPS = ('http://schemas.openxmlformats.org/officeDocument/'
+                      '2006/relationships')
+XLSX_PACKAGE = 'http://schemas.openxmlformats.org/package/2006'
@@ -0,0 +1,191 @@
+"""Код для хранения состояний диалогов с пользователями."""
+
+import atexit
+import enum
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from db_functions import connections
+
+STATE_STORAGE = os.getenv('STATE_STORAGE', 'memory')
+STATE_TTL = float(os.getenv('STATE_TTL', 86400))
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 100000))
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 1))
+
+
+class State(enum.Enum):
+    """Шаги многошаговых диалогов: какое сообщение ожидается от чата."""
+
+    ACTION = 'action'
+    ADD_AMOUNT = 'add_amount'
+    NEW_CATEGORY = 'new_category'
+    INCOME_DESCRIPTION = 'income_description'
+    EDIT_INCOME_ID = 'edit_income_id'
+    EDIT_INCOME_AMOUNT = 'edit_income_amount'
+    EDIT_INCOME_DESCRIPTION = 'edit_income_description'
+    DELETE_INCOME_ID = 'delete_income_id'
+    EXPENSE_DESCRIPTION = 'expense_description'
+    EXPENSE_CATEGORY = 'expense_category'
+    EDIT_EXPENSE_ID = 'edit_expense_id'
+    EDIT_EXPENSE_AMOUNT = 'edit_expense_amount'
+    EDIT_EXPENSE_DESCRIPTION = 'edit_expense_description'
+    EDIT_EXPENSE_CATEGORY = 'edit_expense_category'
+    DELETE_EXPENSE_ID = 'delete_expense_id'
+    STATS_FORMAT = 'stats_format'
+    EXPORT_FORMAT = 'export_format'
+
+
+class MemoryStateStore:
+    """Состояния диалогов в памяти: LRU с ограничением по времени жизни."""
+
+    def __init__(self, ttl: float = STATE_TTL,
+                 max_size: int = STATE_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Optional[Tuple[State, dict]]:
+        """Текущее состояние чата или None."""
+        with self.lock:
+            item = self.items.get(chat_id)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self.items[chat_id]
+                return None
+            return item[1], item[2]
+
+    def set(self, chat_id: int, state: State, data: dict) -> None:
+        """Сохранение состояния чата."""
+        with self.lock:
+            self.items[chat_id] = (time.monotonic() + self.ttl, state, data)
+            self.items.move_to_end(chat_id)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def pop(self, chat_id: int) -> Optional[Tuple[State, dict]]:
+        """Извлечение состояния чата с удалением."""
+        with self.lock:
+            item = self.items.pop(chat_id, None)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1], item[2]
+
+    def start(self) -> None:
+        """Подготовка к работе: в памяти ничего не нужно."""
+
+    def purge(self) -> None:
+        """Удаление просроченных состояний."""
+        now = time.monotonic()
+        with self.lock:
+            for chat_id in [chat_id for chat_id, item in self.items.items()
+                            if item[0] <= now]:
+                del self.items[chat_id]
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """Состояния диалогов в памяти с копией в таблице chat_states.
+
+    Сообщения обрабатываются только по памяти, таблица читается один раз
+    при запуске (start), поэтому диалоги продолжаются после перезапуска.
+    Изменения не пишутся в БД на каждое сообщение: для каждого чата
+    запоминается последнее, и раз в flush_interval секунд фоновый поток
+    записывает их одной транзакцией. Извлечение и новое состояние шага
+    диалога дают одну запись; при падении процесса теряются изменения
+    за последний интервал.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL,
+                 max_size: int = STATE_CACHE_SIZE,
+                 flush_interval: float = STATE_FLUSH_INTERVAL) -> None:
+        super().__init__(ttl, max_size)
+        self.flush_interval = flush_interval
+        # chat_id -> (состояние, данные, срок по time.time()), None - удалить
+        self.changes: Dict[int, Optional[Tuple[str, str, float]]] = {}
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def set(self, chat_id: int, state: State, data: dict) -> None:
+        """Сохранение состояния чата."""
+        super().set(chat_id, state, data)
+        change = (state.value, json.dumps(data), time.time() + self.ttl)
+        with self.lock:
+            self.changes[chat_id] = change
+
+    def pop(self, chat_id: int) -> Optional[Tuple[State, dict]]:
+        """Извлечение состояния чата с удалением."""
+        current = super().pop(chat_id)
+        with self.lock:
+            self.changes[chat_id] = None
+        return current
+
+    def start(self) -> None:
+        """Загрузка состояний из БД и запуск фоновой записи."""
+        self.purge()
+        now, started = time.time(), time.monotonic()
+        rows = connections.reader().execute(
+            'SELECT chat_id, state, data, expires_at FROM chat_states'
+        ).fetchall()
+        with self.lock:
+            for chat_id, state, data, expires_at in rows:
+                if chat_id not in self.items:
+                    self.items[chat_id] = (started + expires_at - now,
+                                           State(state), json.loads(data))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                                           name='state-flush', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def run(self) -> None:
+        """Запись изменений раз в flush_interval секунд до остановки."""
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Запись накопленных изменений одной транзакцией."""
+        with self.lock:
+            changes, self.changes = self.changes, {}
+        if not changes:
+            return
+        with connections.writer() as con:
+            con.executemany(
+                'DELETE FROM chat_states WHERE chat_id = ?',
+                [(chat_id,) for chat_id, change in changes.items()
+                 if change is None])
+            con.executemany(
+                '''
+                INSERT OR REPLACE INTO chat_states
+                    (chat_id, state, data, expires_at) VALUES (?, ?, ?, ?)
+                ''', [(chat_id, *change) for chat_id, change in changes.items()
+                      if change is not None])
+
+    def stop(self) -> None:
+        """Остановка фоновой записи с записью оставшихся изменений."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def purge(self) -> None:
+        """Удаление просроченных состояний из памяти и БД."""
+        super().purge()
+        with connections.writer() as con:
+            con.execute('DELETE FROM chat_states WHERE expires_at <= ?',
+                        (time.time(),))
+
+
+def create_state_store():
+    """Хранилище состояний по настройке STATE_STORAGE."""
+    if STATE_STORAGE == 'sqlite':
+        return SQLiteStateStore()
+    return MemoryStateStore()
+
+
+state_store = create_state_store()
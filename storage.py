@@ -0,0 +1,503 @@
+"""Код для хранилищ данных бота: SQLite, в памяти и асинхронного."""
+
+import asyncio
+import calendar
+import functools
+import heapq
+import itertools
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import (Any, AsyncIterator, Callable, Dict, Iterator, List,
+                    Optional, Set, Tuple)
+
+import numpy as np
+
+import db_functions
+from analytics import read_points, read_rows, read_total, to_points
+from cache import data_versions
+from db_functions import PERIOD_BUCKETS, category_index
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+STORAGE_ASYNC_WORKERS = int(os.getenv('STORAGE_ASYNC_WORKERS', 4))
+# Записей на странице при редактировании и удалении
+RECORDS_PAGE_SIZE = int(os.getenv('RECORDS_PAGE_SIZE', 10))
+# Как в значении date_added по умолчанию: datetime('now', '+3 hours')
+UTC_OFFSET = timedelta(hours=3)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+UNKNOWN_CATEGORY = 'Неизвестная категория'
+TOP_EXPENSES = 5
+
+
+class SQLiteStorage:
+    """Данные в SQLite: запросы db_functions и статистика analytics."""
+
+    def add_user(self, telegram_id: int) -> None:
+        """Добавление пользователя, если его еще нет."""
+        db_functions.add_user(telegram_id)
+
+    def categories(self) -> List[Tuple[int, str]]:
+        """Список (id, имя) всех категорий."""
+        return db_functions.sql_all_category()
+
+    def category_id(self, name: str) -> Optional[int]:
+        """Id категории по имени или None."""
+        return category_index.get_id(name)
+
+    def add_category(self, name: str) -> int:
+        """Добавление категории, возвращает ее id."""
+        db_functions.sql_insert_category(name)
+        return category_index.get_id(name)
+
+    def add_income(self, amount: float, description: str,
+                   user_id: int) -> None:
+        """Добавление дохода."""
+        db_functions.sql_insert_incomes(amount, description, user_id)
+
+    def incomes_page(self, user_id: int, before_id: Optional[int] = None,
+                     after_id: Optional[int] = None,
+                     limit: int = RECORDS_PAGE_SIZE) -> List[tuple]:
+        """Доходы (id, сумма, описание, дата) с id меньше before_id или
+        больше after_id, новые сверху."""
+        return db_functions.sql_page_incomes(user_id, before_id, after_id,
+                                             limit)
+
+    def get_income(self, income_id: int, user_id: int) -> Optional[tuple]:
+        """Доход пользователя по id или None."""
+        return db_functions.sql_select_all_incomes_user(income_id, user_id)
+
+    def update_income(self, amount: float, description: str,
+                      income_id: int, user_id: int) -> None:
+        """Изменение дохода."""
+        db_functions.sql_update_income(amount, description, income_id,
+                                       user_id)
+
+    def delete_income(self, income_id: int, user_id: int) -> None:
+        """Удаление дохода."""
+        db_functions.sql_delete_income(income_id, user_id)
+
+    def add_expense(self, amount: float, description: str, category_id: int,
+                    user_id: int) -> None:
+        """Добавление расхода."""
+        db_functions.sql_insert_expense(amount, description, category_id,
+                                        user_id)
+
+    def expenses_page(self, user_id: int, before_id: Optional[int] = None,
+                      after_id: Optional[int] = None,
+                      limit: int = RECORDS_PAGE_SIZE) -> List[tuple]:
+        """Расходы (id, сумма, категория, описание, дата) с id меньше
+        before_id или больше after_id, новые сверху."""
+        return db_functions.sql_page_expense(user_id, before_id, after_id,
+                                             limit)
+
+    def get_expense(self, expense_id: int,
+                    user_id: int) -> Optional[tuple]:
+        """Расход пользователя по id или None."""
+        return db_functions.sql_select_all_expenses_user(expense_id, user_id)
+
+    def update_expense(self, amount: float, description: str,
+                       category_id: int, expense_id: int,
+                       user_id: int) -> None:
+        """Изменение расхода."""
+        db_functions.sql_update_expense(amount, description, category_id,
+                                        expense_id, user_id)
+
+    def delete_expense(self, expense_id: int, user_id: int) -> None:
+        """Удаление расхода."""
+        db_functions.sql_delete_expense(expense_id, user_id)
+
+    def import_records(self, expenses: List[tuple], incomes: List[tuple],
+                       user_id: int) -> Tuple[int, int]:
+        """Добавление импортированных записей, см. sql_import_records."""
+        return db_functions.sql_import_records(expenses, incomes, user_id)
+
+    def top_expenses(self, period: str, user_id: int) -> List[tuple]:
+        """Топ расходов периода: (дата, сумма, описание, категория)."""
+        return read_rows(db_functions.sql_for_table, period, user_id)
+
+    def expenses_total(self, period: str, user_id: int) -> float:
+        """Сумма расходов за период."""
+        return read_total(db_functions.sql_for_graph_total, period, user_id)
+
+    def expense_points(self, period: str, user_id: int) -> np.ndarray:
+        """Точки графика расходов: суммы по часам, дням или неделям."""
+        return read_points(db_functions.sql_for_graph, period, user_id)
+
+    def category_totals(self, period: str, user_id: int) -> List[tuple]:
+        """Суммы расходов за период: (сумма, id категории, категория)."""
+        return read_rows(db_functions.sql_for_chart, period, user_id)
+
+    def month_incomes(self, user_id: int) -> List[tuple]:
+        """Доходы с начала месяца по дате: (дата, сумма, описание)."""
+        return read_rows(db_functions.sql_for_graph_incomes, user_id)
+
+    def month_incomes_total(self, user_id: int) -> float:
+        """Сумма доходов с начала месяца."""
+        return read_total(db_functions.sql_for_incomes_total, user_id)
+
+    def export_records(self, user_id: int,
+                       chunk_size: int) -> Iterator[List[tuple]]:
+        """Все расходы, затем все доходы пользователя частями.
+
+        Строки (дата, тип, сумма, категория, описание) читаются курсором
+        по chunk_size, в памяти никогда не бывает больше одной части.
+        """
+        for query in (db_functions.sql_for_export_expenses,
+                      db_functions.sql_for_export_incomes):
+            sql, params = query(user_id)
+            cursor = db_functions.connections.reader().execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def now_utc() -> datetime:
+    """Текущее время UTC, как datetime('now') в SQLite."""
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def period_start(period: str) -> str:
+    """Начало периода, как datetime('now', period) в SQLite.
+
+    Поддерживаются модификаторы 'start of day|month|year' и '±N day|month
+    |year'. При сдвиге на месяцы день ограничивается длиной месяца.
+    """
+    now = now_utc()
+    if period.startswith('start of '):
+        unit = period[len('start of '):]
+        if unit not in ('day', 'month', 'year'):
+            raise ValueError(f'Неизвестный период: {period}')
+        now = now.replace(hour=0, minute=0, second=0)
+        if unit != 'day':
+            now = now.replace(day=1)
+        if unit == 'year':
+            now = now.replace(month=1)
+        return now.strftime(DATE_FORMAT)
+    count, unit = period.split()
+    unit = unit.rstrip('s')
+    if unit == 'day':
+        return (now + timedelta(days=int(count))).strftime(DATE_FORMAT)
+    if unit not in ('month', 'year'):
+        raise ValueError(f'Неизвестный период: {period}')
+    months = int(count) * (12 if unit == 'year' else 1)
+    year, month = divmod(now.year * 12 + now.month - 1 + months, 12)
+    day = min(now.day, calendar.monthrange(year, month + 1)[1])
+    return now.replace(year=year, month=month + 1,
+                       day=day).strftime(DATE_FORMAT)
+
+
+def page_of(records: Dict[int, tuple], before_id: Optional[int],
+            after_id: Optional[int], limit: int,
+            keep: Callable[[tuple], bool] = bool) -> List[tuple]:
+    """Страница записей records (id -> запись, по возрастанию id).
+
+    До limit записей, для которых keep истинно, с id меньше before_id
+    или больше after_id, новые сверху, как в db_functions.page_rows.
+    """
+    if after_id is not None:
+        rows = list(itertools.islice(
+            (row for row in records.values()
+             if row[0] > after_id and keep(row)), limit))
+        rows.reverse()
+        return rows
+    return list(itertools.islice(
+        (row for row in reversed(records.values())
+         if (before_id is None or row[0] < before_id) and keep(row)), limit))
+
+
+def graph_bucket(day: str, bucket: str) -> str:
+    """Интервал графика для даты записи, как в SQL_FOR_GRAPH."""
+    if bucket == 'hour':
+        return day[:13] + ':00:00'
+    if bucket == 'week':
+        start = date.fromisoformat(day[:10])
+        return (start - timedelta(days=start.weekday())).isoformat()
+    return day[:10]
+
+
+class MemoryStorage:
+    """Данные в памяти процесса, без обращений к диску.
+
+    Поведение и строки результатов те же, что у SQLiteStorage; нужно
+    для тестов обработчиков и бенчмарков. Данные теряются при выходе.
+    """
+
+    def __init__(self) -> None:
+        self.clients: Set[str] = set()
+        self.category_names: Dict[int, str] = {}
+        self.category_ids: Dict[str, int] = {}
+        # id -> (id, сумма, описание, дата, id клиента)
+        self.incomes: Dict[int, Dict[int, tuple]] = defaultdict(dict)
+        # id -> (id, сумма, описание, дата, id категории, id клиента)
+        self.expenses: Dict[int, Dict[int, tuple]] = defaultdict(dict)
+        self.import_keys: Set[Tuple[str, int, str]] = set()
+        self.ids = defaultdict(lambda: itertools.count(1))
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def now() -> str:
+        """Дата новой записи, как date_added по умолчанию."""
+        return (now_utc() + UTC_OFFSET).strftime(DATE_FORMAT)
+
+    def add_user(self, telegram_id: int) -> None:
+        """Добавление пользователя, если его еще нет."""
+        with self.lock:
+            self.clients.add(str(telegram_id))
+
+    def categories(self) -> List[Tuple[int, str]]:
+        """Список (id, имя) всех категорий."""
+        with self.lock:
+            return sorted(self.category_names.items())
+
+    def category_id(self, name: str) -> Optional[int]:
+        """Id категории по имени или None."""
+        return self.category_ids.get(name)
+
+    def add_category(self, name: str) -> int:
+        """Добавление категории, возвращает ее id."""
+        with self.lock:
+            if name not in self.category_ids:
+                category_id = next(self.ids['categories'])
+                self.category_ids[name] = category_id
+                self.category_names[category_id] = name
+            return self.category_ids[name]
+
+    def add_income(self, amount: float, description: str, user_id: int,
+                   date_added: Optional[str] = None) -> None:
+        """Добавление дохода."""
+        with self.lock:
+            income_id = next(self.ids['incomes'])
+            self.incomes[user_id][income_id] = (
+                income_id, amount, description, date_added or self.now(),
+                user_id)
+        data_versions.bump(user_id)
+
+    def incomes_page(self, user_id: int, before_id: Optional[int] = None,
+                     after_id: Optional[int] = None,
+                     limit: int = RECORDS_PAGE_SIZE) -> List[tuple]:
+        """Доходы (id, сумма, описание, дата) с id меньше before_id или
+        больше after_id, новые сверху."""
+        with self.lock:
+            rows = page_of(self.incomes.get(user_id, {}), before_id,
+                           after_id, limit)
+        return [row[:4] for row in rows]
+
+    def get_income(self, income_id: int, user_id: int) -> Optional[tuple]:
+        """Доход пользователя по id или None."""
+        return self.incomes.get(user_id, {}).get(income_id)
+
+    def update_income(self, amount: float, description: str,
+                      income_id: int, user_id: int) -> None:
+        """Изменение дохода."""
+        with self.lock:
+            row = self.incomes.get(user_id, {}).get(income_id)
+            if row is not None:
+                self.incomes[user_id][income_id] = (
+                    income_id, amount, description) + row[3:]
+        data_versions.bump(user_id)
+
+    def delete_income(self, income_id: int, user_id: int) -> None:
+        """Удаление дохода."""
+        with self.lock:
+            self.incomes.get(user_id, {}).pop(income_id, None)
+        data_versions.bump(user_id)
+
+    def add_expense(self, amount: float, description: str, category_id: int,
+                    user_id: int, date_added: Optional[str] = None) -> None:
+        """Добавление расхода."""
+        with self.lock:
+            expense_id = next(self.ids['expenses'])
+            self.expenses[user_id][expense_id] = (
+                expense_id, amount, description, date_added or self.now(),
+                category_id, user_id)
+        data_versions.bump(user_id)
+
+    def expenses_page(self, user_id: int, before_id: Optional[int] = None,
+                      after_id: Optional[int] = None,
+                      limit: int = RECORDS_PAGE_SIZE) -> List[tuple]:
+        """Расходы (id, сумма, категория, описание, дата) с id меньше
+        before_id или больше after_id, новые сверху."""
+        with self.lock:
+            rows = page_of(self.expenses.get(user_id, {}), before_id,
+                           after_id, limit,
+                           lambda row: row[4] in self.category_names)
+            return [(row[0], row[1], self.category_names[row[4]], row[2],
+                     row[3]) for row in rows]
+
+    def get_expense(self, expense_id: int,
+                    user_id: int) -> Optional[tuple]:
+        """Расход пользователя по id или None."""
+        return self.expenses.get(user_id, {}).get(expense_id)
+
+    def update_expense(self, amount: float, description: str,
+                       category_id: int, expense_id: int,
+                       user_id: int) -> None:
+        """Изменение расхода."""
+        with self.lock:
+            row = self.expenses.get(user_id, {}).get(expense_id)
+            if row is not None:
+                self.expenses[user_id][expense_id] = (
+                    expense_id, amount, description, row[3], category_id,
+                    user_id)
+        data_versions.bump(user_id)
+
+    def delete_expense(self, expense_id: int, user_id: int) -> None:
+        """Удаление расхода."""
+        with self.lock:
+            self.expenses.get(user_id, {}).pop(expense_id, None)
+        data_versions.bump(user_id)
+
+    def import_records(self, expenses: List[tuple], incomes: List[tuple],
+                       user_id: int) -> Tuple[int, int]:
+        """Добавление импортированных записей, см. sql_import_records."""
+        added = {'expenses': 0, 'incomes': 0}
+        with self.lock:
+            for kind, rows in (('expenses', expenses), ('incomes', incomes)):
+                for row in rows:
+                    key = (kind, user_id, row[-1])
+                    if key in self.import_keys:
+                        continue
+                    self.import_keys.add(key)
+                    if kind == 'expenses':
+                        self.add_expense(row[0], row[1], row[3], user_id,
+                                         date_added=row[2])
+                    else:
+                        self.add_income(row[0], row[1], user_id,
+                                        date_added=row[2])
+                    added[kind] += 1
+        data_versions.bump(user_id)
+        return added['expenses'], added['incomes']
+
+    def period_expenses(self, period: str, user_id: int) -> List[tuple]:
+        """Расходы за период."""
+        start = period_start(period)
+        with self.lock:
+            return [row for row in self.expenses.get(user_id, {}).values()
+                    if row[3] >= start]
+
+    def top_expenses(self, period: str, user_id: int) -> List[tuple]:
+        """Топ расходов периода: (дата, сумма, описание, категория)."""
+        rows = [row for row in self.period_expenses(period, user_id)
+                if row[4] in self.category_names]
+        return [(row[3], row[1], row[2], self.category_names[row[4]])
+                for row in heapq.nlargest(TOP_EXPENSES, rows,
+                                          key=lambda row: row[1])]
+
+    def expenses_total(self, period: str, user_id: int) -> float:
+        """Сумма расходов за период."""
+        return sum(row[1] for row in self.period_expenses(period, user_id))
+
+    def expense_points(self, period: str, user_id: int) -> np.ndarray:
+        """Точки графика расходов: суммы по часам, дням или неделям."""
+        bucket = PERIOD_BUCKETS.get(period, 'day')
+        totals: Dict[str, float] = defaultdict(float)
+        for row in self.period_expenses(period, user_id):
+            totals[graph_bucket(row[3], bucket)] += row[1]
+        return to_points(sorted(totals.items()))
+
+    def category_totals(self, period: str, user_id: int) -> List[tuple]:
+        """Суммы расходов за период: (сумма, id категории, категория)."""
+        totals: Dict[int, float] = defaultdict(float)
+        for row in self.period_expenses(period, user_id):
+            totals[row[4] or 0] += row[1]
+        return [(total, category_id,
+                 self.category_names.get(category_id, UNKNOWN_CATEGORY))
+                for category_id, total in sorted(totals.items())]
+
+    def month_incomes(self, user_id: int) -> List[tuple]:
+        """Доходы с начала месяца по дате: (дата, сумма, описание)."""
+        start = period_start('start of month')
+        with self.lock:
+            rows = [row for row in self.incomes.get(user_id, {}).values()
+                    if row[3] >= start]
+        return sorted((row[3], row[1], row[2]) for row in rows)
+
+    def month_incomes_total(self, user_id: int) -> float:
+        """Сумма доходов с начала месяца."""
+        return sum(row[1] for row in self.month_incomes(user_id))
+
+    def export_records(self, user_id: int,
+                       chunk_size: int) -> Iterator[List[tuple]]:
+        """Все расходы, затем все доходы пользователя частями."""
+        with self.lock:
+            expenses = sorted(
+                (row[3], 'Расход', row[1], self.category_names.get(row[4]),
+                 row[2]) for row in self.expenses.get(user_id, {}).values())
+            incomes = sorted((row[3], 'Доход', row[1], None, row[2])
+                             for row in self.incomes.get(user_id, {}).values())
+        for rows in (expenses, incomes):
+            for start in range(0, len(rows), chunk_size):
+                yield rows[start:start + chunk_size]
+
+
+class AsyncStorage:
+    """Асинхронный доступ к хранилищу.
+
+    Каждый метод хранилища доступен как сопрограмма: вызов выполняется
+    в пуле из workers потоков, и цикл событий не ждет БД. У каждого
+    потока пула свое соединение SQLite для чтения, запись, как и в
+    синхронном хранилище, идет через общее соединение под блокировкой.
+    Синхронный код, работающий с хранилищем, например обработчики бота,
+    выполняется в том же пуле через run.
+    """
+
+    def __init__(self, storage, workers: int = STORAGE_ASYNC_WORKERS) -> None:
+        self.storage = storage
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='storage')
+
+    def __getattr__(self, name: str):
+        method = getattr(self.storage, name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return call
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Вызов func в пуле хранилища."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def export_records(self, user_id: int,
+                             chunk_size: int) -> AsyncIterator[List[tuple]]:
+        """Все расходы, затем все доходы пользователя частями.
+
+        Генератор читает курсором соединения своего потока, поэтому все
+        его шаги выполняются в одном отдельном потоке, а не в разных
+        потоках пула.
+        """
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix='storage-export')
+        chunks = self.storage.export_records(user_id, chunk_size)
+        try:
+            while True:
+                rows = await loop.run_in_executor(executor, next, chunks,
+                                                  None)
+                if rows is None:
+                    break
+                yield rows
+        finally:
+            await loop.run_in_executor(executor, chunks.close)
+            executor.shutdown(wait=False)
+
+    def close(self) -> None:
+        """Остановка пула потоков."""
+        self.executor.shutdown()
+
+
+def create_storage():
+    """Хранилище данных по настройке STORAGE_BACKEND."""
+    if STORAGE_BACKEND == 'memory':
+        return MemoryStorage()
+    return SQLiteStorage()
+
+
+storage = create_storage()
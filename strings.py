@@ -1,11 +1,21 @@
 RETURN_MENU = 'Меню'
-EDIT_RECORDS_ID = 'Введите ID записи, которую хотите редактировать:'
-DELETE_RECORDS_ID = 'Введите ID записи, которую хотите удалить:'
+EDIT_RECORDS_ID = ('Выберите запись, которую хотите редактировать, '
+                   'или введите ее ID:')
+DELETE_RECORDS_ID = ('Выберите запись, которую хотите удалить, '
+                     'или введите ее ID:')
+RECORDS_STALE = 'Список устарел, откройте его заново'
 
 ERROR_NUMBER = 'Необходимо вести положительное число'
 ERROR_NUMBER_ID = 'Пожалуйста, введите действительный ID (целое число)'
 ERROR_RECORDS_ID = 'Запись с таким ID не найдена'
 ERROR_RECORD_EMPTY = 'Записей доходов/расходов нет'
+ERROR_RENDER_BUSY = ('Не удалось построить график, попробуйте запросить '
+                     'статистику позже')
+IMPORT_STARTED = 'Загружаю выписку, это может занять несколько секунд...'
+IMPORT_UNSUPPORTED = 'Для импорта отправьте выписку в формате CSV или XLSX'
+EXPORT_FORMAT = 'Выберите формат файла со всеми доходами и расходами:'
+EXPORT_STARTED = 'Готовлю файл, это может занять несколько секунд...'
+EXPORT_TOO_LARGE = 'Файл больше 50 МБ и не может быть отправлен в Telegram'
 
 HELP_MSG = '👋 Привет! Это Финансовый менеджер - ' \
            'ваш личный помощник для учета расходов.\n\n'\
@@ -15,7 +25,13 @@ HELP_MSG = '👋 Привет! Это Финансовый менеджер - '
            'чтобы лучше контролировать свои финансы.\n\n'\
            '📝 Команды:\n'\
            '- /start - начать диалог с ботом.\n'\
-           '- /help - получить помощь по использованию бота.\n\n'\
+           '- /help - получить помощь по использованию бота.\n'\
+           '- /export - выгрузить все доходы и расходы в CSV или XLSX.\n\n'\
+           '📥 Чтобы загрузить выписку, отправьте файл CSV или XLSX '\
+           'с колонками "Дата", "Сумма", "Описание", "Категория" '\
+           'и, по желанию, "Тип" (доход/расход). Без колонки "Тип" '\
+           'отрицательные суммы считаются расходами, положительные - '\
+           'доходами. Повторно загруженные строки пропускаются.\n\n'\
            '❗ Если у вас возникли проблемы или есть вопросы, ' \
            'не стесняйтесь писать @slavakyrlan. '\
            'Я всегда готов помочь вам!'
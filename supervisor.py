@@ -0,0 +1,302 @@
+"""Код для обработки обновлений в нескольких процессах."""
+
+import atexit
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Iterable, List, Optional, Sequence, Tuple
+
+from telebot import TeleBot, types
+
+from runtime import HANDLER_WORKERS, WORKER_PROCESSES, ChatQueues, get_chat_id
+from webhook import (UPDATE_MODE, WEBHOOK_BATCH_SIZE, WEBHOOK_ENQUEUE_TIMEOUT,
+                     WEBHOOK_QUEUE_SIZE, WebhookServer, run_webhook)
+
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', 1024))
+WORKER_ENQUEUE_TIMEOUT = float(os.getenv('WORKER_ENQUEUE_TIMEOUT', 1))
+WORKER_HEALTH_INTERVAL = float(os.getenv('WORKER_HEALTH_INTERVAL', 1))
+WORKER_HEALTH_TIMEOUT = float(os.getenv('WORKER_HEALTH_TIMEOUT', 60))
+WORKER_STOP_TIMEOUT = float(os.getenv('WORKER_STOP_TIMEOUT', 30))
+# Точек на кольце у каждого процесса: чем больше, тем ровнее нагрузка
+HASH_RING_REPLICAS = 100
+
+# Процесс-обработчик: (номер, WorkerChannel)
+WorkerTarget = Callable[..., None]
+
+
+def ring_hash(key: str) -> int:
+    """Положение ключа на кольце."""
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Консистентное хеширование ключей по nodes узлам.
+
+    У каждого узла replicas точек на кольце, ключ достается узлу
+    следующей за ним точки. Выбор узла не зависит от процесса и запуска,
+    а при изменении числа узлов переходит только около 1/nodes ключей.
+    """
+
+    def __init__(self, nodes: int,
+                 replicas: int = HASH_RING_REPLICAS) -> None:
+        points = sorted((ring_hash(f'{node}:{replica}'), node)
+                        for node in range(nodes)
+                        for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node(self, key: int) -> int:
+        """Номер узла для ключа."""
+        index = bisect.bisect(self.hashes, ring_hash(str(key)))
+        return self.nodes[index % len(self.nodes)]
+
+
+class WorkerChannel:
+    """Очередь обновлений процесса-обработчика и его отметки.
+
+    В очередь кладутся пары (номер, обновление). Процесс отмечает время
+    последней проверки очереди (heartbeat) и номер последнего забранного
+    обновления (taken).
+    """
+
+    def __init__(self, context, queue_size: int) -> None:
+        self.updates = context.Queue(queue_size)
+        self.heartbeat = context.Value('d', time.time(), lock=False)
+        self.taken = context.Value('q', 0, lock=False)
+
+
+class Worker:
+    """Процесс-обработчик и обновления, которые он мог еще не забрать."""
+
+    def __init__(self, context, target: WorkerTarget, index: int,
+                 channel: WorkerChannel,
+                 sent: Iterable[Tuple[int, types.Update]] = ()) -> None:
+        self.channel = channel
+        self.sent: Deque[Tuple[int, types.Update]] = deque(sent)
+        # Не демон: процесс запускает собственный пул построения графиков
+        self.process = context.Process(target=target, args=(index, channel),
+                                       name=f'worker-{index}')
+        self.process.start()
+
+    def pending(self) -> List[Tuple[int, types.Update]]:
+        """Отправленные процессу обновления, которые он еще не забрал."""
+        taken = self.channel.taken.value
+        while self.sent and self.sent[0][0] <= taken:
+            self.sent.popleft()
+        return list(self.sent)
+
+
+class Supervisor(TeleBot):
+    """Прием обновлений и распределение их по процессам-обработчикам.
+
+    Процесс для обновления выбирается консистентным хешированием id
+    чата: все обновления чата обрабатываются одним процессом по порядку,
+    а состояние диалога и кэши чата остаются в его памяти. Раз в
+    health_interval секунд процессы проверяются: завершившийся или не
+    отмечавшийся дольше health_timeout секунд процесс перезапускается,
+    и новый процесс получает обновления, которые старый не успел забрать.
+    """
+
+    def __init__(self, token: str, target: WorkerTarget,
+                 workers: int = WORKER_PROCESSES,
+                 queue_size: int = WORKER_QUEUE_SIZE,
+                 health_interval: float = WORKER_HEALTH_INTERVAL,
+                 health_timeout: float = WORKER_HEALTH_TIMEOUT) -> None:
+        super().__init__(token=token, threaded=False)
+        self.target = target
+        self.size = workers
+        self.queue_size = queue_size
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        # spawn: процессы не наследуют потоки и соединения с БД
+        self.context = multiprocessing.get_context('spawn')
+        self.ring = HashRing(workers)
+        self.workers: List[Worker] = []
+        self.counter = itertools.count(1)
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.monitor: Optional[threading.Thread] = None
+
+    def spawn(self, index: int,
+              sent: Sequence[Tuple[int, types.Update]] = ()) -> Worker:
+        """Запуск процесса index с новой очередью из обновлений sent."""
+        channel = WorkerChannel(self.context, self.queue_size)
+        for item in sent:
+            channel.updates.put_nowait(item)
+        return Worker(self.context, self.target, index, channel, sent)
+
+    def start(self) -> None:
+        """Запуск процессов-обработчиков и проверки их работы."""
+        with self.lock:
+            self.workers = [self.spawn(index) for index in range(self.size)]
+        self.monitor = threading.Thread(target=self.watch,
+                                        name='supervisor', daemon=True)
+        self.monitor.start()
+        # Иначе multiprocessing при выходе будет бесконечно ждать процессы
+        atexit.register(self.stop)
+
+    def dispatch(self, update: types.Update,
+                 timeout: float = WORKER_ENQUEUE_TIMEOUT) -> bool:
+        """Передача обновления процессу чата.
+
+        False - очередь процесса заполнена или процессы остановлены.
+        """
+        chat_id = get_chat_id(update)
+        key = update.update_id if chat_id is None else chat_id
+        with self.lock:
+            if not self.workers:
+                return False
+            worker = self.workers[self.ring.node(key)]
+            item = (next(self.counter), update)
+            try:
+                worker.channel.updates.put(item, timeout=timeout)
+            except queue.Full:
+                logging.warning(f'Очередь {worker.process.name} заполнена, '
+                                f'обновление {update.update_id} не принято')
+                return False
+            worker.pending()
+            worker.sent.append(item)
+        return True
+
+    def process_new_updates(self, updates: List[types.Update]) -> None:
+        """Распределение обновлений по процессам.
+
+        Пока очередь процесса заполнена, передача повторяется, и новые
+        обновления не запрашиваются. Смещение getUpdates сдвигается
+        только за переданными обновлениями: при остановке остальные
+        Telegram отдаст заново.
+        """
+        for update in updates:
+            while not self.dispatch(update):
+                if self.stopped.is_set():
+                    return
+            # Смещение getUpdates сдвигает process_new_updates TeleBot,
+            # который здесь не вызывается
+            self.last_update_id = max(self.last_update_id, update.update_id)
+
+    def watch(self) -> None:
+        """Проверка процессов до остановки."""
+        while not self.stopped.wait(self.health_interval):
+            self.check()
+
+    def check(self) -> None:
+        """Перезапуск завершившихся и зависших процессов."""
+        for index, worker in enumerate(list(self.workers)):
+            process = worker.process
+            idle = time.time() - worker.channel.heartbeat.value
+            if not process.is_alive():
+                logging.error(f'{process.name} завершился с кодом '
+                              f'{process.exitcode}, перезапуск')
+            elif idle > self.health_timeout:
+                logging.error(f'{process.name} не отвечает {idle:.0f} с, '
+                              f'перезапуск')
+                process.kill()
+            else:
+                continue
+            process.join()
+            self.restart(index)
+
+    def restart(self, index: int) -> None:
+        """Замена процесса index новым.
+
+        Старая очередь не читается: процесс мог завершиться, держа ее
+        блокировку. Обновления, которые он не забрал, отправляются новому
+        процессу заново, а забранные, но не обработанные теряются.
+        """
+        with self.lock:
+            old = self.workers[index]
+            old.channel.updates.close()
+            self.workers[index] = self.spawn(index, old.pending())
+            self.restarts += 1
+
+    def stop(self, timeout: float = WORKER_STOP_TIMEOUT) -> None:
+        """Остановка процессов после обработки принятых обновлений."""
+        self.stopped.set()
+        if self.monitor is not None:
+            self.monitor.join()
+            self.monitor = None
+        with self.lock:
+            for worker in self.workers:
+                try:
+                    worker.channel.updates.put(None, timeout=timeout)
+                except queue.Full:
+                    worker.process.terminate()
+            for worker in self.workers:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+            self.workers = []
+
+
+class SupervisorWebhook(WebhookServer):
+    """Webhook, передающий обновления сразу процессам-обработчикам.
+
+    Telegram получает 200, только когда обновление попало в очередь
+    процесса, иначе 503, и доставка повторяется. Собственный пул
+    обработчиков WebhookServer не нужен.
+    """
+
+    def __init__(self, supervisor: Supervisor) -> None:
+        super().__init__(supervisor, workers=0)
+        self.supervisor = supervisor
+
+    def dispatch(self, update: types.Update) -> bool:
+        """Передача обновления процессу (False - очередь заполнена)."""
+        return self.supervisor.dispatch(update,
+                                        timeout=WEBHOOK_ENQUEUE_TIMEOUT)
+
+
+def serve_worker(bot: TeleBot, channel: WorkerChannel) -> None:
+    """Обработка обновлений из очереди в процессе-обработчике.
+
+    Обновления раздаются пулу ChatQueues. Пока очередь чата заполнена,
+    отметка о работе не обновляется, и зависший процесс будет перезапущен.
+    """
+    # Процессы останавливает Supervisor, Ctrl+C их не прерывает
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handlers = ChatQueues(bot, HANDLER_WORKERS, WEBHOOK_QUEUE_SIZE,
+                          WEBHOOK_BATCH_SIZE)
+    handlers.start()
+    parent = multiprocessing.parent_process()
+    while True:
+        channel.heartbeat.value = time.time()
+        try:
+            item = channel.updates.get(timeout=WORKER_HEALTH_INTERVAL)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        if item is None:
+            break
+        channel.taken.value, update = item
+        handlers.put(update)
+    handlers.stop()
+
+
+def run_supervisor(token: str, target: WorkerTarget) -> None:
+    """Запуск бота в WORKER_PROCESSES процессах.
+
+    target вызывается в каждом процессе-обработчике и должен передать
+    управление serve_worker.
+    """
+    supervisor = Supervisor(token, target)
+    supervisor.start()
+    logging.info(f'Запущено процессов-обработчиков: {WORKER_PROCESSES}')
+    try:
+        if UPDATE_MODE == 'webhook':
+            run_webhook(supervisor, SupervisorWebhook(supervisor))
+        else:
+            supervisor.polling(none_stop=True)
+    finally:
+        supervisor.stop()
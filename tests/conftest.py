@@ -0,0 +1,14 @@
+"""Общие настройки тестов: временная БД, данные и шаги диалогов в памяти."""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(),
+                                              'test_finance_bot.db'))
+os.environ.setdefault('STATE_STORAGE', 'memory')
+os.environ.setdefault('TOKEN', '0:test')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.mkdtemp(),
+                                               'test_finance_bot.log'))
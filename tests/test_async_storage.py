@@ -0,0 +1,75 @@
+"""Асинхронный доступ к хранилищу."""
+
+import asyncio
+import threading
+
+from database import create_tables
+from storage import AsyncStorage, SQLiteStorage
+
+USER_ID = 7000
+
+
+class ThreadRecorder:
+    """Хранилище, запоминающее потоки шагов выгрузки."""
+
+    def __init__(self, storage) -> None:
+        self.storage = storage
+        self.threads = set()
+
+    def export_records(self, user_id: int, chunk_size: int):
+        """Выгрузка хранилища с записью потока каждого шага."""
+        for rows in self.storage.export_records(user_id, chunk_size):
+            self.threads.add(threading.get_ident())
+            yield rows
+
+
+def sqlite_storage() -> SQLiteStorage:
+    """SQLite с расходами и доходами пользователя."""
+    create_tables()
+    storage = SQLiteStorage()
+    category_id = (storage.category_id('Еда')
+                   or storage.add_category('Еда'))
+    storage.import_records(
+        [(amount, 'Покупка', '2024-03-01 12:00:00', category_id,
+          f'async-{amount}') for amount in range(1, 31)],
+        [(1000, 'Зарплата', '2024-03-01 09:00:00', 'async-income')],
+        USER_ID)
+    return storage
+
+
+def test_methods_are_coroutines():
+    storage = sqlite_storage()
+    async_storage = AsyncStorage(storage, workers=2)
+
+    async def read():
+        return await asyncio.gather(
+            async_storage.expenses_page(USER_ID),
+            async_storage.get_expense(-1, USER_ID))
+
+    try:
+        page, missing = asyncio.run(read())
+    finally:
+        async_storage.close()
+    assert page == storage.expenses_page(USER_ID)
+    assert missing is None
+
+
+def test_export_runs_in_one_thread():
+    storage = ThreadRecorder(sqlite_storage())
+    async_storage = AsyncStorage(storage, workers=4)
+
+    async def export():
+        chunks = []
+        async for rows in async_storage.export_records(USER_ID, 4):
+            chunks.append(rows)
+            # Пул занят другими запросами, пока идет выгрузка
+            await asyncio.gather(*(async_storage.run(sum, [1])
+                                   for _ in range(8)))
+        return chunks
+
+    try:
+        chunks = asyncio.run(export())
+    finally:
+        async_storage.close()
+    assert sum(len(rows) for rows in chunks) == 31
+    assert len(storage.threads) == 1
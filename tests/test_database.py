@@ -0,0 +1,30 @@
+"""Миграции схемы БД."""
+
+import sqlite3
+
+import pytest
+
+import database
+from database import MIGRATIONS, db_connect, get_schema_version, migrate
+
+
+def columns(con, table: str) -> list:
+    """Имена колонок таблицы."""
+    return [row[1] for row in con.execute(f'PRAGMA table_info({table})')]
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    con = db_connect(str(tmp_path / 'migrate.db'))
+    migrate(con, target=4)
+    monkeypatch.setattr(database, 'MIGRATIONS', MIGRATIONS[:-1] + [
+        (5, ['ALTER TABLE expenses ADD COLUMN import_key TEXT',
+             'SELECT * FROM no_such_table'])])
+    with pytest.raises(sqlite3.OperationalError):
+        database.migrate(con)
+    assert get_schema_version(con) == 4
+    assert 'import_key' not in columns(con, 'expenses')
+
+    monkeypatch.undo()
+    assert migrate(con) == MIGRATIONS[-1][0]
+    assert 'import_key' in columns(con, 'expenses')
+    con.close()
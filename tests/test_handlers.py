@@ -0,0 +1,245 @@
+"""Диалоги бота на хранилище в памяти без обращений к Telegram."""
+
+import itertools
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+from telebot import types
+
+import bot as bot_module
+from runtime import ChatPolling
+from storage import MemoryStorage
+from strings import ERROR_RECORD_EMPTY, ERROR_RECORDS_ID, RECORDS_STALE
+
+CHAT_IDS = itertools.count(1000)
+UPDATE_IDS = itertools.count(1)
+
+
+class FakeOutbox:
+    """Очередь отправки, запоминающая ответы и изменения сообщений."""
+
+    def __init__(self) -> None:
+        self.texts = []
+        # id сообщения -> (текст, кнопки)
+        self.messages = {}
+        self.message_ids = itertools.count(1)
+
+    def send_message(self, chat_id: int, text: str,
+                     reply_markup=None, **kwargs) -> Future:
+        """Запоминание сообщения вместо отправки."""
+        message_id = next(self.message_ids)
+        self.texts.append(text)
+        self.messages[message_id] = (text, reply_markup)
+        sent = Future()
+        sent.set_result(SimpleNamespace(message_id=message_id, text=text))
+        return sent
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str,
+                          reply_markup=None, **kwargs) -> Future:
+        """Изменение запомненного сообщения."""
+        self.messages[message_id] = (text, reply_markup)
+        sent = Future()
+        sent.set_result(None)
+        return sent
+
+    def buttons(self, message_id: int) -> list:
+        """Данные кнопок под сообщением."""
+        markup = self.messages[message_id][1]
+        if not isinstance(markup, types.InlineKeyboardMarkup):
+            return []
+        return [button.callback_data for row in markup.keyboard
+                for button in row]
+
+    def records_page(self) -> int:
+        """Id последнего сообщения с кнопками записей."""
+        return max(message_id for message_id in self.messages
+                   if self.buttons(message_id))
+
+
+class Chat:
+    """Чат пользователя: сообщения боту и его ответы."""
+
+    def __init__(self, outbox: FakeOutbox) -> None:
+        self.id = next(CHAT_IDS)
+        self.outbox = outbox
+        self.answers = []
+
+    def update(self, text: str) -> types.Update:
+        """Обновление с сообщением пользователя."""
+        update_id = next(UPDATE_IDS)
+        return types.Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': 0, 'text': text,
+                'chat': {'id': self.id, 'type': 'private'},
+                'from': {'id': self.id, 'is_bot': False,
+                         'first_name': 'Тест'}}})
+
+    def send(self, *texts: str) -> list:
+        """Отправка сообщений по очереди, ответы бота на последнее."""
+        for text in texts:
+            del self.outbox.texts[:]
+            bot_module.bot.process_new_updates([self.update(text)])
+        return list(self.outbox.texts)
+
+    def press(self, message_id: int, data: str) -> list:
+        """Нажатие кнопки под сообщением бота, ответы бота."""
+        del self.outbox.texts[:]
+        update_id = next(UPDATE_IDS)
+        user = {'id': self.id, 'is_bot': False, 'first_name': 'Тест'}
+        bot_module.bot.process_new_updates([types.Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': '1',
+                'data': data,
+                'message': {
+                    'message_id': message_id, 'date': 0,
+                    'text': self.outbox.messages[message_id][0],
+                    'chat': {'id': self.id, 'type': 'private'}}}})])
+        return list(self.outbox.texts)
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Новый чат с ответами бота в памяти."""
+    outbox = FakeOutbox()
+    monkeypatch.setattr(bot_module, 'outbox', outbox)
+    chat = Chat(outbox)
+    monkeypatch.setattr(
+        bot_module.bot, 'answer_callback_query',
+        lambda call_id, text=None, **kwargs: chat.answers.append(text))
+    return chat
+
+
+@pytest.fixture
+def category():
+    """Категория расходов с уникальным именем."""
+    name = f'Категория {next(CHAT_IDS)}'
+    bot_module.storage.add_category(name)
+    return name
+
+
+def test_storage_is_in_memory():
+    assert isinstance(bot_module.storage, MemoryStorage)
+
+
+def test_start_registers_user(chat):
+    replies = chat.send('/start')
+    assert replies[0].startswith('Привет, Тест!')
+    assert str(chat.id) in bot_module.storage.clients
+
+
+def test_add_income(chat):
+    chat.send('/start', 'Доход', 'Добавить', '1500')
+    replies = chat.send('Зарплата')
+    assert replies[0] == 'Доход успешно добавлен!'
+    assert bot_module.storage.month_incomes(chat.id)[0][1:] == (
+        1500.0, 'Зарплата')
+
+
+def test_wrong_amount_returns_to_menu(chat):
+    replies = chat.send('/start', 'Доход', 'Добавить', 'много')
+    assert replies[0] == 'Ошибка, вы отправили некорректную сумму.'
+    assert bot_module.state_store.get(chat.id) is None
+    assert bot_module.storage.month_incomes_total(chat.id) == 0
+
+
+def test_add_category_twice(chat):
+    name = f'Новая {chat.id}'
+    chat.send('/start', 'Расход', 'Добавить категорию')
+    assert chat.send(name)[0] == f'Категория "{name}" успешно добавлена!'
+    chat.send('Расход', 'Добавить категорию')
+    assert chat.send(name)[0].startswith(f'Категория "{name}" уже')
+
+
+def test_add_edit_delete_expense(chat, category):
+    chat.send('/start', 'Расход', 'Добавить', '250', 'Обед')
+    replies = chat.send(category)
+    assert replies[0] == (f'Расход в размере 250.0 с описанием "Обед" '
+                          f'успешно добавлен в категорию "{category}".')
+    (expense_id, *_), = bot_module.storage.expenses_page(chat.id)
+
+    chat.send('Расход', 'Редактировать', str(expense_id), '300', 'Ужин')
+    assert chat.send(category)[0] == 'Расход успешно обновлен!'
+    assert bot_module.storage.get_expense(expense_id, chat.id)[1:3] == (
+        300.0, 'Ужин')
+
+    chat.send('Расход', 'Удалить')
+    assert chat.send(str(expense_id))[0] == 'Расход успешно удален!'
+    assert bot_module.storage.get_expense(expense_id, chat.id) is None
+
+
+def test_other_users_record_is_not_found(chat, category):
+    chat.send('/start', 'Расход', 'Добавить', '100', 'Такси', category)
+    (expense_id, *_), = bot_module.storage.expenses_page(chat.id)
+    other = Chat(chat.outbox)
+    other.send('/start', 'Расход', 'Добавить', '50', 'Кофе', category,
+               'Расход', 'Удалить')
+    assert other.send(str(expense_id))[0] == ERROR_RECORDS_ID
+    assert bot_module.storage.get_expense(expense_id, chat.id) is not None
+
+
+def test_reads_do_not_create_users(chat):
+    storage = bot_module.storage
+    replies = chat.send('/start', 'Статистика доходов')
+    assert replies[0] == ERROR_RECORD_EMPTY
+    assert chat.send('Расход', 'Удалить')[0] == 'Нет записей для удаления.'
+    assert storage.get_income(1, chat.id) is None
+    assert chat.id not in storage.incomes
+    assert chat.id not in storage.expenses
+
+
+def add_expense(chat: Chat, category: str) -> int:
+    """Новый расход чата, его id."""
+    chat.send('/start', 'Расход', 'Добавить', '100', 'Такси', category)
+    return bot_module.storage.expenses_page(chat.id)[0][0]
+
+
+def test_pick_deletes_record_from_open_list(chat, category):
+    expense_id = add_expense(chat, category)
+    chat.send('Расход', 'Удалить')
+    page = chat.outbox.records_page()
+    pick = f'records:expense:delete:pick:{expense_id}'
+    assert pick in chat.outbox.buttons(page)
+    assert chat.press(page, pick)[0] == 'Расход успешно удален!'
+    assert chat.answers == [None]
+    assert chat.outbox.buttons(page) == []
+    assert bot_module.storage.get_expense(expense_id, chat.id) is None
+
+
+def test_leaving_list_removes_buttons_and_stale_pick(chat, category):
+    expense_id = add_expense(chat, category)
+    chat.send('Расход', 'Удалить')
+    page = chat.outbox.records_page()
+    chat.send('Меню')
+    assert chat.outbox.buttons(page) == []
+    chat.press(page, f'records:expense:delete:pick:{expense_id}')
+    assert chat.answers == [RECORDS_STALE]
+    assert bot_module.storage.get_expense(expense_id, chat.id) is not None
+
+
+def test_pick_keeps_other_dialog(chat, category):
+    expense_id = add_expense(chat, category)
+    chat.send('Расход', 'Удалить')
+    page = chat.outbox.records_page()
+    chat.send('Меню', 'Доход', 'Добавить')
+    chat.press(page, f'records:expense:delete:pick:{expense_id}')
+    assert chat.answers == [RECORDS_STALE]
+    assert bot_module.state_store.get(chat.id)[0] == (
+        bot_module.State.ADD_AMOUNT)
+    assert chat.send('700', 'Премия')[0] == 'Доход успешно добавлен!'
+    assert bot_module.storage.get_expense(expense_id, chat.id) is not None
+
+
+def test_polling_keeps_chat_order(chat):
+    polling = ChatPolling(bot_module.bot, workers=4, queue_size=16,
+                          batch_size=1)
+    polling.handlers.start()
+    updates = [chat.update(text) for text in
+               ('/start', 'Доход', 'Добавить', '1500', 'Зарплата')]
+    polling.process_new_updates(updates)
+    polling.handlers.stop()
+    assert 'Доход успешно добавлен!' in chat.outbox.texts
+    assert bot_module.storage.month_incomes_total(chat.id) == 1500.0
+    assert polling.last_update_id == updates[-1].update_id
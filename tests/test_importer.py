@@ -0,0 +1,56 @@
+"""Импорт выписок: повторы строк и повторная загрузка."""
+
+import io
+import itertools
+
+from importer import IMPORT_DEFAULT_CATEGORY, import_statement
+from storage import storage
+
+USER_IDS = itertools.count(5000)
+STATEMENT = ('Дата,Сумма,Описание\n'
+             '01.03.2024,-150,Кофе\n'
+             '01.03.2024,-300,Такси\n'
+             '01.03.2024,-150,Кофе\n')
+
+
+def upload(text: str, user_id: int):
+    """Импорт выписки CSV из строки."""
+    return import_statement(io.BytesIO(text.encode()), 'statement.csv',
+                            user_id)
+
+
+def test_identical_rows_apart_are_all_added():
+    user_id = next(USER_IDS)
+    stats = upload(STATEMENT, user_id)
+    assert (stats.expenses, stats.duplicates) == (3, 0)
+    amounts = sorted(row[1] for row in storage.expenses_page(user_id))
+    assert amounts == [150.0, 150.0, 300.0]
+
+
+def test_reupload_skips_every_row():
+    user_id = next(USER_IDS)
+    upload(STATEMENT, user_id)
+    stats = upload(STATEMENT, user_id)
+    assert (stats.expenses, stats.duplicates) == (0, 3)
+    assert len(storage.expenses_page(user_id)) == 3
+
+
+def test_extended_statement_adds_only_new_repeat():
+    user_id = next(USER_IDS)
+    upload(STATEMENT, user_id)
+    stats = upload(STATEMENT + '01.03.2024,-150,Кофе\n', user_id)
+    assert (stats.expenses, stats.duplicates) == (1, 3)
+
+
+def test_unknown_categories_are_not_added():
+    user_id = next(USER_IDS)
+    storage.add_category('Кафе')
+    allowed = {name for _, name in storage.categories()}
+    allowed.add(IMPORT_DEFAULT_CATEGORY)
+    upload('Дата,Сумма,Описание,Категория\n'
+           '01.03.2024,-150,Кофе,Кафе\n'
+           '01.03.2024,-900,Билеты,Развлечения банка\n', user_id)
+    assert storage.category_id('Развлечения банка') is None
+    assert {name for _, name in storage.categories()} <= allowed
+    categories = sorted(row[2] for row in storage.expenses_page(user_id))
+    assert categories == sorted(['Кафе', IMPORT_DEFAULT_CATEGORY])
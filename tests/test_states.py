@@ -0,0 +1,37 @@
+"""Состояния диалогов в памяти с копией в SQLite."""
+
+from database import create_tables
+from states import SQLiteStateStore, State
+
+
+def test_sqlite_store_survives_restart():
+    """Последнее состояние чата восстанавливается новым хранилищем."""
+    create_tables()
+    store = SQLiteStateStore(flush_interval=60)
+    store.start()
+    store.set(1, State.ADD_AMOUNT, {'kind': 'expense'})
+    store.pop(1)
+    store.set(1, State.EXPENSE_DESCRIPTION, {'amount': 250.0})
+    store.set(2, State.ACTION, {})
+    store.pop(2)
+    store.stop()
+
+    restarted = SQLiteStateStore(flush_interval=60)
+    restarted.start()
+    assert restarted.get(1) == (State.EXPENSE_DESCRIPTION, {'amount': 250.0})
+    assert restarted.get(2) is None
+    restarted.stop()
+
+
+def test_sqlite_store_writes_once_per_interval():
+    """Изменения между записями в БД не попадают в нее по одному."""
+    create_tables()
+    store = SQLiteStateStore(flush_interval=60)
+    store.start()
+    for step in range(10):
+        store.set(3, State.ADD_AMOUNT, {'step': step})
+        store.pop(3)
+    store.set(3, State.ADD_AMOUNT, {'step': 10})
+    assert store.changes == {3: store.changes[3]}
+    store.stop()
+    assert store.changes == {}
@@ -0,0 +1,51 @@
+"""Сумма графика и диаграммы совпадает с подписью за тот же период."""
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import create_tables
+from storage import (DATE_FORMAT, MemoryStorage, SQLiteStorage, now_utc,
+                     period_start)
+
+PERIODS = ['start of day', '-7 day', 'start of month', '-3 month',
+           'start of year']
+user_ids = itertools.count(1000)
+
+
+@pytest.fixture(scope='module', params=['sqlite', 'memory'])
+def storage(request):
+    """Хранилище с категорией для расходов."""
+    if request.param == 'sqlite':
+        create_tables()
+        return SQLiteStorage()
+    return MemoryStorage()
+
+
+def add_expenses(storage, user_id, period):
+    """Расходы вокруг границы периода: до нее, сразу после и позже."""
+    category_id = (storage.category_id('Еда')
+                   or storage.add_category('Еда'))
+    start = datetime.strptime(period_start(period), DATE_FORMAT)
+    dates = [start - timedelta(seconds=1), start - timedelta(days=2),
+             start + timedelta(minutes=1), start + timedelta(hours=30),
+             now_utc() - timedelta(minutes=5)]
+    storage.import_records(
+        [(amount, 'Покупка', day.strftime(DATE_FORMAT), category_id,
+          f'{period}-{amount}')
+         for amount, day in zip((100, 200, 10, 20, 40), dates)],
+        [], user_id)
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_chart_and_graph_match_total(storage, period):
+    """Точки графика и категории диаграммы дают сумму подписи."""
+    user_id = next(user_ids)
+    add_expenses(storage, user_id, period)
+    total = storage.expenses_total(period, user_id)
+    points = storage.expense_points(period, user_id)
+    categories = storage.category_totals(period, user_id)
+    assert total >= 10
+    assert points['amount'].sum() == total
+    assert sum(row[0] for row in categories) == total
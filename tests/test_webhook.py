@@ -0,0 +1,55 @@
+"""Прием обновлений через webhook: проверка секрета."""
+
+import json
+import urllib.error
+import urllib.request
+from typing import Optional
+
+import pytest
+from telebot import TeleBot
+
+from webhook import SECRET_HEADER, WebhookServer
+
+UPDATE = {'update_id': 1,
+          'message': {'message_id': 1, 'date': 0, 'text': 'Удалить',
+                      'chat': {'id': 1, 'type': 'private'}}}
+
+
+def post(server: WebhookServer, secret: Optional[str] = None) -> int:
+    """Код ответа сервера на обновление с заголовком secret."""
+    headers = {'Content-Type': 'application/json'}
+    if secret is not None:
+        headers[SECRET_HEADER] = secret
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{server.port}{server.path}',
+        data=json.dumps(UPDATE).encode(), headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+@pytest.fixture
+def server():
+    """Запущенный webhook на свободном порту."""
+    server = WebhookServer(TeleBot('0:test', threaded=False), port=0,
+                           secret='secret', workers=1)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        WebhookServer(TeleBot('0:test', threaded=False), port=0, secret='')
+
+
+def test_listens_on_localhost(server):
+    assert server.httpd.server_address[0] == '127.0.0.1'
+
+
+@pytest.mark.parametrize('secret, status', [
+    (None, 403), ('wrong', 403), ('secret', 200)])
+def test_update_needs_secret(server, secret, status):
+    assert post(server, secret) == status
@@ -0,0 +1,137 @@
+"""Код для приема обновлений Telegram через webhook."""
+
+import hmac
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from telebot import TeleBot, types
+
+from runtime import HANDLER_WORKERS, ChatQueues
+
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Снаружи сервер доступен через обратный прокси с HTTPS
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 64))
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 16))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 1))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Обработчик POST-запросов от Telegram."""
+
+    server: 'WebhookHTTPServer'
+
+    def do_POST(self) -> None:
+        """Прием одного обновления."""
+        webhook = self.server.webhook
+        if self.path != webhook.path:
+            return self.reply(404)
+        secret = self.headers.get(SECRET_HEADER, '').encode()
+        if not hmac.compare_digest(secret, webhook.secret.encode()):
+            return self.reply(403)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = types.Update.de_json(
+                json.loads(self.rfile.read(length)))
+        except (ValueError, TypeError, KeyError):
+            return self.reply(400)
+        # 503 - Telegram повторит доставку, когда очередь освободится
+        self.reply(200 if webhook.dispatch(update) else 503)
+
+    def reply(self, status: int) -> None:
+        """Пустой ответ с кодом status."""
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        """Запросы не пишутся в лог."""
+
+
+class WebhookHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер со ссылкой на WebhookServer."""
+
+    daemon_threads = True
+    request_queue_size = 256
+    webhook: 'WebhookServer'
+
+
+class WebhookServer:
+    """Локальный HTTP-сервер для обновлений с пулом обработчиков.
+
+    Обновления обрабатываются пулом ChatQueues: сообщения одного чата -
+    по порядку, пакетами до batch_size обновлений. Без секрета сервер
+    не запускается: иначе любой, кто видит порт, может прислать
+    обновление от имени любого чата.
+    """
+
+    def __init__(self, bot: TeleBot, host: str = WEBHOOK_HOST,
+                 port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                 secret: str = WEBHOOK_SECRET,
+                 workers: int = HANDLER_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 batch_size: int = WEBHOOK_BATCH_SIZE) -> None:
+        if not secret:
+            raise ValueError('Для webhook нужен WEBHOOK_SECRET')
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.handlers = ChatQueues(bot, workers, queue_size, batch_size,
+                                   name='webhook')
+        self.httpd = WebhookHTTPServer((host, port), WebhookHandler)
+        self.httpd.webhook = self
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        """Порт, на котором принимаются обновления."""
+        return self.httpd.server_address[1]
+
+    def dispatch(self, update: types.Update) -> bool:
+        """Постановка обновления в очередь (False - очередь заполнена)."""
+        if self.handlers.put(update, timeout=WEBHOOK_ENQUEUE_TIMEOUT):
+            return True
+        logging.warning(f'Очередь webhook заполнена, '
+                        f'обновление {update.update_id} отклонено')
+        return False
+
+    def start(self) -> None:
+        """Запуск обработчиков и HTTP-сервера в фоновых потоках."""
+        self.handlers.start()
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='webhook-http', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Остановка сервера после обработки принятых обновлений."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.handlers.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def run_webhook(bot: TeleBot,
+                server: Optional[WebhookServer] = None) -> None:
+    """Запуск бота в режиме webhook (по умолчанию с WebhookServer)."""
+    if server is None:
+        server = WebhookServer(bot)
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    server.start()
+    logging.info(f'Webhook принимает обновления на порту {server.port}')
+    try:
+        threading.Event().wait()
+    finally:
+        server.stop()
@@ -0,0 +1,115 @@
+"""Код для пакетной записи изменений в БД."""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from itertools import groupby
+from typing import List, Optional, Sequence, Tuple
+
+from database import ConnectionManager
+
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '0') == '1'
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 256))
+WRITE_MAX_LATENCY = float(os.getenv('WRITE_MAX_LATENCY', 0.005))
+
+Item = Tuple[str, Sequence, Future]
+
+
+class WriteQueue:
+    """Очередь изменений с одним потоком записи.
+
+    Изменения из очереди применяются пакетами до max_batch штук в одной
+    транзакции, подряд идущие одинаковые запросы - через executemany.
+    Пакет собирается не дольше max_latency секунд. Вызывающий поток
+    получает ответ только после фиксации транзакции.
+    """
+
+    def __init__(self, connections: ConnectionManager,
+                 max_batch: int = WRITE_BATCH_SIZE,
+                 max_latency: float = WRITE_MAX_LATENCY) -> None:
+        self.connections = connections
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Запуск потока записи."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        """Остановка потока записи после применения очереди."""
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+
+    def submit(self, sql: str, params: Sequence = ()) -> Future:
+        """Постановка изменения в очередь."""
+        self.start()
+        future: Future = Future()
+        self.queue.put((sql, params, future))
+        return future
+
+    def execute(self, sql: str, params: Sequence = ()) -> None:
+        """Выполнение изменения с ожиданием фиксации."""
+        self.submit(sql, params).result()
+
+    def run(self) -> None:
+        """Сбор пакетов изменений и их применение."""
+        with self.connections.writer() as con:
+            con.execute('PRAGMA synchronous = FULL')
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = (self.queue.get(timeout=timeout) if timeout > 0
+                            else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.apply(batch)
+
+    def apply(self, batch: List[Item]) -> None:
+        """Применение пакета в одной транзакции."""
+        try:
+            with self.connections.writer() as con:
+                for sql, items in groupby(batch, key=lambda item: item[0]):
+                    con.executemany(sql, [params for _, params, _ in items])
+        except Exception as error:
+            logging.warning(f'Ошибка пакетной записи, '
+                            f'изменения применяются по одному: {error}')
+            for item in batch:
+                self.apply_one(item)
+            return
+        for _, _, future in batch:
+            future.set_result(None)
+
+    def apply_one(self, item: Item) -> None:
+        """Применение одного изменения в отдельной транзакции."""
+        sql, params, future = item
+        try:
+            with self.connections.writer() as con:
+                con.execute(sql, params)
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)